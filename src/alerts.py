@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import queue
+import threading
+
+# --- CẤU HÌNH ---
+# Backend âm thanh cảnh báo: auto | winsound | bell | none (biến môi trường ANOMALY_ALERT)
+# auto: winsound trên Windows, chuông terminal nếu đang chạy trong terminal, còn lại tắt (server).
+ALERT_BACKEND = os.environ.get("ANOMALY_ALERT", "auto")
+ALERT_FREQ = 1000         # Hz
+ALERT_DURATION_MS = 200
+
+def _winsound_beep(freq, duration_ms):
+    import winsound
+    winsound.Beep(freq, duration_ms)
+
+def _bell_beep(freq, duration_ms):
+    sys.stdout.write("\a")
+    sys.stdout.flush()
+
+_BACKENDS = {"winsound": _winsound_beep, "bell": _bell_beep, "none": None}
+
+def resolve_alert_backend(name=ALERT_BACKEND):
+    if name != "auto":
+        if name not in _BACKENDS:
+            raise ValueError(f"Backend cảnh báo không hỗ trợ: {name} (chọn một trong {list(_BACKENDS)} hoặc auto)")
+        return name
+    if sys.platform == "win32":
+        return "winsound"
+    if sys.stdout is not None and sys.stdout.isatty():
+        return "bell"
+    return "none"
+
+class Alerter:
+    """
+    Phát tiếng cảnh báo KHÔNG chặn luồng gọi: một thread riêng phát lần lượt,
+    đang phát dở thì yêu cầu mới bị bỏ (winsound.Beep chặn suốt thời gian kêu).
+    """
+    def __init__(self, backend=ALERT_BACKEND):
+        self.name = resolve_alert_backend(backend)
+        self._beep = _BACKENDS[self.name]
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = None
+        self.played = 0
+        self.dropped = 0
+
+    def beep(self, freq=ALERT_FREQ, duration_ms=ALERT_DURATION_MS):
+        """Xếp một tiếng bíp. Trả về False nếu bị bỏ (đang kêu hoặc backend none)."""
+        if self._beep is None:
+            return False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((freq, duration_ms))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            freq, duration_ms = self._queue.get()
+            try:
+                self._beep(freq, duration_ms)
+                self.played += 1
+            except Exception as e:
+                print(f"[WARNING] Không phát được cảnh báo ({self.name}): {e}")
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_alerter():
+    """Alerter dùng chung của process (tạo khi cần)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Alerter()
+        return _default
+
+def beep(freq=ALERT_FREQ, duration_ms=ALERT_DURATION_MS):
+    return default_alerter().beep(freq, duration_ms)
+
+class AlertHooks:
+    """
+    Gọi các hook cảnh báo hook(event) (event: dict, vd. sự kiện bắt đầu/kết thúc bất thường) trên
+    một thread riêng, để hook chậm (gửi webhook, ghi file...) không làm chậm vòng xử lý frame.
+    Hàng đợi đầy (hook chậm hơn tốc độ sinh sự kiện) thì sự kiện mới bị bỏ và đếm vào dropped.
+    """
+    def __init__(self, hooks=(), maxsize=64):
+        self.hooks = list(hooks)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self.dispatched = 0
+        self.dropped = 0
+
+    def add(self, hook):
+        self.hooks.append(hook)
+
+    def __call__(self, event):
+        if not self.hooks:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            for hook in self.hooks:
+                try:
+                    hook(event)
+                except Exception as e:
+                    print(f"[WARNING] Hook cảnh báo {getattr(hook, '__name__', hook)} lỗi: {e}")
+            self.dispatched += 1
+            self._queue.task_done()
+
+    def flush(self, timeout=2.0):
+        """Chờ các sự kiện đã xếp hàng được xử lý xong (lúc thoát)."""
+        deadline = time.monotonic() + timeout
+        while self._thread is not None and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
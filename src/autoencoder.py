@@ -1,45 +1,53 @@
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, UpSampling2D, Input, BatchNormalization
 from tensorflow.keras.models import Model
+from tensorflow.keras.optimizers import Adam
 import numpy as np
 
-def build_autoencoder(input_shape=(128, 128, 1)):
+def build_autoencoder(input_shape=(128, 128, 1), learning_rate=1e-3, jit_compile=False, mixed_precision=False):
     """
     Xây dựng Convolutional Autoencoder.
-    Input: (128, 128, 1) -> Output: (128, 128, 1)
+    Input: (128, 128, C) -> Output: (128, 128, C)
+    C = T frame xám liên tiếp xếp theo channel (clips.py), C = 1 là model một frame.
+    - learning_rate: số hoặc LearningRateSchedule cho Adam.
+    - jit_compile: biên dịch train step bằng XLA.
+    - mixed_precision: các lớp ẩn tính bằng bfloat16 (trọng số vẫn float32), lớp output float32.
     """
+    # Chính sách dtype cho lớp ẩn (rỗng = float32 như cũ)
+    hidden = {"dtype": "mixed_bfloat16"} if mixed_precision else {}
+
     # --- ENCODER (Nén dữ liệu) ---
     input_img = Input(shape=input_shape)
     
     # Block 1: 128 -> 64
-    x = Conv2D(32, (3, 3), activation='relu', padding='same')(input_img)
-    x = BatchNormalization()(x)
-    x = MaxPooling2D((2, 2), padding='same')(x)
+    x = Conv2D(32, (3, 3), activation='relu', padding='same', **hidden)(input_img)
+    x = BatchNormalization(**hidden)(x)
+    x = MaxPooling2D((2, 2), padding='same', **hidden)(x)
     
     # Block 2: 64 -> 32
-    x = Conv2D(16, (3, 3), activation='relu', padding='same')(x)
-    x = BatchNormalization()(x)
-    encoded = MaxPooling2D((2, 2), padding='same')(x)
+    x = Conv2D(16, (3, 3), activation='relu', padding='same', **hidden)(x)
+    x = BatchNormalization(**hidden)(x)
+    encoded = MaxPooling2D((2, 2), padding='same', **hidden)(x)
 
     # --- DECODER (Tái tạo dữ liệu) ---
     
     # Block 3: 32 -> 64
-    x = Conv2D(16, (3, 3), activation='relu', padding='same')(encoded)
-    x = BatchNormalization()(x)
-    x = UpSampling2D((2, 2))(x)
+    x = Conv2D(16, (3, 3), activation='relu', padding='same', **hidden)(encoded)
+    x = BatchNormalization(**hidden)(x)
+    x = UpSampling2D((2, 2), **hidden)(x)
     
     # Block 4: 64 -> 128
-    x = Conv2D(32, (3, 3), activation='relu', padding='same')(x)
-    x = BatchNormalization()(x)
-    x = UpSampling2D((2, 2))(x)
+    x = Conv2D(32, (3, 3), activation='relu', padding='same', **hidden)(x)
+    x = BatchNormalization(**hidden)(x)
+    x = UpSampling2D((2, 2), **hidden)(x)
     
     # Output Layer: Trả về ảnh gốc (dùng Sigmoid để giá trị về 0-1)
-    decoded = Conv2D(1, (3, 3), activation='sigmoid', padding='same')(x)
+    decoded = Conv2D(input_shape[-1], (3, 3), activation='sigmoid', padding='same', dtype="float32")(x)
 
     # Tạo Model
     autoencoder = Model(input_img, decoded)
     
     # Compile Model (Dùng MSE Loss để đo độ sai lệch giữa ảnh gốc và ảnh tái tạo)
-    autoencoder.compile(optimizer='adam', loss='mse')
+    autoencoder.compile(optimizer=Adam(learning_rate=learning_rate), loss='mse', jit_compile=jit_compile)
     
     return autoencoder
 
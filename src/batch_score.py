@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+from frame_source import open_source, iter_scheduled, list_images, preprocess_key
+from dataset import source_signature
+from inference import load_backend, resolve_backend, artifact_path, BACKEND
+from clips import ClipBuffer, clip_length_of
+from score_cache import ScoreRecord, file_hash, cache_key
+
+# --- CẤU HÌNH ---
+MODEL_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
+THRESHOLD_PATH = os.path.join("outputs", "models", "threshold.txt")
+DATA_ROOT = os.path.join("data", "ucsd", "test")
+
+# Kết quả mỗi lần chấm một cây thư mục: BATCH_DIR/<tên thư mục>/{manifest.jsonl, summary.json, scores/...}
+BATCH_DIR = os.path.join("outputs", "batch_scores")
+MANIFEST_NAME = "manifest.jsonl"
+SUMMARY_NAME = "summary.json"
+
+# Mỗi process tải model riêng và chấm trọn một file (video hoặc folder ảnh)
+BATCH_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+INFER_BATCH_SIZE = 16
+SKIP_FRAMES = 0             # 0 = chấm mọi frame; k = chạy model 1 trên k+1 frame
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mkv")
+
+DONE, FAILED = "done", "failed"
+
+_backend = None   # Model của process worker (tải một lần trong _init_worker)
+
+def discover(root):
+    """
+    Các mục cần chấm trong cây thư mục: file video và folder ảnh kiểu UCSD (bỏ folder *_gt).
+    Trả về danh sách đường dẫn đã sắp xếp.
+    """
+    if os.path.isfile(root):
+        return [root]
+    items = []
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames[:] = sorted(d for d in dirnames if not d.endswith("_gt"))
+        if list_images(dirpath):
+            items.append(dirpath)
+        items.extend(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(VIDEO_EXTENSIONS))
+    return sorted(items)
+
+def item_name(root, path):
+    """Tên mục trong manifest: đường dẫn tương đối so với root (root là một mục thì lấy tên của nó)."""
+    rel = os.path.relpath(path, root)
+    return os.path.basename(os.path.abspath(path)) if rel == "." else rel.replace(os.sep, "/")
+
+def item_key(path, model_version, config):
+    """Khoá kết quả: nội dung nguồn (mtime/size từng file) + model + cấu hình chấm. Khác khoá -> chấm lại."""
+    sig = hashlib.sha1(json.dumps(source_signature(path)).encode("utf-8")).hexdigest()
+    return cache_key(sig, model_version, config)
+
+def load_manifest(path):
+    """Bản ghi cuối cùng của từng mục trong manifest (JSONL, chỉ ghi nối thêm). Dòng hỏng bị bỏ qua."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Dòng cuối bị cắt khi dừng giữa chừng
+            records[record["item"]] = record
+    return records
+
+def _init_worker(backend_name, model_path):
+    global _backend
+    cv2.setNumThreads(1)   # Song song theo file; thread pool của OpenCV chỉ tranh core
+    _backend = load_backend(backend_name, model_path)
+
+def _flush(batch, window, record):
+    # Một lần forward cho các frame chấm trong cửa sổ, ghi điểm theo đúng thứ tự frame
+    errors = iter(np.mean(np.square(batch - _backend.predict(batch)), axis=(1, 2, 3)) if len(batch) else ())
+    for scored in window:
+        if scored:
+            record.add(True, float(next(errors)))
+        else:
+            record.add(False)
+
+def score_item(path, out_path, threshold, skip=SKIP_FRAMES, batch_size=INFER_BATCH_SIZE):
+    """
+    Chấm một video / folder ảnh (chạy trong worker). Lưu ScoreRecord (.npz, như score cache của gradio_app)
+    vào out_path và trả về thống kê của mục.
+    """
+    t0 = time.perf_counter()
+    step = skip + 1
+    clip_length = clip_length_of(_backend)
+    clips = ClipBuffer(clip_length) if clip_length > 1 else None
+    batch = np.empty((batch_size, 128, 128, clip_length), dtype=np.float32)
+    record = ScoreRecord()
+    window, n = [], 0
+    with open_source(path) as source:
+        # Model clip cần mọi frame đã tiền xử lý; model 1 frame chỉ giải mã frame đến lượt chấm
+        should_score = (lambda i: True) if clips is not None else (lambda i: i % step == 0)
+        for i, gray in iter_scheduled(source, should_score):
+            scored = i % step == 0
+            if clips is not None:
+                clips.push(np.divide(gray, 255.0, dtype=np.float32))
+                if scored: batch[n] = clips.clip()
+            elif scored:
+                np.divide(gray, 255.0, out=batch[n, :, :, 0], dtype=np.float32)
+            n += scored
+            window.append(scored)
+            if n == batch_size:
+                _flush(batch, window, record)
+                window, n = [], 0
+        _flush(batch[:n], window, record)
+        fps, size = source.fps, source.size
+    if not len(record):
+        raise ValueError("Không đọc được frame nào")
+
+    labels, _, _ = record.labels(threshold)
+    mse = np.asarray(record.mse, dtype=np.float32)
+    scored = int(np.sum(record.scored))
+    record.meta = {"frames": len(record), "scored": scored, "fps": fps, "size": list(size), "skip": skip,
+                   "threshold": threshold}
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    record.save(out_path)
+    seconds = time.perf_counter() - t0
+    return {"frames": len(record), "scored": scored, "seconds": round(seconds, 3),
+            "fps": round(len(record) / seconds, 2), "anomalies": int(labels.sum()),
+            "max_mse": round(float(mse.max()), 6)}
+
+def run(root, out_dir=None, backend_name=BACKEND, workers=BATCH_WORKERS, skip=SKIP_FRAMES,
+        batch_size=INFER_BATCH_SIZE, threshold=None, retry_failed=False):
+    """
+    Chấm mọi video / folder ảnh dưới root trên một pool process, ghi manifest sau MỖI mục
+    (chạy lại sẽ bỏ qua các mục đã xong với cùng nội dung, model và cấu hình).
+    Trả về dict báo cáo (cũng lưu ở <out_dir>/summary.json).
+    """
+    if threshold is None:
+        if not os.path.exists(THRESHOLD_PATH):
+            print("[ERROR] Chưa có file ngưỡng (threshold.txt). Chạy evaluate.py trước!")
+            return None
+        with open(THRESHOLD_PATH, "r") as f:
+            threshold = float(f.read())
+    name = resolve_backend(backend_name, MODEL_PATH)
+    model_file = artifact_path(MODEL_PATH, name)
+    if not os.path.exists(model_file):
+        print(f"[ERROR] Không tìm thấy model cho backend '{name}': {model_file}")
+        return None
+    model_version = file_hash(model_file)
+    config = {"backend": name, "skip": skip, "preprocess": preprocess_key()}
+
+    out_dir = out_dir or os.path.join(BATCH_DIR, os.path.basename(os.path.abspath(root)))
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    items = discover(root)
+    print(f"[DATA] {len(items)} mục (video / folder ảnh) dưới {root}")
+    todo, skipped = [], 0
+    for path in items:
+        rel = item_name(root, path)
+        key = item_key(path, model_version, config)
+        last = manifest.get(rel)
+        if last is not None and last.get("key") == key:
+            if last["status"] == DONE and os.path.exists(os.path.join(out_dir, last["output"])):
+                skipped += 1
+                continue
+            if last["status"] == FAILED and not retry_failed:
+                skipped += 1
+                continue
+        todo.append((path, rel, key, os.path.join("scores", rel + ".npz")))
+    print(f"[INFO] Cần chấm {len(todo)} mục, bỏ qua {skipped} mục đã có trong manifest "
+          f"(backend {name}, ngưỡng {threshold:.5f}, skip {skip})")
+
+    start = time.perf_counter()
+    run_stats = {"items": 0, "failed": 0, "frames": 0, "scored": 0}
+    workers = max(1, min(workers, len(todo)))
+    interrupted = False
+    with open(manifest_path, "a", encoding="utf-8") as log:
+        def record(rel, key, output, result=None, error=None):
+            entry = {"item": rel, "key": key, "time": round(time.time(), 3)}
+            if error is None:
+                entry.update(status=DONE, output=output.replace(os.sep, "/"), **result)
+                run_stats["frames"] += result["frames"]
+                run_stats["scored"] += result["scored"]
+                print(f"[{run_stats['items'] + 1}/{len(todo)}] {rel}: {result['frames']} frames, "
+                      f"{result['fps']:.1f} FPS, {result['anomalies']} frame bất thường")
+            else:
+                entry.update(status=FAILED, error=error)
+                run_stats["failed"] += 1
+                print(f"[ERROR] [{run_stats['items'] + 1}/{len(todo)}] {rel}: {error}")
+            run_stats["items"] += 1
+            manifest[rel] = entry
+            # Ghi ngay (mỗi mục một dòng) để dừng giữa chừng vẫn giữ được các mục đã xong
+            log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            log.flush()
+
+        try:
+            if workers == 1:
+                # Tuần tự trong process hiện tại (không tốn thời gian khởi động pool)
+                if todo: _init_worker(name, MODEL_PATH)
+                for path, rel, key, output in todo:
+                    try:
+                        result = score_item(path, os.path.join(out_dir, output), threshold, skip, batch_size)
+                        record(rel, key, output, result)
+                    except Exception as e:
+                        record(rel, key, output, error=f"{type(e).__name__}: {e}")
+            else:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(name, MODEL_PATH)) as pool:
+                    futures = {pool.submit(score_item, path, os.path.join(out_dir, output), threshold, skip,
+                                           batch_size): (rel, key, output)
+                               for path, rel, key, output in todo}
+                    try:
+                        for fut in as_completed(futures):
+                            rel, key, output = futures[fut]
+                            try:
+                                record(rel, key, output, fut.result())
+                            except Exception as e:
+                                record(rel, key, output, error=f"{type(e).__name__}: {e}")
+                    except KeyboardInterrupt:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise
+        except KeyboardInterrupt:
+            interrupted = True
+            print("\n[WARNING] Dừng giữa chừng. Chạy lại cùng lệnh để tiếp tục từ các mục chưa xong.")
+
+    wall = time.perf_counter() - start
+    entries = [manifest[item_name(root, p)] for p in items if item_name(root, p) in manifest]
+    done = [e for e in entries if e["status"] == DONE]
+    failed = [e for e in entries if e["status"] == FAILED]
+    summary = {
+        "root": os.path.abspath(root), "backend": name, "model": model_version, "threshold": threshold,
+        "skip": skip, "workers": workers, "interrupted": interrupted,
+        "items": len(items), "done": len(done), "failed": len(failed), "pending": len(items) - len(entries),
+        "run": {"items": run_stats["items"], "failed": run_stats["failed"], "frames": run_stats["frames"],
+                "scored_frames": run_stats["scored"], "wall_s": round(wall, 3),
+                "fps": round(run_stats["frames"] / wall, 2) if wall > 0 else 0.0,
+                "scored_fps": round(run_stats["scored"] / wall, 2) if wall > 0 else 0.0},
+        "total_frames": sum(e["frames"] for e in done),
+        "anomalous": sorted(({"item": e["item"], "anomalies": e["anomalies"], "frames": e["frames"],
+                              "max_mse": e["max_mse"], "output": e["output"]}
+                             for e in done if e["anomalies"]), key=lambda e: -e["anomalies"] / e["frames"]),
+        "failures": [{"item": e["item"], "error": e["error"]} for e in failed],
+    }
+    with open(os.path.join(out_dir, SUMMARY_NAME), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+    run_info = summary["run"]
+    print(f"\n[KẾT QUẢ] Lần chạy này: {run_info['items']} mục, {run_info['frames']} frames trong "
+          f"{run_info['wall_s']:.2f}s -> {run_info['fps']:.1f} FPS tổng ({workers} process)")
+    print(f"[KẾT QUẢ] Toàn bộ: {len(done)}/{len(items)} mục xong, {len(failed)} lỗi, "
+          f"{len(summary['anomalous'])} mục có frame bất thường")
+    print(f"[INFO] Báo cáo: {os.path.join(out_dir, SUMMARY_NAME)} | Manifest: {manifest_path}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chấm điểm bất thường cho cả cây thư mục video / folder ảnh "
+                                                 "(chạy lại để tiếp tục lần chạy bị dừng)")
+    parser.add_argument("root", nargs="?", default=DATA_ROOT, help="Thư mục gốc (hoặc một video)")
+    parser.add_argument("--out", help=f"Thư mục kết quả (mặc định {BATCH_DIR}/<tên root>)")
+    parser.add_argument("--backend", default=BACKEND, help="keras | savedmodel | tflite | tflite_int8 | onnx | auto")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Số process (mỗi process một model)")
+    parser.add_argument("--skip", type=int, default=SKIP_FRAMES, help="Chạy model 1 trên skip+1 frame")
+    parser.add_argument("--batch-size", type=int, default=INFER_BATCH_SIZE)
+    parser.add_argument("--threshold", type=float, help="Ngưỡng MSE (mặc định đọc threshold.txt)")
+    parser.add_argument("--retry-failed", action="store_true", help="Chấm lại các mục lỗi ở lần chạy trước")
+    args = parser.parse_args()
+    run(args.root, args.out, args.backend, args.workers, args.skip, args.batch_size, args.threshold,
+        args.retry_failed)
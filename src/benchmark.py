@@ -0,0 +1,444 @@
+import cv2
+import numpy as np
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import platform
+from dataset import preprocess_frame
+from frame_source import VideoSource, ImageFolderSource, iter_scheduled
+import shm_ring
+from inference import load_backend, make_predict_fn, artifact_path, BACKEND
+from localization import contour_boxes, BlockLocalizer
+from clips import ClipBuffer, clip_length_of
+from video_writer import FFmpegWriter, open_writer, add_alert_audio, ffmpeg_exe
+
+# --- CẤU HÌNH ---
+MODEL_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
+BENCH_DIR = os.path.join("outputs", "benchmarks")
+SYNTH_DIR = os.path.join(BENCH_DIR, "synthetic")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 720)]
+DECODE_WORKERS = sorted({1, shm_ring.DECODE_WORKERS})   # Giải mã đa process qua shared memory
+LENGTHS = [60, 240]
+BATCH_SIZES = [1, 8, 32]
+SKIP_RATES = [0, 2, 5]
+QUICK = {"resolutions": [(320, 240)], "lengths": [60], "batch_sizes": [1, 16], "skip_rates": [2]}
+
+FPS = 24.0
+# Chậm hơn baseline quá tỉ lệ này (và quá NOISE_FLOOR_MS) thì báo regression
+REGRESSION_TOLERANCE = 0.20
+NOISE_FLOOR_MS = 0.05
+
+STAGES = ["decode", "preprocess", "forward", "localize", "overlay", "encode"]
+
+class _InMemoryBackend:
+    """Model chưa train (trọng số ngẫu nhiên) khi chưa có file model: chỉ để đo thời gian."""
+    name = "keras-untrained"
+
+    def __init__(self):
+        from autoencoder import build_autoencoder
+        model = build_autoencoder()
+        self.input_shape = tuple(model.input_shape[1:])
+        self.predict = make_predict_fn(model)
+
+def get_backend(name):
+    if os.path.exists(artifact_path(MODEL_PATH, name)):
+        return load_backend(name, MODEL_PATH)
+    print(f"[WARNING] Không có model cho backend '{name}', dùng model chưa train.")
+    return _InMemoryBackend()
+
+# --- DỮ LIỆU GIẢ LẬP ---
+
+def _synthetic_frame(i, size, rng_noise):
+    w, h = size
+    frame = np.full((h, w, 3), 90, dtype=np.uint8)
+    frame += rng_noise[:h, :w]
+    # Một "người đi bộ" di chuyển ngang và một vật thể lạ ở nửa sau video
+    x = int((i * 4) % max(w - 40, 1))
+    cv2.rectangle(frame, (x, h // 3), (x + 30, h // 3 + 80), (200, 200, 200), -1)
+    if i % 100 > 50:
+        cv2.circle(frame, (w - x - 20, 2 * h // 3), 25, (30, 30, 220), -1)
+    return frame
+
+def make_synthetic_video(size, length):
+    """Tạo (nếu chưa có) video .avi giả lập với kích thước và số frame cho trước."""
+    path = os.path.join(SYNTH_DIR, f"synthetic_{size[0]}x{size[1]}_{length}.avi")
+    if os.path.exists(path):
+        return path
+    os.makedirs(SYNTH_DIR, exist_ok=True)
+    noise = np.random.RandomState(0).randint(0, 20, (size[1], size[0], 3)).astype(np.uint8)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), FPS, size)
+    for i in range(length):
+        out.write(_synthetic_frame(i, size, noise))
+    out.release()
+    return path
+
+def make_synthetic_images(size, length):
+    """Tạo (nếu chưa có) folder chuỗi ảnh .tif giả lập (kiểu UCSD)."""
+    folder = os.path.join(SYNTH_DIR, f"synthetic_{size[0]}x{size[1]}_{length}_tif")
+    if os.path.isdir(folder):
+        return folder
+    os.makedirs(folder, exist_ok=True)
+    noise = np.random.RandomState(0).randint(0, 20, (size[1], size[0], 3)).astype(np.uint8)
+    for i in range(length):
+        gray = cv2.cvtColor(_synthetic_frame(i, size, noise), cv2.COLOR_BGR2GRAY)
+        cv2.imwrite(os.path.join(folder, f"{i:03d}.tif"), gray)
+    return folder
+
+# --- ĐO TỪNG STAGE ---
+
+def run_pipeline(video_path, backend, batch_size, skip, out_path):
+    """
+    Chạy lại vòng lặp của process_video (decode -> preprocess -> forward theo batch
+    -> localize -> overlay -> encode) và cộng dồn thời gian từng stage.
+    Localize chạy trên mọi frame được chấm điểm (trường hợp xấu nhất).
+    Model clip (T > 1): mọi frame đều được tiền xử lý để đưa vào ClipBuffer.
+    """
+    timers = dict.fromkeys(STAGES, 0.0)
+    cap = cv2.VideoCapture(video_path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    out = open_writer(out_path, FPS, (width, height))
+    scale_x, scale_y = width / 128, height / 128
+    localizer = BlockLocalizer()
+    clip_length = clip_length_of(backend)
+    clips = ClipBuffer(clip_length) if clip_length > 1 else None
+    frames = scored = 0
+    boxes = []
+    mse = 0.0
+    start = time.perf_counter()
+    while True:
+        window, inputs = [], []
+        while len(inputs) < batch_size:
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            timers["decode"] += time.perf_counter() - t0
+            if not ret: break
+            is_scored = (frames + len(window)) % (skip + 1) == 0
+            if clips is not None:
+                t0 = time.perf_counter()
+                clips.push(preprocess_frame(frame))
+                if is_scored: inputs.append(clips.clip().copy())
+                timers["preprocess"] += time.perf_counter() - t0
+            elif is_scored:
+                t0 = time.perf_counter()
+                inputs.append(preprocess_frame(frame)[..., np.newaxis])
+                timers["preprocess"] += time.perf_counter() - t0
+            window.append((frame, is_scored))
+        if not window: break
+
+        if inputs:
+            t0 = time.perf_counter()
+            batch = np.stack(inputs)
+            reconstructed = backend.predict(batch)
+            timers["forward"] += time.perf_counter() - t0
+            scored += len(inputs)
+        k = 0
+        for frame, is_scored in window:
+            if is_scored:
+                t0 = time.perf_counter()
+                diff = np.abs(batch[k] - reconstructed[k])
+                mse = float(np.mean(np.square(diff)))
+                boxes = localizer(diff[:, :, -1], scale_x, scale_y)
+                timers["localize"] += time.perf_counter() - t0
+                k += 1
+            t0 = time.perf_counter()
+            for (x, y, w, h) in boxes:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+            cv2.rectangle(frame, (0, 0), (width, 40), (0, 0, 0), -1)
+            cv2.putText(frame, f"CANH BAO! | MSE: {mse:.4f}", (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+            timers["overlay"] += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            out.write(frame)
+            timers["encode"] += time.perf_counter() - t0
+            frames += 1
+    cap.release()
+    t0 = time.perf_counter()
+    out.release()
+    timers["encode"] += time.perf_counter() - t0
+    wall = time.perf_counter() - start
+    return timers, frames, scored, wall
+
+def time_image_decode(folder):
+    """Thời gian cv2.imread + preprocess cho chuỗi ảnh (UCSD)."""
+    paths = sorted(os.listdir(folder))
+    t0 = time.perf_counter()
+    for name in paths:
+        preprocess_frame(cv2.imread(os.path.join(folder, name)))
+    return time.perf_counter() - t0, len(paths)
+
+def _legacy_preprocess(frame):
+    """Tiền xử lý cũ: cvtColor cả frame rồi resize, mảng mới mỗi frame."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return cv2.resize(gray, (128, 128)).astype("float32") / 255.0
+
+def time_frame_source(video_path, folder, skip):
+    """
+    Đọc + tiền xử lý theo lịch 1 trên skip+1 frame (không render):
+    - legacy: giải mã màu MỌI frame, tiền xử lý frame được chấm (cách cũ);
+    - source: frame_source (grab() frame bỏ qua, ảnh xám thu nhỏ vào buffer dùng lại).
+    Trả về {tên stage: (giây, số frame được chấm)}.
+    """
+    should_score = lambda i: i % (skip + 1) == 0
+    timed = {}
+    t0 = time.perf_counter()
+    cap, i, n = cv2.VideoCapture(video_path), 0, 0
+    while True:
+        ret, frame = cap.read()
+        if not ret: break
+        if should_score(i):
+            _legacy_preprocess(frame)
+            n += 1
+        i += 1
+    cap.release()
+    timed["frames_video_legacy"] = (time.perf_counter() - t0, n)
+
+    t0 = time.perf_counter()
+    with VideoSource(video_path) as source:
+        n = sum(gray is not None for _, gray in iter_scheduled(source, should_score))
+    timed["frames_video_source"] = (time.perf_counter() - t0, n)
+
+    t0 = time.perf_counter()
+    paths, n = sorted(os.listdir(folder)), 0
+    for i, name in enumerate(paths):
+        frame = cv2.imread(os.path.join(folder, name))
+        if should_score(i):
+            _legacy_preprocess(frame)
+            n += 1
+    timed["frames_images_legacy"] = (time.perf_counter() - t0, n)
+
+    t0 = time.perf_counter()
+    with ImageFolderSource(folder) as source:
+        n = sum(gray is not None for _, gray in iter_scheduled(source, should_score))
+    timed["frames_images_source"] = (time.perf_counter() - t0, n)
+
+    # Giải mã + tiền xử lý trên nhiều process, frame qua shared memory (gồm cả thời gian khởi động worker)
+    for workers in DECODE_WORKERS:
+        timed[f"frames_video_shm{workers}"] = shm_ring.measure(video_path, workers, skip)
+        timed[f"frames_images_shm{workers}"] = shm_ring.measure(folder, workers, skip)
+    return timed
+
+def time_localization(video_path):
+    """
+    So sánh định vị trên cùng chuỗi bản đồ sai khác (|frame - frame trước| ở 128x128):
+    contour_boxes (ngưỡng + findContours) vs. BlockLocalizer (khối + EMA + gộp vùng).
+    Trả về (contour_s, block_s, frames).
+    """
+    cap = cv2.VideoCapture(video_path)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    scale_x, scale_y = size[0] / 128, size[1] / 128
+    diffs, prev = [], None
+    while True:
+        ret, frame = cap.read()
+        if not ret: break
+        cur = preprocess_frame(frame)
+        if prev is not None:
+            diffs.append(np.abs(cur - prev))
+        prev = cur
+    cap.release()
+    t0 = time.perf_counter()
+    for diff in diffs:
+        contour_boxes(diff, scale_x, scale_y)
+    contour = time.perf_counter() - t0
+    localizer = BlockLocalizer()
+    t0 = time.perf_counter()
+    for diff in diffs:
+        localizer(diff, scale_x, scale_y)
+    return contour, time.perf_counter() - t0, len(diffs)
+
+def _synthetic_timeline(length):
+    return [i % 100 > 50 for i in range(length)]
+
+def time_output(video_path, out_dir, single_pass):
+    """
+    Thời gian ghi video kết quả + chèn âm thanh cảnh báo (không tính decode).
+    - single_pass=False: cv2.VideoWriter (mp4v) rồi moviepy encode lại cả video (cách cũ).
+    - single_pass=True: pipe frame vào ffmpeg/libx264, ghép PCM với -c:v copy (gradio_app hiện tại).
+    Trả về (encode_s, audio_s, frames) hoặc None nếu thiếu moviepy/ffmpeg.
+    """
+    if single_pass:
+        if ffmpeg_exe() is None:
+            return None
+    else:
+        try:
+            from moviepy.editor import VideoFileClip, AudioClip
+        except ImportError:
+            return None
+    tag = "single_pass" if single_pass else "legacy"
+    silent = os.path.join(out_dir, f"bench_{tag}_silent.mp4")
+    final = os.path.join(out_dir, f"bench_{tag}_final.mp4")
+    cap = cv2.VideoCapture(video_path)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    if single_pass:
+        out = FFmpegWriter(silent, FPS, size)
+    else:
+        out = cv2.VideoWriter(silent, cv2.VideoWriter_fourcc(*"mp4v"), FPS, size)
+    encode = 0.0
+    frames = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret: break
+        t0 = time.perf_counter()
+        out.write(frame)
+        encode += time.perf_counter() - t0
+        frames += 1
+    t0 = time.perf_counter()
+    out.release()
+    encode += time.perf_counter() - t0
+    cap.release()
+
+    timeline = np.array(_synthetic_timeline(frames))
+    t0 = time.perf_counter()
+    if single_pass:
+        add_alert_audio(silent, final, timeline, FPS)
+    else:
+        def make_audio(t):
+            t = np.asanyarray(t)
+            mask = timeline[np.clip((t * FPS).astype(int), 0, len(timeline) - 1)]
+            audio = np.where(mask, np.sin(2 * np.pi * 800 * t), 0.0)
+            return float(audio) if t.ndim == 0 else audio
+        clip = VideoFileClip(silent)
+        clip.set_audio(AudioClip(make_audio, duration=clip.duration)).write_videofile(
+            final, codec="libx264", audio_codec="aac", logger=None)
+        clip.close()
+    return encode, time.perf_counter() - t0, frames
+
+def run_benchmarks(backend, resolutions, lengths, batch_sizes, skip_rates, with_audio=True):
+    results = []
+    tmp_out = os.path.join(SYNTH_DIR, "bench_out.mp4")
+
+    def add(config, stage, seconds, frames):
+        results.append(dict(config, stage=stage, total_s=round(seconds, 6), frames=frames,
+                            ms_per_frame=round(seconds * 1000 / max(frames, 1), 4)))
+
+    # Warm-up (biên dịch graph) để không tính vào lần đo đầu tiên
+    backend.predict(np.zeros((1,) + tuple(backend.input_shape), dtype=np.float32))
+
+    for size in resolutions:
+        for length in lengths:
+            video = make_synthetic_video(size, length)
+            base = {"resolution": f"{size[0]}x{size[1]}", "length": length}
+            print(f"[BENCH] {base['resolution']} x {length} frames")
+
+            images = make_synthetic_images(size, length)
+            seconds, n = time_image_decode(images)
+            add(dict(base, batch_size=0, skip=0), "decode_images", seconds, n)
+
+            # Đọc + tiền xử lý frame được chấm: cách cũ vs. frame_source (grab + ảnh xám thu nhỏ)
+            for skip in skip_rates:
+                timed = time_frame_source(video, images, skip)
+                for stage, (seconds, n) in timed.items():
+                    add(dict(base, batch_size=0, skip=skip), stage, seconds, n)
+                per = {stage: seconds * 1000 / max(n, 1) for stage, (seconds, n) in timed.items()}
+                print(f"  Đọc frame skip={skip}: video {per['frames_video_legacy']:.2f} -> "
+                      f"{per['frames_video_source']:.2f} ms/frame chấm, ảnh {per['frames_images_legacy']:.2f} -> "
+                      f"{per['frames_images_source']:.2f} ms/frame chấm")
+                for workers in DECODE_WORKERS:
+                    print(f"    {workers} process (shared memory): video {per[f'frames_video_shm{workers}']:.2f}, "
+                          f"ảnh {per[f'frames_images_shm{workers}']:.2f} ms/frame chấm")
+
+            contour, block, n = time_localization(video)
+            add(dict(base, batch_size=0, skip=0), "localize_contour", contour, n)
+            add(dict(base, batch_size=0, skip=0), "localize_block", block, n)
+            print(f"  Định vị: contour {contour * 1000 / max(n, 1):.3f} ms/frame, "
+                  f"khối {block * 1000 / max(n, 1):.3f} ms/frame")
+
+            for batch_size in batch_sizes:
+                for skip in skip_rates:
+                    config = dict(base, batch_size=batch_size, skip=skip)
+                    timers, frames, scored, wall = run_pipeline(video, backend, batch_size, skip, tmp_out)
+                    for stage in STAGES:
+                        # forward/localize/preprocess tính trên frame được chấm điểm
+                        n = scored if stage in ("preprocess", "forward", "localize") else frames
+                        add(config, stage, timers[stage], n)
+                    add(config, "end_to_end", wall, frames)
+                    print(f"  batch={batch_size:<3} skip={skip}: {frames / wall:7.1f} FPS "
+                          f"(forward {timers['forward'] * 1000 / max(scored, 1):.2f} ms/frame)")
+
+            if with_audio:
+                # Hậu kỳ (ghi video + âm thanh): moviepy encode lại vs. ghi 1 lần + ghép -c:v copy
+                totals = {}
+                for single_pass in (False, True):
+                    timed = time_output(video, SYNTH_DIR, single_pass)
+                    if timed is None: continue
+                    encode, audio, n = timed
+                    tag = "single_pass" if single_pass else "legacy"
+                    add(dict(base, batch_size=0, skip=0), f"encode_{tag}", encode, n)
+                    add(dict(base, batch_size=0, skip=0), f"audio_mux_{tag}", audio, n)
+                    totals[tag] = encode + audio
+                if len(totals) == 2:
+                    print(f"  Ghi video + âm thanh: {totals['legacy']:.2f}s (moviepy) -> "
+                          f"{totals['single_pass']:.2f}s (1 lần encode), "
+                          f"tiết kiệm {totals['legacy'] - totals['single_pass']:.2f}s")
+    return results
+
+# --- LƯU KẾT QUẢ & SO SÁNH BASELINE ---
+
+def _key(r):
+    return (r["resolution"], r["length"], r["batch_size"], r["skip"], r["stage"])
+
+def save_results(results, backend_name, out_dir=BENCH_DIR):
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    meta = {"timestamp": stamp, "backend": backend_name, "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "opencv": cv2.__version__}
+    json_path = os.path.join(out_dir, f"results_{stamp}.json")
+    with open(json_path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    csv_path = os.path.join(out_dir, f"results_{stamp}.csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    shutil.copyfile(json_path, os.path.join(out_dir, "latest.json"))
+    print(f"[INFO] Đã lưu kết quả: {json_path} / {csv_path}")
+    return json_path
+
+def compare_baseline(results, baseline_path=BASELINE_PATH):
+    """In so sánh với baseline, trả về danh sách các stage bị chậm đi."""
+    if not os.path.exists(baseline_path):
+        print("[INFO] Chưa có baseline (chạy với --save-baseline để tạo).")
+        return []
+    with open(baseline_path) as f:
+        baseline = {_key(r): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        old = baseline.get(_key(r))
+        if old is None: continue
+        delta = r["ms_per_frame"] - old["ms_per_frame"]
+        if delta > NOISE_FLOOR_MS and r["ms_per_frame"] > old["ms_per_frame"] * (1 + REGRESSION_TOLERANCE):
+            regressions.append((r, old))
+    for r, old in regressions:
+        print(f"[REGRESSION] {'/'.join(str(v) for v in _key(r))}: "
+              f"{old['ms_per_frame']:.3f} -> {r['ms_per_frame']:.3f} ms/frame")
+    print(f"[INFO] So với baseline: {len(regressions)} regression")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark từng stage của pipeline phát hiện bất thường")
+    parser.add_argument("--backend", default=BACKEND)
+    parser.add_argument("--quick", action="store_true", help="Ma trận nhỏ để chạy nhanh")
+    parser.add_argument("--no-audio", action="store_true", help="Bỏ qua đo ghi video + chèn âm thanh")
+    parser.add_argument("--save-baseline", action="store_true", help="Lưu kết quả làm baseline mới")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    matrix = QUICK if args.quick else {"resolutions": RESOLUTIONS, "lengths": LENGTHS,
+                                       "batch_sizes": BATCH_SIZES, "skip_rates": SKIP_RATES}
+    backend = get_backend(args.backend)
+    results = run_benchmarks(backend, with_audio=not args.no_audio, **matrix)
+    json_path = save_results(results, getattr(backend, "name", args.backend))
+    if args.save_baseline:
+        shutil.copyfile(json_path, args.baseline)
+        print(f"[INFO] Đã cập nhật baseline: {args.baseline}")
+        return 0
+    return 1 if compare_baseline(results, args.baseline) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Chế độ clip: model nhận T frame liên tiếp xếp theo channel (H, W, T), frame mới nhất ở cuối.
+# T = 1 là model một frame như cũ. T được suy ra từ số channel input của model.
+
+def clip_length_of(backend):
+    """Số frame T của một clip theo input của backend/model (channel cuối)."""
+    return int(backend.input_shape[-1])
+
+def clip_windows(frames, length):
+    """
+    Cửa sổ trượt T frame trên mảng (N, H, W) -> view (N - T + 1, H, W, T), KHÔNG copy
+    (với memmap cache, dữ liệu chỉ được đọc khi lấy từng mẫu).
+    """
+    if len(frames) < length:
+        return np.empty((0,) + frames.shape[1:] + (length,), dtype=frames.dtype)
+    return sliding_window_view(frames, length, axis=0)
+
+def gather_clips(frames, indices, length):
+    """
+    Clip (n, H, W, T) kết thúc tại các frame `indices` của mảng (N, H, W).
+    Đầu video được đệm bằng frame đầu tiên (giống ClipBuffer).
+    """
+    idx = np.maximum(np.asarray(indices)[:, None] - np.arange(length - 1, -1, -1), 0)
+    return np.moveaxis(frames[idx], 1, -1)
+
+class ClipBuffer:
+    """
+    Ring buffer T frame đã tiền xử lý cho suy luận.
+    Mỗi frame được ghi 2 lần (ô i và i + T) nên T frame gần nhất luôn nằm liền nhau:
+    clip() trả về view (H, W, T) theo thứ tự thời gian mà không phải ghép lại.
+    """
+    def __init__(self, length, size=(128, 128)):
+        self.length = length
+        self.data = np.zeros((2 * length, size[1], size[0]), dtype=np.float32)
+        self.head = 0
+        self.count = 0
+
+    def reset(self):
+        self.head = 0
+        self.count = 0
+
+    def push(self, frame):
+        """Thêm frame (H, W) hoặc (H, W, 1). Frame đầu tiên được lặp kín buffer."""
+        if frame.ndim == 3:
+            frame = frame[..., 0]
+        if self.count == 0:
+            self.data[:] = frame
+        else:
+            self.data[self.head] = frame
+            self.data[self.head + self.length] = frame
+        self.head = (self.head + 1) % self.length
+        self.count += 1
+
+    def clip(self):
+        """View (H, W, T) của T frame gần nhất, cũ -> mới (bị ghi đè ở lần push sau)."""
+        return self.data[self.head:self.head + self.length].transpose(1, 2, 0)
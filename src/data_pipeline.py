@@ -0,0 +1,92 @@
+import numpy as np
+import tensorflow as tf
+
+# --- CẤU HÌNH ---
+SHUFFLE_BUFFER = 2048   # Số frame tối đa trong bộ đệm shuffle (giới hạn RAM)
+CHUNK_SIZE = 64         # Đọc memmap theo từng khối frame liên tiếp
+VAL_SPLIT = 0.2         # Tỉ lệ video dành cho validation
+SPLIT_SEED = 42         # Seed cố định -> chia train/val giống nhau mọi lần chạy
+
+def split_sources(view, val_split=VAL_SPLIT, seed=SPLIT_SEED):
+    """
+    Chia train/val theo cấp video (không trộn frame của cùng một video vào 2 tập).
+    Trả về (train_arrays, val_arrays, train_names, val_names) - các view mẫu (n, H, W, T).
+    """
+    n = len(view.windows)
+    if n < 2:
+        # Chỉ có 1 nguồn: cắt đuôi video làm validation (vẫn là view, không copy).
+        # Bỏ T - 1 clip ở chỗ cắt để 2 tập không dùng chung frame.
+        arr = view.windows[0]
+        cut = int(len(arr) * (1 - val_split))
+        return [arr[:cut]], [arr[cut + view.clip_length - 1:]], view.names, view.names
+
+    order = np.random.RandomState(seed).permutation(n)
+    n_val = max(1, int(round(n * val_split)))
+    val_idx = sorted(order[:n_val])
+    train_idx = sorted(order[n_val:])
+    return ([view.windows[i] for i in train_idx], [view.windows[i] for i in val_idx],
+            [view.names[i] for i in train_idx], [view.names[i] for i in val_idx])
+
+def _chunk_generator(arrays, shuffle, chunk_size=CHUNK_SIZE):
+    """Sinh các khối mẫu uint8 (n, H, W, T) đọc thẳng từ memmap."""
+    chunks = [(i, s) for i, arr in enumerate(arrays) for s in range(0, len(arr), chunk_size)]
+
+    def gen():
+        order = np.random.permutation(len(chunks)) if shuffle else range(len(chunks))
+        for k in order:
+            i, s = chunks[k]
+            yield np.asarray(arrays[i][s:s + chunk_size])
+    return gen
+
+def _normalize(batch):
+    # Chuẩn hoá trong graph: uint8 -> float32 [0, 1]
+    x = tf.cast(batch, tf.float32) / 255.0
+    return x, x
+
+def _sample_dataset(arrays, shuffle, shuffle_buffer=SHUFFLE_BUFFER):
+    """Dataset từng mẫu uint8 (H, W, T) (chưa batch) từ danh sách mảng (N, H, W, T)."""
+    h, w, c = arrays[0].shape[1:4]
+    ds = tf.data.Dataset.from_generator(
+        _chunk_generator(arrays, shuffle),
+        output_signature=tf.TensorSpec(shape=(None, h, w, c), dtype=tf.uint8))
+    ds = ds.unbatch()
+    if shuffle:
+        ds = ds.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+    return ds
+
+def make_dataset(arrays, batch_size, shuffle=True, shuffle_buffer=SHUFFLE_BUFFER):
+    """tf.data.Dataset (x, x) stream từ danh sách mảng uint8 (N, H, W, T)."""
+    ds = _sample_dataset(arrays, shuffle, shuffle_buffer)
+    ds = ds.batch(batch_size)
+    ds = ds.map(_normalize, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+def make_train_val_datasets(view, batch_size, val_split=VAL_SPLIT):
+    """Tạo cặp dataset train/val stream từ FrameView của get_training_data."""
+    train_arrays, val_arrays, train_names, val_names = split_sources(view, val_split)
+    print(f"[DATA] Train videos: {train_names}")
+    print(f"[DATA] Validation videos: {val_names}")
+    print(f"[INFO] Training samples: {sum(len(a) for a in train_arrays)}")
+    print(f"[INFO] Validation samples: {sum(len(a) for a in val_arrays)}")
+    train_ds = make_dataset(train_arrays, batch_size, shuffle=True)
+    val_ds = make_dataset(val_arrays, batch_size, shuffle=False)
+    # Số batch biết trước (from_generator không tự suy ra) -> có thanh tiến độ và lịch learning rate
+    n_train = sum(len(a) for a in train_arrays)
+    train_ds = train_ds.apply(tf.data.experimental.assert_cardinality(-(-n_train // batch_size)))
+    return train_ds, val_ds
+
+def make_replay_dataset(new_arrays, old_arrays, batch_size, replay_ratio, shuffle_buffer=SHUFFLE_BUFFER):
+    """
+    Dataset fine-tune: mẫu của nguồn mới trộn với mẫu "replay" lấy ngẫu nhiên từ nguồn cũ
+    (tỉ lệ replay_ratio) để model không quên cảnh cũ. Một epoch = một lượt qua dữ liệu mới.
+    """
+    new_ds = _sample_dataset(new_arrays, True, shuffle_buffer)
+    if not old_arrays or replay_ratio <= 0:
+        ds = new_ds
+    else:
+        old_ds = _sample_dataset(old_arrays, True, shuffle_buffer).repeat()
+        ds = tf.data.Dataset.sample_from_datasets([new_ds, old_ds], weights=[1 - replay_ratio, replay_ratio],
+                                                  stop_on_empty_dataset=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(_normalize, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE)
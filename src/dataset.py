@@ -3,6 +3,24 @@ import numpy as np
 import glob
 import os
 import sys
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from clips import clip_windows
+from frame_source import (list_images, to_gray_small, read_image_small, reduced_factor, preprocess_key,
+                          ImageFolderSource, VideoSource)
+
+# Thư mục cache khung hình đã tiền xử lý (uint8, mỗi nguồn một file .npy)
+CACHE_DIR = os.path.join("outputs", "cache")
+
+# Số process decode song song (1 = tuần tự)
+NUM_WORKERS = os.cpu_count() or 1
+# Số ảnh tối thiểu cho một phần việc khi chia nhỏ folder ảnh giữa các worker
+MIN_CHUNK = 64
+
+def gray_resize(frame, resize=(128, 128)):
+    """Chuyển ảnh xám + resize, giữ kiểu uint8 (dùng cho cache). Cùng hàm với frame_source (train = suy luận)."""
+    return to_gray_small(frame, resize)
 
 def preprocess_frame(frame, resize=(128, 128)):
     """
@@ -11,52 +29,253 @@ def preprocess_frame(frame, resize=(128, 128)):
     2. Resize về kích thước cố định (128x128).
     3. Chuẩn hóa pixel về đoạn [0, 1].
     """
-    # Chuyển sang ảnh xám
-    if len(frame.shape) == 3:
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = frame
-        
-    # Resize
-    gray_resized = cv2.resize(gray, resize)
+    gray_resized = gray_resize(frame, resize)
     
     # Chuẩn hóa (Normalize)
     normalized = gray_resized.astype("float32") / 255.0
     return normalized
 
-def load_image_sequence(folder_path, resize=(128, 128)):
+def _stack_frames(frames, resize, normalize):
+    """Gom list frame uint8 thành mảng (N, H, W)."""
+    if len(frames) == 0:
+        arr = np.empty((0, resize[1], resize[0]), dtype=np.uint8)
+    else:
+        arr = np.stack(frames)
+    if normalize:
+        return arr.astype("float32") / 255.0
+    return arr
+
+def load_image_sequence(folder_path, resize=(128, 128), normalize=True):
     """Đọc chuỗi ảnh từ folder (Dành cho UCSD)"""
-    # Tìm tất cả file ảnh (tif, jpg, png)
-    image_paths = sorted(glob.glob(os.path.join(folder_path, "*.tif")) + 
-                         glob.glob(os.path.join(folder_path, "*.jpg")) +
-                         glob.glob(os.path.join(folder_path, "*.png")))
-    
     frames = []
-    for img_path in image_paths:
-        img = cv2.imread(img_path)
-        if img is None:
-            continue
-        processed = preprocess_frame(img, resize)
-        frames.append(processed)
-        
-    return np.array(frames)
+    with ImageFolderSource(folder_path, resize) as source:
+        while (gray := source.read_small()) is not None:
+            frames.append(gray.copy())
+    return _stack_frames(frames, resize, normalize)
 
-def load_video_file(video_path, resize=(128, 128)):
+def load_video_file(video_path, resize=(128, 128), normalize=True):
     """Đọc file video đơn lẻ (Dành cho Avenue)"""
-    cap = cv2.VideoCapture(video_path)
     frames = []
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        processed = preprocess_frame(frame, resize)
-        frames.append(processed)
-    cap.release()
-    return np.array(frames)
+    with VideoSource(video_path, resize) as source:
+        while (gray := source.read_small()) is not None:
+            frames.append(gray.copy())
+    return _stack_frames(frames, resize, normalize)
+
+# --- CACHE TRÊN Ổ ĐĨA ---
+
+def source_signature(source_path):
+    """Chữ ký nội dung của nguồn: (tên, mtime, size) của file video hoặc từng ảnh."""
+    if os.path.isdir(source_path):
+        files = list_images(source_path)
+    else:
+        files = [source_path]
+    sig = []
+    for p in files:
+        st = os.stat(p)
+        sig.append([os.path.basename(p), st.st_mtime_ns, st.st_size])
+    return sig
+
+def cache_path_for(source_path, resize=(128, 128), cache_dir=CACHE_DIR):
+    """
+    Đường dẫn file cache của một nguồn.
+    Tên file = <hash đường dẫn>_<hash (đường dẫn, mtime/size, resize, phiên bản tiền xử lý)>.npy
+    """
+    abs_path = os.path.abspath(source_path)
+    key = json.dumps({"path": abs_path,
+                      "sig": source_signature(source_path),
+                      "resize": list(resize),
+                      "preprocess": preprocess_key()})
+    prefix = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:12]
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{prefix}_{digest}.npy")
+
+def open_npy(path):
+    """Mở file .npy dạng memory-map (chỉ đọc)."""
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # File rỗng (0 frame) không mmap được
+        return np.load(path)
+
+def _remove_stale(cache_file):
+    """Xoá các bản cache cũ của cùng nguồn (cùng prefix, khác digest)."""
+    cache_dir = os.path.dirname(cache_file)
+    prefix = os.path.basename(cache_file).split("_")[0]
+    for old in glob.glob(os.path.join(cache_dir, prefix + "_*.npy")):
+        if old != cache_file:
+            try: os.remove(old)
+            except OSError: pass
+
+def _save_npy(arr, path):
+    with open(path, "wb") as f:
+        np.save(f, arr)
+
+def _init_worker():
+    # Mỗi process chỉ dùng 1 thread OpenCV để không tranh CPU lẫn nhau
+    cv2.setNumThreads(1)
+
+def _decode_images_into(out_path, image_paths, start, resize):
+    """
+    Worker: decode một đoạn ảnh và ghi thẳng vào lát [start:start+n] của file .npy
+    đã cấp phát sẵn (memmap). Trả về chỉ số các ảnh đọc lỗi.
+    """
+    out = np.load(out_path, mmap_mode="r+")
+    bad = []
+    # Ảnh đủ lớn thì giải mã thẳng ở độ phân giải thấp (IMREAD_REDUCED_GRAYSCALE_*)
+    first = cv2.imread(image_paths[0]) if image_paths else None
+    factor = reduced_factor(first.shape, resize) if first is not None else 1
+    gray = np.empty((resize[1], resize[0]), dtype=np.uint8)
+    small = np.empty((resize[1], resize[0], 3), dtype=np.uint8)
+    for i, img_path in enumerate(image_paths):
+        if read_image_small(img_path, resize, factor, gray, small) is None:
+            bad.append(start + i)
+            continue
+        out[start + i] = gray
+    out.flush()
+    del out
+    return bad
 
-def get_training_data(root_dir, resize=(128, 128)):
+def _decode_video_into(out_path, video_path, resize):
+    """
+    Worker: decode một video vào file .npy cấp phát theo CAP_PROP_FRAME_COUNT.
+    Nếu số frame thực tế khác ước lượng thì ghi lại file đúng kích thước.
+    """
+    source = VideoSource(video_path, resize)
+    estimate = source.frame_count
+    shape = (estimate, resize[1], resize[0])
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.uint8, shape=shape)
+    n = 0
+    extra = []
+    while (gray := source.read_small()) is not None:
+        if n < estimate:
+            out[n] = gray
+        else:
+            extra.append(gray.copy())
+        n += 1
+    source.release()
+    out.flush()
+    if n != estimate:
+        frames = np.concatenate([out[:n], _stack_frames(extra, resize, False)])
+        del out
+        _save_npy(frames, out_path)
+    return []
+
+def build_cache(jobs, resize=(128, 128), workers=NUM_WORKERS):
+    """
+    Decode các nguồn chưa có cache. jobs = [(source_path, cache_file), ...].
+    Folder ảnh được chia thành nhiều đoạn để nhiều worker cùng ghi vào một file;
+    worker chỉ trả về danh sách chỉ số lỗi, không gửi frame về process cha.
+    """
+    if not jobs:
+        return
+    tasks = []
+    tmp_files = {}
+    for source_path, cache_file in jobs:
+        print(f"  -> Decoding: {os.path.basename(source_path)}")
+        os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        tmp_files[cache_file] = tmp_file
+        if os.path.isdir(source_path):
+            image_paths = list_images(source_path)
+            shape = (len(image_paths), resize[1], resize[0])
+            out = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.uint8, shape=shape)
+            del out
+            step = max(MIN_CHUNK, -(-len(image_paths) // max(workers, 1)))
+            for start in range(0, len(image_paths), step):
+                tasks.append((cache_file, _decode_images_into,
+                              (tmp_file, image_paths[start:start + step], start, resize)))
+        else:
+            tasks.append((cache_file, _decode_video_into, (tmp_file, source_path, resize)))
+
+    bad = {cache_file: [] for cache_file in tmp_files}
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                 initializer=_init_worker) as pool:
+            futures = [(cache_file, pool.submit(fn, *args)) for cache_file, fn, args in tasks]
+            for cache_file, fut in futures:
+                bad[cache_file].extend(fut.result())
+    else:
+        for cache_file, fn, args in tasks:
+            bad[cache_file].extend(fn(*args))
+
+    for cache_file, tmp_file in tmp_files.items():
+        if bad[cache_file]:
+            # Loại các ảnh đọc lỗi khỏi file
+            frames = np.delete(np.load(tmp_file), bad[cache_file], axis=0)
+            _save_npy(frames, tmp_file)
+        os.replace(tmp_file, cache_file)
+        _remove_stale(cache_file)
+
+def load_cached_sources(source_paths, resize=(128, 128), cache_dir=CACHE_DIR, workers=NUM_WORKERS):
+    """
+    Trả về list mảng uint8 (N, H, W) memory-mapped, mỗi nguồn (folder ảnh hoặc video) một mảng.
+    Chỉ decode lại các nguồn mới hoặc đã thay đổi (song song trên `workers` process).
+    """
+    cache_files = [cache_path_for(p, resize, cache_dir) for p in source_paths]
+    jobs = [(p, c) for p, c in zip(source_paths, cache_files) if not os.path.exists(c)]
+    for p, c in zip(source_paths, cache_files):
+        if os.path.exists(c):
+            print(f"  -> Cache: {os.path.basename(p)}")
+    build_cache(jobs, resize, workers)
+    return [open_npy(c) for c in cache_files]
+
+def load_cached_source(source_path, resize=(128, 128), cache_dir=CACHE_DIR):
+    """Phiên bản một nguồn của load_cached_sources (tuần tự)."""
+    return load_cached_sources([source_path], resize, cache_dir, workers=1)[0]
+
+class FrameView:
+    """
+    View nối (lazy) nhiều mảng uint8 (N, H, W) của từng nguồn.
+    Mỗi mẫu là một clip T frame liên tiếp trong cùng nguồn (T = clip_length, mặc định 1):
+    `windows` là view cửa sổ trượt (n, H, W, T) trên cache, không copy.
+    Chỉ khi index mới sinh ra mảng float32 (n, H, W, T) đã chuẩn hoá về [0, 1].
+    sources: đường dẫn gốc của từng nguồn (dùng cho manifest khi fine-tune).
+    """
+    def __init__(self, arrays, names=None, clip_length=1, sources=None):
+        self.arrays = list(arrays)
+        self.names = list(names) if names is not None else [str(i) for i in range(len(self.arrays))]
+        self.sources = list(sources) if sources is not None else list(self.names)
+        self.clip_length = clip_length
+        self.windows = [clip_windows(a, clip_length) for a in self.arrays]
+        lengths = [len(w) for w in self.windows]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        h, w = self.arrays[0].shape[1:3] if self.arrays else (0, 0)
+        self.shape = (int(self.offsets[-1]), h, w, clip_length)
+        self.dtype = np.dtype("float32")
+
+    def __len__(self):
+        return self.shape[0]
+
+    def take_raw(self, indices):
+        """Lấy các mẫu uint8 (n, H, W, T) theo chỉ số toàn cục."""
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if indices.size and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError("FrameView index out of range")
+        out = np.empty((len(indices),) + self.shape[1:], dtype=np.uint8)
+        src = np.searchsorted(self.offsets, indices, side="right") - 1
+        for s in np.unique(src):
+            mask = src == s
+            out[mask] = self.windows[s][indices[mask] - self.offsets[s]]
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self[np.array([key])][0]
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(len(self)))
+        raw = self.take_raw(key)
+        return raw.astype("float32") / 255.0
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[:]
+        return arr if dtype is None else arr.astype(dtype)
+
+def get_training_data(root_dir, resize=(128, 128), workers=NUM_WORKERS, clip_length=1):
     """
     Hàm chính để load dữ liệu. Tự động phát hiện loại dữ liệu.
+    workers: số process decode song song cho các nguồn chưa có cache.
+    clip_length: số frame liên tiếp mỗi mẫu (model clip), 1 = từng frame.
     """
     print(f"[DATA] Đang quét dữ liệu tại: {root_dir}")
     
@@ -64,7 +283,7 @@ def get_training_data(root_dir, resize=(128, 128)):
         print(f"[ERROR] Không tìm thấy đường dẫn: {root_dir}")
         return None
 
-    all_frames = []
+    sources = []
     
     # 1. Kiểm tra xem có phải Avenue (chứa file video) không?
     videos = sorted(glob.glob(os.path.join(root_dir, "*.avi")) + 
@@ -75,31 +294,21 @@ def get_training_data(root_dir, resize=(128, 128)):
 
     if len(videos) > 0:
         print(f"[DATA] Phát hiện {len(videos)} video files (Avenue mode).")
-        for v_path in videos:
-            print(f"  -> Loading: {os.path.basename(v_path)}")
-            frames = load_video_file(v_path, resize)
-            all_frames.extend(frames)
+        sources = videos
 
     elif len(subfolders) > 0:
         print(f"[DATA] Phát hiện {len(subfolders)} thư mục chuỗi ảnh (UCSD mode).")
-        for folder in subfolders:
-            # Bỏ qua các folder _gt nếu lỡ còn sót lại
-            if "_gt" in folder: 
-                continue
-            print(f"  -> Loading: {os.path.basename(folder)}")
-            frames = load_image_sequence(folder, resize)
-            all_frames.extend(frames)
+        # Bỏ qua các folder _gt nếu lỡ còn sót lại
+        sources = [f for f in subfolders if "_gt" not in f]
             
     else:
         print("[WARNING] Thư mục rỗng hoặc cấu trúc không đúng!")
         return None
 
-    # Chuyển list thành numpy array
-    all_frames = np.array(all_frames)
-    
-    # Thêm chiều channel (N, 128, 128, 1) để khớp input của Keras
-    if len(all_frames.shape) == 3:
-        all_frames = np.expand_dims(all_frames, axis=-1)
+    # Mỗi nguồn là một mảng uint8 memory-mapped trong cache.
+    # Trả về view nối lazy (N, 128, 128, T) thay vì tạo mảng float32 mới.
+    arrays = load_cached_sources(sources, resize, workers=workers)
+    all_frames = FrameView(arrays, [os.path.basename(p) for p in sources], clip_length, sources)
 
     print(f"[DATA] Load hoàn tất. Shape dữ liệu: {all_frames.shape}")
     return all_frames
@@ -1,8 +1,11 @@
 import numpy as np
 import os
 import matplotlib.pyplot as plt
-from tensorflow.keras.models import load_model
 from dataset import get_training_data
+from inference import load_backend, BACKEND
+from score_stats import RunningStats, HistogramSketch
+from optical_flow import FlowExtractor, FLOW_METHOD
+from clips import clip_length_of
 
 # --- CẤU HÌNH ---
 DATA_PATH = os.path.join("data", "ucsd", "train")
@@ -10,6 +13,56 @@ DATA_PATH = os.path.join("data", "ucsd", "train")
 MODEL_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
 THRESHOLD_PATH = os.path.join("outputs", "models", "threshold.txt")
 HISTOGRAM_PATH = os.path.join("outputs", "logs", "error_histogram.png")
+FLOW_THRESHOLD_PATH = os.path.join("outputs", "models", "flow_threshold.txt")
+
+BATCH_SIZE = 64                # Số frame mỗi lần forward (bộ nhớ chỉ phụ thuộc giá trị này)
+THRESHOLD_METHOD = "std"       # "std": Mean + STD_FACTOR * Std | "percentile": phân vị PERCENTILE
+STD_FACTOR = 3
+PERCENTILE = 99.7
+FLOW_SCORE = True              # Hiệu chỉnh thêm ngưỡng cho điểm optical flow (điểm phụ)
+
+def frame_errors(batch, reconstructed):
+    """MSE từng frame của một batch."""
+    return np.mean(np.square(batch - reconstructed), axis=(1, 2, 3))
+
+def stream_errors(backend, data, batch_size=BATCH_SIZE):
+    """
+    Tính lỗi tái tạo theo stream: mỗi lần chỉ giữ một batch và kết quả của nó.
+    Trả về (RunningStats, HistogramSketch) - bộ nhớ hằng số theo số frame.
+    """
+    stats, sketch = RunningStats(), HistogramSketch()
+    for i in range(0, len(data), batch_size):
+        batch = data[i:i + batch_size]
+        mse = frame_errors(batch, backend.predict(batch))
+        stats.update(mse)
+        sketch.update(mse)
+    return stats, sketch
+
+def stream_flow_scores(data, method=FLOW_METHOD):
+    """Điểm flow (optical_flow.FlowExtractor.score) của mọi frame, tính tuần tự trong từng nguồn."""
+    stats, sketch = RunningStats(), HistogramSketch(lo=1e-3, hi=1e3)
+    for frames in data.arrays:
+        extractor = FlowExtractor(method, (frames.shape[2], frames.shape[1]))
+        scores = []
+        for i, frame in enumerate(frames):
+            extractor.update(frame)
+            if i > 0:  # Frame đầu của nguồn chưa có flow
+                scores.append(extractor.score())
+        stats.update(scores)
+        sketch.update(scores)
+    return stats, sketch
+
+def compute_threshold(stats, sketch, method=THRESHOLD_METHOD):
+    if method == "percentile":
+        return sketch.quantile(PERCENTILE / 100.0)
+    if method == "std":
+        return stats.mean + STD_FACTOR * stats.std
+    raise ValueError(f"THRESHOLD_METHOD không hợp lệ: {method} (chọn 'std' hoặc 'percentile')")
+
+def calibrate_threshold(backend, data, method=THRESHOLD_METHOD, batch_size=BATCH_SIZE):
+    """Hiệu chỉnh ngưỡng trên dữ liệu bình thường. Trả về (threshold, stats, sketch)."""
+    stats, sketch = stream_errors(backend, data, batch_size)
+    return compute_threshold(stats, sketch, method), stats, sketch
 
 def evaluate():
     # 1. Load Model
@@ -17,46 +70,62 @@ def evaluate():
     if not os.path.exists(MODEL_PATH):
         print("[ERROR] Chưa có model! Hãy chạy train_autoencoder.py trước.")
         return
-    
-    model = load_model(MODEL_PATH, compile=False)
-    
+
+    backend = load_backend(BACKEND, MODEL_PATH)
+
     # 2. Load Dữ liệu Train (Dữ liệu bình thường)
     # Ta dùng chính tập train để xem model tái tạo nó "tốt" đến mức nào
-    data = get_training_data(DATA_PATH)
-    
-    # 3. Dự đoán (Tái tạo lại ảnh)
-    print("[INFO] Đang thực hiện tái tạo ảnh để tính lỗi...")
-    reconstructed = model.predict(data)
-    
-    # 4. Tính Mean Squared Error (MSE) cho từng tấm ảnh
+    # (FrameView lazy: chỉ đọc từng batch từ cache khi cần; model clip -> mẫu T frame)
+    data = get_training_data(DATA_PATH, clip_length=clip_length_of(backend))
+    if data is None or len(data) == 0:
+        print("[ERROR] Không có dữ liệu train để hiệu chỉnh ngưỡng.")
+        return
+
+    # 3. Tái tạo ảnh và tính Mean Squared Error (MSE) theo từng batch
     # Công thức: Trung bình cộng của bình phương hiệu (Gốc - Tái tạo)
-    mse = np.mean(np.square(data - reconstructed), axis=(1, 2, 3))
-    
-    # 5. Vẽ biểu đồ phân bố lỗi (Histogram)
+    # Mean/Std tính online (Welford), phân vị ước lượng bằng histogram sketch
+    print("[INFO] Đang thực hiện tái tạo ảnh để tính lỗi...")
+
+    # 4. Tính Ngưỡng (Threshold)
+    # Cách chọn ngưỡng phổ biến: Mean + 3 * Std (Độ lệch chuẩn)
+    # Nghĩa là: Chỉ 0.3% dữ liệu chuẩn bị coi nhầm là bất thường (Lý thuyết thống kê)
+    # Hoặc lấy trực tiếp phân vị PERCENTILE (không giả định phân phối chuẩn)
+    threshold, stats, sketch = calibrate_threshold(backend, data)
+
+    print(f"\n[KẾT QUẢ] Số frame: {stats.n}")
+    print(f"[KẾT QUẢ] Lỗi trung bình (Mean): {stats.mean}")
+    print(f"[KẾT QUẢ] Độ lệch chuẩn (Std): {stats.std}")
+    print(f"[KẾT QUẢ] Phân vị {PERCENTILE}%: {sketch.quantile(PERCENTILE / 100.0)}")
+    print(f"[KẾT QUẢ] Ngưỡng đề xuất (Threshold, {THRESHOLD_METHOD}): {threshold}")
+
+    # 5. Vẽ biểu đồ phân bố lỗi (Histogram) từ sketch
+    counts, edges = sketch.histogram(bins=50, range_=(stats.min, stats.max))
     plt.figure(figsize=(10, 6))
-    plt.hist(mse, bins=50, alpha=0.75, color='blue', edgecolor='black')
+    plt.stairs(counts, edges, fill=True, alpha=0.75, color='blue', edgecolor='black')
     plt.title("Phân bố lỗi tái tạo (Reconstruction Error Distribution)")
     plt.xlabel("Mean Squared Error (MSE)")
     plt.ylabel("Số lượng Frame")
-    
-    # 6. Tính Ngưỡng (Threshold)
-    # Cách chọn ngưỡng phổ biến: Mean + 3 * Std (Độ lệch chuẩn)
-    # Nghĩa là: Chỉ 0.3% dữ liệu chuẩn bị coi nhầm là bất thường (Lý thuyết thống kê)
-    threshold = np.mean(mse) + 3 * np.std(mse)
-    
-    print(f"\n[KẾT QUẢ] Lỗi trung bình (Mean): {np.mean(mse)}")
-    print(f"[KẾT QUẢ] Ngưỡng đề xuất (Threshold): {threshold}")
-    
+
     # Vẽ đường ngưỡng lên biểu đồ
     plt.axvline(threshold, color='r', linestyle='dashed', linewidth=2, label=f'Threshold: {threshold:.5f}')
     plt.legend()
     plt.savefig(HISTOGRAM_PATH)
     print(f"[INFO] Đã lưu biểu đồ Histogram tại: {HISTOGRAM_PATH}")
-    
-    # 7. Lưu ngưỡng vào file text
+
+    # 6. Lưu ngưỡng vào file text
     with open(THRESHOLD_PATH, "w") as f:
         f.write(str(threshold))
     print(f"[INFO] Đã lưu giá trị ngưỡng vào: {THRESHOLD_PATH}")
 
+    # 7. Ngưỡng cho điểm optical flow (chuyển động nhanh bất thường)
+    if FLOW_SCORE:
+        print("[INFO] Đang tính optical flow để hiệu chỉnh ngưỡng flow...")
+        flow_stats, flow_sketch = stream_flow_scores(data)
+        flow_threshold = compute_threshold(flow_stats, flow_sketch)
+        print(f"[KẾT QUẢ] Điểm flow trung bình: {flow_stats.mean} | Ngưỡng flow: {flow_threshold}")
+        with open(FLOW_THRESHOLD_PATH, "w") as f:
+            f.write(str(flow_threshold))
+        print(f"[INFO] Đã lưu ngưỡng flow vào: {FLOW_THRESHOLD_PATH}")
+
 if __name__ == "__main__":
-    evaluate()
\ No newline at end of file
+    evaluate()
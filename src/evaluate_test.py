@@ -0,0 +1,285 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from dataset import load_cached_sources, cache_path_for, open_npy
+from inference import BACKEND
+from motion_gate import AdaptiveSkipper
+from score_stats import HistogramSketch
+from optical_flow import FlowExtractor
+from clips import clip_length_of, gather_clips
+
+# --- CẤU HÌNH ---
+TEST_PATH = os.path.join("data", "ucsd", "test")
+MODEL_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
+THRESHOLD_PATH = os.path.join("outputs", "models", "threshold.txt")
+FLOW_THRESHOLD_PATH = os.path.join("outputs", "models", "flow_threshold.txt")
+REPORT_DIR = os.path.join("outputs", "logs")
+
+RESIZE = (128, 128)
+BATCH_SIZE = 64
+SKIP_FRAMES = 0     # 0 = chấm mọi frame; k = chạy model 1 trên k+1 frame (frame bỏ qua giữ điểm trước đó)
+# Mỗi worker nạp một bản model riêng nên không nên đặt quá nhiều
+WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# --- ROC / EER (vector hoá) ---
+def _rates(tp, fp):
+    """Thêm điểm (0, 0) và chuẩn hoá TP/FP tích luỹ thành TPR/FPR."""
+    tpr = np.concatenate([[0.0], tp / tp[-1]]) if tp[-1] > 0 else None
+    fpr = np.concatenate([[0.0], fp / fp[-1]]) if fp[-1] > 0 else None
+    return fpr, tpr
+
+def roc_curve(scores, labels):
+    """ROC chính xác từ điểm từng frame (mỗi giá trị điểm khác nhau là một ngưỡng)."""
+    order = np.argsort(-scores, kind="mergesort")
+    s = scores[order]
+    y = labels[order].astype(bool)
+    tp = np.cumsum(y).astype(np.float64)
+    fp = np.cumsum(~y).astype(np.float64)
+    last = np.concatenate([np.flatnonzero(np.diff(s)), [len(s) - 1]])
+    return _rates(tp[last], fp[last])
+
+def roc_from_counts(pos_counts, neg_counts):
+    """ROC từ histogram điểm của mẫu dương/âm (bin theo thứ tự điểm tăng dần)."""
+    tp = np.cumsum(pos_counts[::-1]).astype(np.float64)
+    fp = np.cumsum(neg_counts[::-1]).astype(np.float64)
+    return _rates(tp, fp)
+
+def auc(fpr, tpr):
+    if fpr is None or tpr is None:
+        return float("nan")
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+def eer(fpr, tpr):
+    """Equal Error Rate: điểm FPR = FNR (nội suy tuyến tính)."""
+    if fpr is None or tpr is None:
+        return float("nan")
+    fnr = 1.0 - tpr
+    i = int(np.argmax(fpr >= fnr))
+    if i == 0:
+        return float(fpr[0])
+    d0 = fnr[i - 1] - fpr[i - 1]
+    d1 = fpr[i] - fnr[i]
+    t = d0 / (d0 + d1) if d0 + d1 > 0 else 0.0
+    return float(fpr[i - 1] + t * (fpr[i] - fpr[i - 1]))
+
+# --- Dữ liệu test ---
+def find_test_sequences(root_dir):
+    """Các cặp (folder ảnh, folder _gt). Sequence không có _gt bị bỏ qua."""
+    pairs = []
+    for folder in sorted(f.path for f in os.scandir(root_dir) if f.is_dir() and "_gt" not in f.name):
+        gt = folder + "_gt"
+        if os.path.isdir(gt):
+            pairs.append((folder, gt))
+        else:
+            print(f"[WARNING] {os.path.basename(folder)}: không có ground truth, bỏ qua.")
+    return pairs
+
+def load_masks(gt_folder, resize=RESIZE):
+    """
+    Mask ground truth -> (mask bool (N, H, W) theo kích thước model, nhãn frame (N,)).
+    Nhãn frame = 1 nếu mask gốc có ít nhất một pixel bất thường.
+    """
+    paths = sorted(glob.glob(os.path.join(gt_folder, "*.bmp")) +
+                   glob.glob(os.path.join(gt_folder, "*.png")) +
+                   glob.glob(os.path.join(gt_folder, "*.tif")))
+    masks = np.zeros((len(paths), resize[1], resize[0]), dtype=bool)
+    labels = np.zeros(len(paths), dtype=bool)
+    for i, p in enumerate(paths):
+        m = cv2.imread(p, cv2.IMREAD_GRAYSCALE)
+        if m is None:
+            continue
+        labels[i] = m.any()
+        masks[i] = cv2.resize(m, resize, interpolation=cv2.INTER_NEAREST) > 0
+    return masks, labels
+
+# --- Worker ---
+_backend = None
+
+def _init_worker(backend_name, model_path):
+    global _backend
+    from inference import load_backend
+    cv2.setNumThreads(1)
+    _backend = load_backend(backend_name, model_path)
+
+def schedule(frames, skip, adaptive):
+    """Chỉ số frame được chạy model và, với mỗi frame, frame đã chấm gần nhất."""
+    if adaptive:
+        skipper = AdaptiveSkipper()
+    else:
+        skipper = AdaptiveSkipper(skip, skip, fixed_skip=skip)
+    scored = np.array([skipper.should_score(f) for f in frames], dtype=bool)
+    source = np.maximum.accumulate(np.where(scored, np.arange(len(frames)), 0))
+    return np.flatnonzero(scored), source
+
+def flow_scores(frames):
+    """Điểm optical flow (FlowExtractor.score) của từng frame liên tiếp."""
+    extractor = FlowExtractor(size=(frames.shape[2], frames.shape[1]))
+    scores = np.zeros(len(frames), dtype=np.float32)
+    for i, frame in enumerate(frames):
+        extractor.update(frame)
+        scores[i] = extractor.score()
+    return scores
+
+def score_sequence(cache_file, gt_folder, skip=SKIP_FRAMES, adaptive=False, flow=False, batch_size=BATCH_SIZE):
+    """
+    Chấm một sequence: trả về điểm MSE từng frame, nhãn frame và histogram
+    lỗi từng pixel (dương/âm) để ghép ROC mức pixel mà không giữ bản đồ lỗi.
+    flow=True: thêm điểm optical flow (frame bỏ qua giữ điểm của frame đã chấm, như app).
+    """
+    frames = open_npy(cache_file)
+    masks, labels = load_masks(gt_folder, (frames.shape[2], frames.shape[1]))
+    n = min(len(frames), len(masks))
+    frames, masks, labels = frames[:n], masks[:n], labels[:n]
+
+    scored_idx, source = schedule(frames, skip, adaptive)
+    length = clip_length_of(_backend)
+    scores = np.zeros(n, dtype=np.float32)
+    pos, neg = HistogramSketch(), HistogramSketch()
+    infer_time = 0.0
+    start = time.perf_counter()
+    for k in range(0, len(scored_idx), batch_size):
+        idx = scored_idx[k:k + batch_size]
+        batch = gather_clips(frames, idx, length).astype(np.float32) / 255.0
+        t0 = time.perf_counter()
+        reconstructed = _backend.predict(batch)
+        infer_time += time.perf_counter() - t0
+        squared = np.square(batch - reconstructed)
+        mses = squared.mean(axis=(1, 2, 3))
+        error_maps = squared[..., -1]   # Bản đồ lỗi của frame hiện tại (channel cuối của clip)
+        # Các frame dùng kết quả của batch này (gồm cả frame bị bỏ qua sau đó)
+        j0 = idx[0]
+        j1 = scored_idx[k + batch_size] if k + batch_size < len(scored_idx) else n
+        rows = np.searchsorted(idx, source[j0:j1])
+        scores[j0:j1] = mses[rows]
+        maps = error_maps[rows]
+        gt = masks[j0:j1]
+        pos.update(maps[gt])
+        neg.update(maps[~gt])
+    return {
+        "scores": scores,
+        "flow_scores": flow_scores(frames)[source] if flow else None,
+        "labels": labels,
+        "pos_counts": pos.counts,
+        "neg_counts": neg.counts,
+        "scored": len(scored_idx),
+        "infer_time": infer_time,
+        "wall": time.perf_counter() - start,
+    }
+
+# --- Chạy đánh giá ---
+def evaluate_test(test_path=TEST_PATH, backend_name=BACKEND, model_path=MODEL_PATH,
+                  skip=SKIP_FRAMES, adaptive=False, workers=WORKERS, flow=False):
+    """Đánh giá trên tập test có nhãn. Trả về dict kết quả (hoặc None nếu thiếu dữ liệu)."""
+    pairs = find_test_sequences(test_path) if os.path.isdir(test_path) else []
+    if not pairs:
+        print(f"[ERROR] Không tìm thấy sequence test có _gt tại: {test_path}")
+        return None
+    print(f"[DATA] {len(pairs)} sequence test có ground truth")
+    # Decode (song song) vào cache dùng chung với train; worker chỉ mở memmap
+    load_cached_sources([f for f, _ in pairs], RESIZE)
+    jobs = [(cache_path_for(f, RESIZE), gt, skip, adaptive, flow) for f, gt in pairs]
+
+    start = time.perf_counter()
+    if workers <= 1:
+        _init_worker(backend_name, model_path)
+        results = [score_sequence(*job) for job in jobs]
+    else:
+        # spawn: mỗi worker khởi tạo runtime của backend từ đầu (an toàn hơn fork)
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=ctx,
+                                 initializer=_init_worker, initargs=(backend_name, model_path)) as pool:
+            results = list(pool.map(score_sequence, *zip(*jobs)))
+    elapsed = time.perf_counter() - start
+
+    per_sequence = []
+    for (folder, _), r in zip(pairs, results):
+        fpr, tpr = roc_curve(r["scores"], r["labels"])
+        per_sequence.append({"name": os.path.basename(folder), "frames": len(r["scores"]),
+                             "scored": r["scored"], "anomalous": int(r["labels"].sum()),
+                             "frame_auc": auc(fpr, tpr)})
+        print(f"  -> {per_sequence[-1]['name']}: {len(r['scores'])} frames "
+              f"({r['scored']} chạy model), AUC {per_sequence[-1]['frame_auc']:.4f}")
+
+    scores = np.concatenate([r["scores"] for r in results])
+    labels = np.concatenate([r["labels"] for r in results])
+    frame_roc = roc_curve(scores, labels)
+    pixel_roc = roc_from_counts(sum(r["pos_counts"] for r in results),
+                                sum(r["neg_counts"] for r in results))
+    scored = sum(r["scored"] for r in results)
+    infer_time = sum(r["infer_time"] for r in results)
+    report = {
+        "backend": backend_name,
+        "schedule": "adaptive" if adaptive else f"skip{skip}",
+        "frames": int(len(scores)),
+        "scored": int(scored),
+        "frame_auc": auc(*frame_roc),
+        "frame_eer": eer(*frame_roc),
+        "pixel_auc": auc(*pixel_roc),
+        "pixel_eer": eer(*pixel_roc),
+        "model_fps": scored / infer_time if infer_time > 0 else 0.0,
+        "wall_seconds": elapsed,
+        "sequences": per_sequence,
+    }
+    if flow:
+        flows = np.concatenate([r["flow_scores"] for r in results])
+        report["flow_auc"] = auc(*roc_curve(flows, labels))
+    if os.path.exists(THRESHOLD_PATH):
+        with open(THRESHOLD_PATH, "r") as f:
+            threshold = float(f.read())
+        pred = scores > threshold
+        if flow and os.path.exists(FLOW_THRESHOLD_PATH):
+            with open(FLOW_THRESHOLD_PATH, "r") as f:
+                flow_threshold = float(f.read())
+            # Kết hợp như app: bất thường nếu một trong hai điểm vượt ngưỡng của nó
+            report["flow_threshold"] = flow_threshold
+            report["combined_auc"] = auc(*roc_curve(np.maximum(scores / threshold, flows / flow_threshold), labels))
+            pred |= flows > flow_threshold
+        report["threshold"] = threshold
+        report["threshold_tpr"] = float(pred[labels].mean()) if labels.any() else float("nan")
+        report["threshold_fpr"] = float(pred[~labels].mean()) if (~labels).any() else float("nan")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá AUC/EER trên tập test có ground truth (_gt)")
+    parser.add_argument("--data", default=TEST_PATH)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--backend", default=BACKEND, help="keras | tflite | tflite_int8 | onnx")
+    parser.add_argument("--skip", type=int, default=SKIP_FRAMES, help="Lịch cố định: chạy model 1 trên skip+1 frame")
+    parser.add_argument("--adaptive", action="store_true", help="Lịch thích ứng theo chuyển động (motion_gate)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--flow", action="store_true", help="Thêm điểm phụ optical flow")
+    args = parser.parse_args()
+
+    report = evaluate_test(args.data, args.backend, args.model, args.skip, args.adaptive, args.workers, args.flow)
+    if report is None:
+        return 1
+
+    print(f"\n[KẾT QUẢ] Backend: {report['backend']} | Lịch: {report['schedule']} | "
+          f"Model chạy {report['scored']}/{report['frames']} frames")
+    print(f"[KẾT QUẢ] Frame-level: AUC {report['frame_auc']:.4f} | EER {report['frame_eer']:.4f}")
+    print(f"[KẾT QUẢ] Pixel-level: AUC {report['pixel_auc']:.4f} | EER {report['pixel_eer']:.4f}")
+    if "flow_auc" in report:
+        print(f"[KẾT QUẢ] Optical flow: AUC {report['flow_auc']:.4f}"
+              + (f" | Kết hợp MSE + flow: AUC {report['combined_auc']:.4f}" if "combined_auc" in report else ""))
+    if "threshold" in report:
+        print(f"[KẾT QUẢ] Tại ngưỡng {report['threshold']:.6f}: TPR {report['threshold_tpr']:.4f} | "
+              f"FPR {report['threshold_fpr']:.4f}")
+    print(f"[INFO] Tốc độ model: {report['model_fps']:.1f} FPS | Tổng thời gian: {report['wall_seconds']:.2f}s")
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    suffix = "_flow" if args.flow else ""
+    path = os.path.join(REPORT_DIR, f"test_eval_{report['backend']}_{report['schedule']}{suffix}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Đã lưu kết quả tại: {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import os
+import sys
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Input, InputLayer, Conv2D, BatchNormalization, Layer
+from tensorflow.keras.models import Model, load_model
+from dataset import get_training_data
+from inference import artifact_path, load_backend
+
+# --- CẤU HÌNH ---
+DATA_PATH = os.path.join("data", "ucsd", "train")
+#DATA_PATH = os.path.join("data", "avenue", "train")
+MODEL_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
+
+CALIBRATION_SAMPLES = 200   # Số frame train dùng hiệu chỉnh INT8
+VERIFY_SAMPLES = 200        # Số frame (khác tập hiệu chỉnh) dùng kiểm tra sai số
+SEED = 42
+
+# Sai lệch tương đối tối đa của MSE từng frame so với Keras gốc
+MSE_TOLERANCE = {"savedmodel": 1e-5, "tflite": 1e-3, "tflite_int8": 0.05, "onnx": 1e-3}
+
+class ChannelBias(Layer):
+    """Cộng bias theo channel (phần dịch của BatchNorm còn lại sau khi gộp)."""
+    def build(self, input_shape):
+        self.bias = self.add_weight(name="bias", shape=(input_shape[-1],),
+                                    initializer="zeros", trainable=False)
+
+    def call(self, inputs):
+        return inputs + self.bias
+
+def _clone(layer, x):
+    new_layer = layer.__class__.from_config(layer.get_config())
+    y = new_layer(x)
+    new_layer.set_weights(layer.get_weights())
+    return y
+
+def fold_batchnorm(model, batch_size=None):
+    """
+    Gộp các cặp Conv2D -> BatchNormalization (model dạng chuỗi như build_autoencoder).
+    BN suy luận là y = a * x + b với a = gamma / sqrt(var + eps), b = beta - mean * a.
+    - Conv tuyến tính: gộp cả a và b vào kernel/bias.
+    - Conv + ReLU và a > 0: relu(z) * a = relu(z * a) nên gộp a vào kernel/bias,
+      chỉ còn cộng b (ChannelBias). Trường hợp khác giữ nguyên BN.
+    """
+    layers = [l for l in model.layers if not isinstance(l, InputLayer)]
+    inp = Input(shape=model.input_shape[1:], batch_size=batch_size)
+    x = inp
+    i = 0
+    folded = 0
+    while i < len(layers):
+        layer = layers[i]
+        nxt = layers[i + 1] if i + 1 < len(layers) else None
+        if isinstance(layer, Conv2D) and isinstance(nxt, BatchNormalization) and layer.use_bias:
+            kernel, bias = layer.get_weights()
+            gamma, beta, mean, var = nxt.get_weights()
+            a = gamma / np.sqrt(var + nxt.epsilon)
+            b = beta - mean * a
+            activation = layer.get_config()["activation"]
+            if activation == "linear" or (activation == "relu" and np.all(a > 0)):
+                config = layer.get_config()
+                config["name"] = layer.name + "_folded"
+                conv = Conv2D.from_config(config)
+                x = conv(x)
+                if activation == "linear":
+                    conv.set_weights([kernel * a, bias * a + b])
+                else:
+                    conv.set_weights([kernel * a, bias * a])
+                    shift = ChannelBias(name=nxt.name + "_shift")
+                    x = shift(x)
+                    shift.set_weights([b])
+                folded += 1
+                i += 2
+                continue
+        x = _clone(layer, x)
+        i += 1
+    print(f"[INFO] Đã gộp {folded} lớp BatchNormalization")
+    return Model(inp, x)
+
+def sample_frames(data, n, exclude=None, seed=SEED):
+    """Lấy ngẫu nhiên (cố định seed) n frame float32 từ FrameView."""
+    rng = np.random.RandomState(seed)
+    candidates = np.arange(len(data))
+    if exclude is not None and len(exclude) < len(data):
+        candidates = np.setdiff1d(candidates, exclude)
+    idx = np.sort(rng.choice(candidates, size=min(n, len(candidates)), replace=False))
+    return idx, data[idx]
+
+def export_tflite(folded, path, calibration=None):
+    """Export TFLite (float, hoặc INT8 nếu có dữ liệu hiệu chỉnh)."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(folded)
+    if calibration is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([frame[np.newaxis]] for frame in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    print(f"[SUCCESS] Đã lưu: {path}")
+
+def export_savedmodel(model, path):
+    """SavedModel (endpoint serve, batch động): nạp nhanh hơn .h5 vì không dựng lại model Keras."""
+    model.export(path, format="tf_saved_model", verbose=False)
+    print(f"[SUCCESS] Đã lưu: {path}")
+
+def export_onnx(folded, path):
+    try:
+        import tf2onnx
+    except ImportError:
+        print("[WARNING] Chưa cài tf2onnx (pip install tf2onnx onnxruntime), bỏ qua ONNX.")
+        return False
+    spec = (tf.TensorSpec((None,) + tuple(folded.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(folded, input_signature=spec, opset=13, output_path=path)
+    print(f"[SUCCESS] Đã lưu: {path}")
+    return True
+
+def verify(backends, frames, reference_mse, model_path=MODEL_PATH):
+    """So sánh MSE từng frame của mỗi backend với Keras gốc."""
+    ok = True
+    for name in backends:
+        backend = load_backend(name, model_path)
+        recon = np.concatenate([backend.predict(frames[i:i + 32]) for i in range(0, len(frames), 32)])
+        mse = np.mean(np.square(frames - recon), axis=(1, 2, 3))
+        rel = np.max(np.abs(mse - reference_mse) / np.maximum(reference_mse, 1e-12))
+        passed = rel <= MSE_TOLERANCE[name]
+        ok = ok and passed
+        print(f"[{'OK' if passed else 'FAIL'}] {name}: sai lệch MSE tương đối max {rel:.2e} "
+              f"(cho phép {MSE_TOLERANCE[name]:.0e})")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model sang SavedModel, TFLite (float/INT8) và ONNX")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--no-onnx", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print("[ERROR] Chưa có model! Hãy chạy train_autoencoder.py trước.")
+        return 1
+    model = load_model(args.model, compile=False)
+
+    data = get_training_data(args.data, clip_length=model.input_shape[-1])
+    if data is None or len(data) == 0:
+        print("[ERROR] Cần dữ liệu train để hiệu chỉnh INT8 và kiểm tra sai số.")
+        return 1
+    calib_idx, calibration = sample_frames(data, CALIBRATION_SAMPLES)
+    _, verify_frames = sample_frames(data, VERIFY_SAMPLES, exclude=calib_idx, seed=SEED + 1)
+
+    # TFLite: batch cố định = 1 (kích thước tĩnh, chạy tốt với XNNPack)
+    export_tflite(fold_batchnorm(model, batch_size=1), artifact_path(args.model, "tflite"))
+    export_tflite(fold_batchnorm(model, batch_size=1), artifact_path(args.model, "tflite_int8"), calibration)
+    export_savedmodel(model, artifact_path(args.model, "savedmodel"))
+    exported = ["savedmodel", "tflite", "tflite_int8"]
+    if not args.no_onnx and export_onnx(fold_batchnorm(model), artifact_path(args.model, "onnx")):
+        exported.append("onnx")
+
+    # Kiểm tra sai số so với Keras
+    reference = model.predict(verify_frames, verbose=0)
+    reference_mse = np.mean(np.square(verify_frames - reference), axis=(1, 2, 3))
+    return 0 if verify(exported, verify_frames, reference_mse, args.model) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
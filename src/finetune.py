@@ -0,0 +1,121 @@
+import os
+import time
+import shutil
+import argparse
+from tensorflow.keras.callbacks import EarlyStopping
+from tensorflow.keras.models import load_model
+from tensorflow.keras.optimizers import Adam
+from dataset import get_training_data, FrameView
+from data_pipeline import split_sources, make_replay_dataset, make_dataset
+from inference import load_backend
+from evaluate import calibrate_threshold, THRESHOLD_METHOD
+from train_autoencoder import (source_manifest, load_manifest, save_manifest,
+                               load_optimizer_state, save_optimizer_state,
+                               MODEL_SAVE_PATH, OPTIMIZER_STATE_PATH, MANIFEST_PATH)
+
+# --- CẤU HÌNH ---
+DATA_PATH = os.path.join("data", "ucsd", "train")
+THRESHOLD_PATH = os.path.join("outputs", "models", "threshold.txt")
+BACKUP_PATH = os.path.join("outputs", "models", "anomaly_detector_prev.h5")
+
+# Fine-tune ngắn trên nguồn mới/thay đổi, trộn REPLAY_RATIO mẫu cũ để không quên cảnh cũ
+EPOCHS = 3
+BATCH_SIZE = 64
+LEARNING_RATE = 2e-4       # Nhỏ hơn lúc train từ đầu: chỉ chỉnh model cho cảnh mới
+REPLAY_RATIO = 0.3
+PATIENCE = 2
+
+def changed_sources(data, manifest):
+    """Chỉ số các nguồn mới hoặc đã thay đổi so với manifest (chữ ký cache khác)."""
+    trained = manifest.get("sources", {})
+    current = source_manifest(data)
+    return [i for i, p in enumerate(data.sources)
+            if trained.get(os.path.abspath(p), {}).get("cache") != current[os.path.abspath(p)]["cache"]]
+
+def restore_model(learning_rate, model_path=MODEL_SAVE_PATH):
+    """
+    Model để fine-tune: trọng số tốt nhất (model_path) + moment Adam của lần train trước
+    (OPTIMIZER_STATE_PATH, nếu có), learning rate cố định mới.
+    """
+    model = load_model(model_path, compile=False)
+    model.compile(optimizer=Adam(learning_rate=learning_rate), loss="mse")
+    if load_optimizer_state(model):
+        print(f"[INFO] Đã khôi phục trạng thái optimizer từ {OPTIMIZER_STATE_PATH}")
+    else:
+        print("[WARNING] Không có trạng thái optimizer: fine-tune với moment Adam rỗng.")
+    return model
+
+def merge_views(views):
+    views = [v for v in views if v is not None]
+    return FrameView([a for v in views for a in v.arrays], [n for v in views for n in v.names],
+                     views[0].clip_length, [s for v in views for s in v.sources])
+
+def finetune(data_paths, epochs=EPOCHS, batch_size=BATCH_SIZE, learning_rate=LEARNING_RATE,
+             replay_ratio=REPLAY_RATIO, full=False):
+    if not os.path.exists(MODEL_SAVE_PATH):
+        print("[ERROR] Chưa có model! Hãy chạy train_autoencoder.py trước.")
+        return
+
+    start = time.perf_counter()
+    model = restore_model(learning_rate)
+    clip_length = int(model.input_shape[-1])
+
+    # 1. Dữ liệu: cache chỉ decode các nguồn mới/thay đổi
+    views = [get_training_data(p, clip_length=clip_length) for p in data_paths]
+    if not any(v is not None and len(v) for v in views):
+        print("[ERROR] Không tìm thấy dữ liệu. Hãy kiểm tra lại folder data!")
+        return
+    data = merge_views(views)
+    manifest = load_manifest()
+    new_idx = list(range(len(data.arrays))) if full else changed_sources(data, manifest)
+    if not new_idx:
+        print("[INFO] Không có nguồn mới hoặc thay đổi so với manifest, không cần fine-tune.")
+        return
+    old_idx = [i for i in range(len(data.arrays)) if i not in new_idx]
+    print(f"[DATA] Nguồn mới/thay đổi: {[data.names[i] for i in new_idx]}")
+    print(f"[DATA] Nguồn cũ (replay {replay_ratio:.0%}): {[data.names[i] for i in old_idx]}")
+
+    # 2. Train/val trên nguồn mới, replay mẫu ngẫu nhiên từ nguồn cũ
+    new_view = FrameView([data.arrays[i] for i in new_idx], [data.names[i] for i in new_idx],
+                         clip_length, [data.sources[i] for i in new_idx])
+    train_arrays, val_arrays, _, _ = split_sources(new_view)
+    train_ds = make_replay_dataset(train_arrays, [data.windows[i] for i in old_idx], batch_size, replay_ratio)
+    val_ds = make_dataset(val_arrays, batch_size, shuffle=False)
+
+    # 3. Fine-tune (giữ trọng số có val_loss tốt nhất)
+    print("[INFO] Bắt đầu fine-tune...")
+    early_stopping = EarlyStopping(monitor="val_loss", patience=PATIENCE, restore_best_weights=True, verbose=1)
+    history = model.fit(train_ds, validation_data=val_ds, epochs=epochs, callbacks=[early_stopping])
+
+    # 4. Lưu model (bản cũ giữ ở BACKUP_PATH), trạng thái optimizer và manifest
+    shutil.copyfile(MODEL_SAVE_PATH, BACKUP_PATH)
+    model.save(MODEL_SAVE_PATH)
+    save_optimizer_state(model.optimizer)
+    manifest["sources"] = {**manifest.get("sources", {}), **source_manifest(data)}
+    manifest["finetuned"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    manifest["best_val_loss"] = float(min(history.history["val_loss"]))
+    save_manifest(manifest, MANIFEST_PATH)
+    print(f"[SUCCESS] Đã lưu model tại: {MODEL_SAVE_PATH} (bản cũ: {BACKUP_PATH})")
+
+    # 5. Hiệu chỉnh lại ngưỡng trên toàn bộ dữ liệu bình thường (cũ + mới), một lượt stream
+    print("[INFO] Đang hiệu chỉnh lại ngưỡng...")
+    threshold, stats, _ = calibrate_threshold(load_backend("keras", MODEL_SAVE_PATH), data)
+    with open(THRESHOLD_PATH, "w") as f:
+        f.write(str(threshold))
+    print(f"[KẾT QUẢ] {stats.n} frame | Mean: {stats.mean:.6f} | Std: {stats.std:.6f} | "
+          f"Ngưỡng ({THRESHOLD_METHOD}): {threshold:.6f}")
+    print(f"[INFO] Đã lưu giá trị ngưỡng vào: {THRESHOLD_PATH}")
+    print(f"[SUCCESS] Fine-tune xong trong {time.perf_counter() - start:.1f}s")
+    print("[INFO] Nếu dùng backend tflite/onnx, chạy lại export_model.py để cập nhật.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tune model trên footage bình thường mới (camera đổi cảnh)")
+    parser.add_argument("--data", action="append",
+                        help="Thư mục dữ liệu (lặp lại được). Mặc định: DATA_PATH")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--lr", type=float, default=LEARNING_RATE)
+    parser.add_argument("--replay", type=float, default=REPLAY_RATIO, help="Tỉ lệ mẫu cũ trong mỗi batch")
+    parser.add_argument("--all", action="store_true", help="Fine-tune trên mọi nguồn (bỏ qua manifest)")
+    args = parser.parse_args()
+    finetune(args.data or [DATA_PATH], args.epochs, args.batch_size, args.lr, args.replay, args.all)
@@ -0,0 +1,289 @@
+import os
+import glob
+import time
+import cv2
+import numpy as np
+
+# --- CẤU HÌNH ---
+RESIZE = (128, 128)
+# Nội suy khi thu nhỏ. INTER_AREA chống răng cưa tốt hơn nhưng đo được chậm hơn INTER_LINEAR 3-6 lần
+# ở 128x128 với hệ số không nguyên; đổi thì phải train lại model (dữ liệu train dùng cùng hàm này).
+INTERPOLATION = cv2.INTER_LINEAR
+# Phiên bản tiền xử lý: tăng khi kết quả to_gray_small thay đổi -> cache frame/điểm tự làm mới
+PREPROCESS_VERSION = 2
+DEFAULT_FPS = 10.0           # FPS khi nguồn không cho biết (UCSD quay ở ~10 FPS)
+IMAGE_EXTENSIONS = ("*.tif", "*.jpg", "*.png")
+
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                  8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+def preprocess_key():
+    """Mô tả tiền xử lý đưa vào khoá cache (dataset, score cache)."""
+    return {"version": PREPROCESS_VERSION, "interpolation": int(INTERPOLATION)}
+
+def list_images(folder_path):
+    """Danh sách file ảnh (tif, jpg, png) trong folder, đã sắp xếp."""
+    return sorted(p for ext in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(folder_path, ext)))
+
+def to_gray_small(frame, resize=RESIZE, out=None, small=None):
+    """
+    Ảnh xám uint8 kích thước resize từ frame BGR hoặc xám.
+    Frame màu: thu nhỏ TRƯỚC rồi mới đổi sang xám (cvtColor trên ảnh 128x128 thay vì cả frame),
+    khác thứ tự cũ tối đa 1 mức xám. out / small: buffer dùng lại giữa các frame (tránh cấp phát).
+    """
+    if frame.ndim == 3:
+        small = cv2.resize(frame, resize, dst=small, interpolation=INTERPOLATION)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=out)
+    return cv2.resize(frame, resize, dst=out, interpolation=INTERPOLATION)
+
+def reduced_factor(shape, resize=RESIZE):
+    """Hệ số giải mã thu nhỏ lớn nhất (1, 2, 4, 8) mà ảnh vẫn không nhỏ hơn resize."""
+    h, w = shape[:2]
+    factor = 1
+    for k in (2, 4, 8):
+        if w // k >= resize[0] and h // k >= resize[1]:
+            factor = k
+    return factor
+
+def read_image_small(path, resize=RESIZE, factor=1, out=None, small=None):
+    """Đọc ảnh đã thu nhỏ; factor >= 2 dùng IMREAD_REDUCED_GRAYSCALE_* (JPEG giải mã thẳng ở độ phân giải thấp)."""
+    if factor > 1:
+        img = cv2.imread(path, _REDUCED_FLAGS[factor])
+    else:
+        img = cv2.imread(path)
+    if img is None:
+        return None
+    return to_gray_small(img, resize, out, small)
+
+class FrameSource:
+    """
+    Nguồn frame chung (folder ảnh, video file, camera, live giả lập).
+    - read(): frame BGR đầy đủ (để hiển thị / render), None khi hết.
+    - grab(): bỏ qua một frame KHÔNG giải mã màu (cap.grab), False khi hết.
+    - read_small(): ảnh xám uint8 RESIZE (đường nhanh cho frame cần chấm), None khi hết.
+    - read_input(): như read_small nhưng float32 [0, 1] (đầu vào model).
+    Buffer trả về bởi read_small/read_input được DÙNG LẠI ở lần đọc sau (copy nếu cần giữ),
+    trừ khi truyền out riêng.
+    """
+    is_live = False
+
+    def __init__(self, resize=RESIZE):
+        self.resize = resize
+        self.fps = DEFAULT_FPS
+        self.frame_count = 0
+        self.size = (0, 0)
+        self.index = 0       # Số frame đã đi qua (đọc hoặc bỏ qua)
+        self._small = None   # Buffer màu 128x128 trung gian
+        self._gray = np.empty((resize[1], resize[0]), dtype=np.uint8)
+        self._input = np.empty((resize[1], resize[0]), dtype=np.float32)
+
+    def read(self):
+        raise NotImplementedError
+
+    def grab(self):
+        return self.read() is not None
+
+    def read_small(self, out=None):
+        frame = self.read()
+        if frame is None:
+            return None
+        return self.preprocess_small(frame, out)
+
+    def read_input(self, out=None):
+        gray = self.read_small()
+        if gray is None:
+            return None
+        return np.divide(gray, 255.0, out=self._input if out is None else out, dtype=np.float32)
+
+    def preprocess_small(self, frame, out=None):
+        """Ảnh xám RESIZE của một frame BGR đã đọc (vào buffer dùng lại nếu out=None)."""
+        if frame.ndim == 3:
+            if self._small is None:
+                self._small = np.empty((self.resize[1], self.resize[0], 3), dtype=np.uint8)
+            return to_gray_small(frame, self.resize, self._gray if out is None else out, self._small)
+        return to_gray_small(frame, self.resize, self._gray if out is None else out)
+
+    def preprocess_input(self, frame, out=None):
+        """Đầu vào model float32 [0, 1] của một frame BGR đã đọc; out có thể là view (vd. batch[n, :, :, 0])."""
+        return np.divide(self.preprocess_small(frame), 255.0,
+                         out=self._input if out is None else out, dtype=np.float32)
+
+    def release(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class ImageFolderSource(FrameSource):
+    """Folder ảnh (UCSD). grab() chỉ tăng chỉ số, read_small() giải mã thu nhỏ nếu ảnh đủ lớn."""
+    def __init__(self, folder, resize=RESIZE, fps=DEFAULT_FPS):
+        super().__init__(resize)
+        self.paths = list_images(folder)
+        self.fps = fps
+        self.frame_count = len(self.paths)
+        self.factor = 1
+        self._small = np.empty((resize[1], resize[0], 3), dtype=np.uint8)
+        if self.paths:
+            first = cv2.imread(self.paths[0])
+            if first is not None:
+                self.size = (first.shape[1], first.shape[0])
+                self.factor = reduced_factor(first.shape, resize)
+
+    def read(self):
+        # Ảnh đọc lỗi (None) bị bỏ qua như dataset.load_image_sequence
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return frame
+        return None
+
+    def grab(self):
+        if self.index >= len(self.paths):
+            return False
+        self.index += 1
+        return True
+
+    def read_small(self, out=None):
+        while self.index < len(self.paths):
+            gray = read_image_small(self.paths[self.index], self.resize, self.factor,
+                                    self._gray if out is None else out, self._small)
+            self.index += 1
+            if gray is not None:
+                return gray
+        return None
+
+class VideoSource(FrameSource):
+    """Video file hoặc camera (cv2.VideoCapture). grab() không giải mã ra ảnh BGR."""
+    def __init__(self, path, resize=RESIZE):
+        super().__init__(resize)
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = DEFAULT_FPS if fps == 0 or np.isnan(fps) else fps
+        self.frame_count = max(int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        self.size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self._frame = None   # Buffer BGR cho cap.read (dùng lại khi người gọi không giữ frame)
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        self.index += 1
+        return frame
+
+    def grab(self):
+        if not self.cap.grab():
+            return False
+        self.index += 1
+        return True
+
+    def read_small(self, out=None):
+        ret, self._frame = self.cap.read(self._frame)
+        if not ret:
+            return None
+        self.index += 1
+        return self.preprocess_small(self._frame, out)
+
+    def seek(self, index):
+        """
+        Nhảy tới frame index (CAP_PROP_POS_FRAMES). Trả về False nếu backend không đặt đúng vị trí
+        (đã kiểm tra chính xác từng frame với ffmpeg trên mp4/avi; luồng mạng/camera thì không seek được).
+        """
+        ok = self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.index = index
+        return ok and int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) == index
+
+    def release(self):
+        self.cap.release()
+
+class LiveSource(VideoSource):
+    """
+    Giả lập camera từ video file: phát đúng FPS của video, hết video thì quay lại đầu
+    (chạy vô hạn). Chậm hơn nguồn thì không dồn nợ thời gian.
+    """
+    is_live = True
+
+    def __init__(self, path, resize=RESIZE):
+        super().__init__(path, resize)
+        self.interval = 1.0 / self.fps
+        self.next_due = time.perf_counter()
+
+    def _wait(self):
+        delay = self.next_due - time.perf_counter()
+        if delay > 0: time.sleep(delay)
+        self.next_due = max(self.next_due + self.interval, time.perf_counter() - self.interval)
+
+    def _rewind(self):
+        # Hết video: quay lại đầu như một camera chạy liên tục
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def read(self):
+        self._wait()
+        frame = super().read()
+        if frame is None:
+            self._rewind()
+            frame = super().read()
+        return frame
+
+    def grab(self):
+        self._wait()
+        if super().grab():
+            return True
+        self._rewind()
+        return super().grab()
+
+    def read_small(self, out=None):
+        self._wait()
+        gray = super().read_small(out)
+        if gray is None:
+            self._rewind()
+            gray = super().read_small(out)
+        return gray
+
+class CameraSource(VideoSource):
+    """Webcam cục bộ (cam:<index>)."""
+    is_live = True
+
+def open_source(spec, resize=RESIZE):
+    """
+    Mở nguồn frame theo chuỗi mô tả:
+    - folder ảnh (UCSD), video file;
+    - "live:<video>": phát lại video theo FPS, lặp vô hạn (giả lập camera);
+    - "cam:<index>": webcam cục bộ.
+    """
+    if spec.startswith("cam:"):
+        return CameraSource(int(spec[4:]), resize)
+    if spec.startswith("live:"):
+        return LiveSource(spec[5:], resize)
+    if os.path.isdir(spec):
+        return ImageFolderSource(spec, resize)
+    return VideoSource(spec, resize)
+
+def iter_scheduled(source, should_score, out=None):
+    """
+    Duyệt nguồn theo lịch chấm: should_score(i) -> bool quyết định TRƯỚC khi giải mã frame i.
+    Frame không chấm chỉ grab(); frame chấm đọc thẳng ảnh xám thu nhỏ.
+    Yield (i, gray hoặc None). gray là buffer dùng lại (copy nếu cần giữ).
+    """
+    i = 0
+    while True:
+        if should_score(i):
+            gray = source.read_small(out)
+            if gray is None:
+                return
+            yield i, gray
+        else:
+            if not source.grab():
+                return
+            yield i, None
+        i += 1
@@ -1,168 +1,384 @@
+import time
+_BOOT = time.perf_counter()  # Mốc khởi động (trước các import nặng) cho báo cáo startup
 import gradio as gr
 import cv2
 import numpy as np
 import os
-import winsound  
-from tensorflow.keras.models import load_model
-from moviepy.editor import VideoFileClip, AudioClip
+import threading
+import functools
+import alerts
+from startup import StartupReport, warm_up
+from frame_source import VideoSource, preprocess_key
+from inference import load_backend, artifact_path, resolve_backend, import_runtime
+from motion_gate import AdaptiveSkipper
+from localization import BlockLocalizer
+from optical_flow import FlowExtractor, FLOW_METHOD
+from clips import ClipBuffer, clip_length_of
+from video_writer import open_writer, add_alert_audio
+from jobs import JobManager, QUEUED, DONE, CANCELLED
+from score_cache import ScoreCache, ScoreRecord, file_hash, cache_key
+
+startup_report = StartupReport("gradio_app", _BOOT)
+startup_report.add("import", time.perf_counter() - _BOOT)
 
 # --- CẤU HÌNH ---
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Backend: biến môi trường ANOMALY_BACKEND (keras | savedmodel | tflite | tflite_int8 | onnx | auto).
+# auto = artifact khởi động nhanh nhất đã export (onnx/tflite không cần import TensorFlow), không có thì .h5
+APP_BACKEND = os.environ.get("ANOMALY_BACKEND", "auto")
+
 # Các đường dẫn Input
 MODEL_PATH = os.path.join(BASE_DIR, "outputs", "models", "anomaly_detector.h5")
 THRESHOLD_PATH = os.path.join(BASE_DIR, "outputs", "models", "threshold.txt")
+FLOW_THRESHOLD_PATH = os.path.join(BASE_DIR, "outputs", "models", "flow_threshold.txt")
 
 # --- CẤU HÌNH OUTPUT  ---
 OUTPUT_DIR = os.path.join(BASE_DIR, "outputs", "videos")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Đường dẫn file tạm và file kết quả nằm trong thư mục này
-TEMP_VIDEO_PATH = os.path.join(OUTPUT_DIR, "temp_video_silent.mp4") 
-OUTPUT_VIDEO_PATH = os.path.join(OUTPUT_DIR, "result_final.mp4")
+# Tên file tạm và file kết quả (mỗi job ghi vào thư mục riêng trong JOBS_DIR)
+TEMP_VIDEO_NAME = "temp_video_silent.mp4"
+OUTPUT_VIDEO_NAME = "result_final.mp4"
+JOBS_DIR = os.path.join(OUTPUT_DIR, "jobs")
+
+# Đường dẫn mặc định khi gọi process_video trực tiếp (không qua hàng đợi job)
+TEMP_VIDEO_PATH = os.path.join(OUTPUT_DIR, TEMP_VIDEO_NAME) 
+OUTPUT_VIDEO_PATH = os.path.join(OUTPUT_DIR, OUTPUT_VIDEO_NAME)
+
+# Cập nhật tiến độ (đường MSE + ảnh xem trước) cho giao diện mỗi PROGRESS_INTERVAL giây
+PROGRESS_INTERVAL = 0.5
+PREVIEW_WIDTH = 480
+CURVE_SIZE = (640, 160)
+TIMELINE_HEIGHT = 8     # Dải timeline frame bất thường ở đáy đường MSE
+
+# Số frame (đến lượt chạy model) gom lại cho một lần forward
+INFER_BATCH_SIZE = 16
+
+# Frame Skipping (Tăng tốc): chạy model theo mức chuyển động của cảnh.
+# ADAPTIVE_SKIP = False -> lịch cố định 1 trên (SKIP_FRAMES + 1) frame như cũ.
+ADAPTIVE_SKIP = True
+SKIP_FRAMES = 2
+
+# Số hash nội dung video giữ trong bộ nhớ (mỗi upload của Gradio là một file tạm mới -> phải có giới hạn)
+VIDEO_HASH_MEMO = 64
+
+# Điểm phụ optical flow (chuyển động nhanh bất thường), dùng khi đã có flow_threshold.txt (evaluate.py)
+FLOW_SCORE = True
 
 # Biến toàn cục
-model = None
+backend = None
+backend_name = None
 default_threshold = 0.0035
+flow_threshold = None
+model_version = None      # SHA-1 file model, một phần khoá cache điểm
+_resource_lock = threading.Lock()
+
+# Cache điểm từng frame theo (nội dung video, model, cấu hình) -> đổi ngưỡng không cần chạy lại model
+score_cache = ScoreCache(os.path.join(BASE_DIR, "outputs", "score_cache"))
+
+@functools.lru_cache(maxsize=VIDEO_HASH_MEMO)
+def _video_hash(path, size, mtime):
+    # size, mtime chỉ để làm khoá: file đổi nội dung thì tính lại hash
+    return file_hash(path)
 
 def load_resources():
-    global model, default_threshold
-    if model is None:
-        if os.path.exists(MODEL_PATH):
-            model = load_model(MODEL_PATH, compile=False)
-        else:
-            if os.path.exists("anomaly_detector.h5"):
-                model = load_model("anomaly_detector.h5", compile=False)
+    global backend, default_threshold, flow_threshold
+    with _resource_lock:
+        _load_resources()
+
+def _load_resources():
+    global backend, backend_name, model_version, default_threshold, flow_threshold
+    if backend is None:
+        for path in (MODEL_PATH, "anomaly_detector.h5"):
+            name = resolve_backend(APP_BACKEND, path)
+            if os.path.exists(artifact_path(path, name)):
+                with startup_report.phase("import_runtime"):
+                    import_runtime(name)
+                with startup_report.phase("load_model"):
+                    backend = load_backend(name, path)
+                backend_name = name
+                model_version = file_hash(artifact_path(path, name))
+                # Lần forward đầu (trace graph, cấp phát) chạy lúc khởi động, không rơi vào request đầu tiên
+                with startup_report.phase("warm_up"):
+                    startup_report.info["first_inference_s"] = round(warm_up(backend, (INFER_BATCH_SIZE, 1)), 4)
+                startup_report.info["backend"] = name
+                break
     
     if os.path.exists(THRESHOLD_PATH):
         with open(THRESHOLD_PATH, "r") as f:
             try: default_threshold = float(f.read().strip())
             except: pass
 
-def process_video(video_path, threshold_value):
+    if FLOW_SCORE and os.path.exists(FLOW_THRESHOLD_PATH):
+        with open(FLOW_THRESHOLD_PATH, "r") as f:
+            try: flow_threshold = float(f.read().strip())
+            except: pass
+
+def draw_mse_curve(values, threshold, size=CURVE_SIZE, timeline=None):
+    """
+    Vẽ đường MSE theo frame (cv2, rẻ hơn matplotlib) kèm ngưỡng. Trả về ảnh RGB.
+    timeline (tuỳ chọn): dải đỏ ở đáy đánh dấu các frame bất thường.
+    """
+    w, h = size
+    img = np.full((h, w, 3), 255, dtype=np.uint8)
+    if len(values) == 0:
+        return img
+    values = np.asarray(values, dtype=np.float32)
+    top = max(float(values.max()), threshold) * 1.1 or 1.0
+    # Gộp về tối đa w điểm (lấy max mỗi đoạn để không mất đỉnh)
+    if len(values) > w:
+        values = values[:len(values) // w * w].reshape(w, -1).max(axis=1)
+    xs = np.linspace(0, w - 1, len(values)).astype(np.int32)
+    ys = (h - 1 - values / top * (h - 1)).astype(np.int32)
+    ty = int(h - 1 - threshold / top * (h - 1))
+    cv2.line(img, (0, ty), (w - 1, ty), (255, 0, 0), 1)
+    cv2.polylines(img, [np.stack([xs, ys], axis=1)], False, (0, 0, 255), 1)
+    if timeline is not None and len(timeline):
+        # Cột x nào có frame bất thường thì tô đỏ
+        cols = (np.flatnonzero(timeline) * w // len(timeline)).astype(np.int32)
+        img[h - TIMELINE_HEIGHT:, cols] = (255, 0, 0)
+    return img
+
+def _preview(frame):
+    h, w = frame.shape[:2]
+    if w > PREVIEW_WIDTH:
+        frame = cv2.resize(frame, (PREVIEW_WIDTH, int(h * PREVIEW_WIDTH / w)), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+def _make_skipper():
+    # Bộ lập lịch chạy model (Frame Skipping)
+    if ADAPTIVE_SKIP:
+        return AdaptiveSkipper(fixed_skip=SKIP_FRAMES)
+    return AdaptiveSkipper(SKIP_FRAMES, SKIP_FRAMES, fixed_skip=SKIP_FRAMES)
+
+def video_cache_key(video_path):
+    """Khoá cache điểm của video: nội dung file + file model + cấu hình chấm điểm."""
+    stat = os.stat(video_path)
+    config = {"backend": backend_name, "adaptive": ADAPTIVE_SKIP, "skip": SKIP_FRAMES, "localizer": "block",
+              "preprocess": preprocess_key(),
+              "flow": FLOW_METHOD if FLOW_SCORE and flow_threshold is not None else None}
+    return cache_key(_video_hash(video_path, stat.st_size, stat.st_mtime), model_version, config)
+
+def _score_frames(source, skipper, scale):
+    """
+    Đọc video và chạy model theo batch. Yield (frame, scored, mse, flow_score, boxes) theo thứ tự frame.
+    Khung ứng viên tính cho MỌI frame được chấm (không phụ thuộc ngưỡng) để lưu cache.
+    """
+    # Flow tính trên MỌI frame (128x128, rẻ) để luôn là flow giữa 2 frame liên tiếp
+    flow = FlowExtractor() if FLOW_SCORE and flow_threshold is not None else None
+
+    # Model clip (T frame xếp theo channel): ring buffer các frame đã tiền xử lý
+    clip_length = clip_length_of(backend)
+    clips = ClipBuffer(clip_length) if clip_length > 1 else None
+    batch = np.empty((INFER_BATCH_SIZE, 128, 128, clip_length), dtype=np.float32)
+    localizer = BlockLocalizer()
+
+    while True:
+        # 1. Đọc một cửa sổ frame, tiền xử lý các frame đến lượt chạy model
+        window = []
+        n = 0
+        while n < INFER_BATCH_SIZE:
+            frame = source.read()
+            if frame is None: break
+            # CHỈ CHẠY MODEL KHI ĐẾN LƯỢT
+            scored = skipper.should_score(frame)
+            flow_score = None
+            if flow is not None:
+                flow.update(frame)
+                if scored: flow_score = flow.score()
+            if clips is not None:
+                # Mỗi frame chỉ tiền xử lý 1 lần; clip là view của ring buffer, chép thẳng vào batch
+                clips.push(source.preprocess_input(frame))
+                if scored: batch[n] = clips.clip()
+            elif scored:
+                source.preprocess_input(frame, out=batch[n, :, :, 0])
+            if scored: n += 1
+            window.append((frame, scored, flow_score))
+        if not window: return
+
+        # 2. Một lần forward cho cả batch
+        if n:
+            reconstructed = backend.predict(batch[:n])
+        k = 0
+        for frame, scored, flow_score in window:
+            if scored:
+                diff = np.abs(batch[k:k + 1] - reconstructed[k:k + 1])
+                k += 1
+                mse = np.mean(np.square(diff))
+                yield frame, True, mse, flow_score, localizer(diff[0, :, :, -1], *scale)
+            else:
+                yield frame, False, 0.0, None, []
+
+def _cached_frames(source, record):
+    """Giống _score_frames nhưng lấy điểm/khung từ cache: chỉ giải mã video, không chạy model."""
+    for i in range(len(record)):
+        frame = source.read()
+        if frame is None: return
+        if record.scored[i]:
+            flow_score = None if np.isnan(record.flow[i]) else float(record.flow[i])
+            yield frame, True, record.mse[i], flow_score, record.boxes(i)
+        else:
+            yield frame, False, 0.0, None, []
+
+def preview_threshold(video_path, threshold_value):
+    """
+    Xem trước tức thì khi kéo thanh ngưỡng: nếu video đã được chấm điểm (có cache)
+    thì áp ngưỡng mới lên điểm đã lưu, trả về nhãn, thống kê và timeline mà không render.
+    """
+    if video_path is None or backend is None:
+        return gr.skip(), gr.skip(), gr.skip()
+    record = score_cache.get(video_cache_key(video_path))
+    if record is None:
+        return gr.skip(), gr.skip(), gr.skip()
+    labels, curve, _ = record.labels(threshold_value, flow_threshold)
+    anom_count = int(labels.sum())
+    ratio = 100 * anom_count / len(labels) if len(labels) else 0
+    badge = "⚠️ CẢNH BÁO" if anom_count else "✅ AN TOÀN"
+    status = (f"Xem trước (điểm đã lưu) với ngưỡng `{threshold_value:.4f}`: "
+              f"`{anom_count}` frame bất thường (`{ratio:.1f}%`). Bấm PHÂN TÍCH để render video.")
+    return badge, status, draw_mse_curve(curve, threshold_value, timeline=labels)
+
+def analyze_video(video_path, threshold_value, out_dir=OUTPUT_DIR, cancel_event=None):
+    """
+    Phân tích video dạng generator: yield tiến độ (frame, đường MSE, ảnh xem trước)
+    mỗi PROGRESS_INTERVAL giây, cuối cùng yield kết quả (done=True).
+    Mọi file ghi vào out_dir nên nhiều job chạy song song không ghi đè nhau.
+    Điểm từng frame được cache theo (video, model): đổi ngưỡng chỉ render lại, không chạy model.
+    """
     load_resources()
-    if video_path is None: 
-        return None, "LỖI", "Vui lòng upload video!"
+    temp_video_path = os.path.join(out_dir, TEMP_VIDEO_NAME)
+    output_video_path = os.path.join(out_dir, OUTPUT_VIDEO_NAME)
 
-    cap = cv2.VideoCapture(video_path)
+    source = VideoSource(video_path)
     
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps    = cap.get(cv2.CAP_PROP_FPS)
+    width, height = source.size
+    fps    = source.cap.get(cv2.CAP_PROP_FPS)
     if fps == 0 or np.isnan(fps): fps = 24.0
+    total_frames = source.frame_count
+
+    key = video_cache_key(video_path)
+    record = score_cache.get(key)
+    if record is not None:
+        print(f"[INFO] Dùng điểm đã cache ({key}), bỏ qua model.")
+        schedule = record.meta.get("schedule", "")
+        frames = _cached_frames(source, record)
+        recorder = None
+        # Timeline với ngưỡng mới có ngay, trước khi render
+        labels, curve, _ = record.labels(threshold_value, flow_threshold)
+        yield {"done": False, "frame": 0, "total": total_frames, "fps": 0.0, "anomalies": int(labels.sum()),
+               "curve": draw_mse_curve(curve, threshold_value, timeline=labels), "preview": None}
+    else:
+        skipper = _make_skipper()
+        frames = _score_frames(source, skipper, (width / 128, height / 128))
+        recorder = ScoreRecord()
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v') 
     # Lưu vào đường dẫn mới trong outputs/videos
-    out = cv2.VideoWriter(TEMP_VIDEO_PATH, fourcc, fps, (width, height))
+    # (frame được pipe thẳng vào ffmpeg/libx264 trong lúc phân tích)
+    out = open_writer(temp_video_path, fps, (width, height))
 
     max_error = 0
     frame_count = 0
     anom_count = 0
     anomaly_timeline = []
+    mse_curve = []
 
-    # Cấu hình Frame Skipping (Tăng tốc)
-    SKIP_FRAMES = 2
     last_label = "BINH THUONG"
     last_color = (0, 255, 0)
     last_mse = 0
     last_boxes = [] 
-    scale_x = width / 128
-    scale_y = height / 128
+    last_frame = None
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret: break
-        
-        # CHỈ CHẠY MODEL KHI ĐẾN LƯỢT
-        if frame_count % (SKIP_FRAMES + 1) == 0:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            gray_resized = cv2.resize(gray, (128, 128))
-            input_data = gray_resized.astype("float32") / 255.0
-            input_data = np.expand_dims(input_data, axis=0)
-            input_data = np.expand_dims(input_data, axis=-1)
-
-            reconstructed = model.predict(input_data, verbose=0)
-            
-            diff = np.abs(input_data - reconstructed)
-            mse = np.mean(np.square(diff))
-            if mse > max_error: max_error = mse
-
-            if mse > threshold_value:
-                last_label = "CANH BAO!"
-                last_color = (0, 0, 255) # Đỏ
-                anom_count += 1 
-                last_mse = mse
-                
-                # Tìm khung vẽ
-                last_boxes = [] 
-                diff_map = (diff[0, :, :, 0] * 255).astype(np.uint8)
-                _, thresh_img = cv2.threshold(diff_map, 30, 255, cv2.THRESH_BINARY)
-                cnts, _ = cv2.findContours(thresh_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                for c in cnts:
-                    if cv2.contourArea(c) > 10:
-                        x, y, w, h = cv2.boundingRect(c)
-                        last_boxes.append((int(x * scale_x), int(y * scale_y), int(w * scale_x), int(h * scale_y)))
-            else:
-                last_label = "BINH THUONG"
-                last_color = (0, 255, 0)
-                last_mse = mse
-                last_boxes = []
+    start_time = time.perf_counter()
+    last_progress = start_time
+    scored_count = 0
+    try:
+        # Áp nhãn, khung và overlay cho các frame theo đúng thứ tự
+        for frame, scored, mse, flow_score, boxes in frames:
+            if cancel_event is not None and cancel_event.is_set():
+                print("[INFO] Job bị huỷ.")
+                return
+            if recorder is not None:
+                recorder.add(scored, mse, flow_score, boxes)
+            if scored:
+                scored_count += 1
+                if mse > max_error: max_error = mse
 
-        else:
-            if last_label == "CANH BAO!":
-                anom_count += 1
+                if mse > threshold_value or (flow_score is not None and flow_score > flow_threshold):
+                    last_label = "CANH BAO!"
+                    last_color = (0, 0, 255) # Đỏ
+                    anom_count += 1 
+                    last_mse = mse
+                    last_boxes = boxes
+                else:
+                    last_label = "BINH THUONG"
+                    last_color = (0, 255, 0)
+                    last_mse = mse
+                    last_boxes = []
+
+            else:
+                if last_label == "CANH BAO!":
+                    anom_count += 1
 
-        anomaly_timeline.append(last_label == "CANH BAO!")
+            anomaly_timeline.append(last_label == "CANH BAO!")
+            mse_curve.append(last_mse)
 
-        # Vẽ lên frame
-        for (x, y, w, h) in last_boxes:
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+            # Vẽ lên frame
+            for (x, y, w, h) in last_boxes:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
 
-        cv2.rectangle(frame, (0, 0), (width, 40), (0, 0, 0), -1)
-        cv2.putText(frame, f"{last_label} | MSE: {last_mse:.4f}", (10, 30), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, last_color, 2)
+            cv2.rectangle(frame, (0, 0), (width, 40), (0, 0, 0), -1)
+            cv2.putText(frame, f"{last_label} | MSE: {last_mse:.4f}", (10, 30), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, last_color, 2)
         
-        out.write(frame)
-        frame_count += 1
+            out.write(frame)
+            frame_count += 1
+            last_frame = frame
         
-        if frame_count % 10 == 0 and last_label == "CANH BAO!":
-            try: winsound.Beep(1000, 50)
-            except: pass
+            if frame_count % 10 == 0 and last_label == "CANH BAO!":
+                alerts.beep(1000, 50)  # Không chặn vòng xử lý; tắt trên server không có âm thanh
+
+            # Tiến độ cho giao diện (giới hạn theo thời gian, không theo từng frame)
+            now = time.perf_counter()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                yield {"done": False, "frame": frame_count, "total": total_frames,
+                       "fps": frame_count / (now - start_time), "anomalies": anom_count,
+                       "curve": draw_mse_curve(mse_curve, threshold_value), "preview": _preview(last_frame)}
+    finally:
+        frames.close()
+        source.release()
+        out.release()
 
-    cap.release()
-    out.release()
+    elapsed = time.perf_counter() - start_time
+    analysis_fps = frame_count / elapsed if elapsed > 0 else 0.0
+    if recorder is not None:
+        schedule = skipper.summary()
+        print(f"[INFO] Phân tích {frame_count} frames ({scored_count} qua model) "
+              f"trong {elapsed:.2f}s -> {analysis_fps:.1f} FPS")
+        if frame_count:
+            recorder.meta = {"frames": frame_count, "fps": fps, "size": [width, height], "schedule": schedule}
+            score_cache.put(key, recorder)
+    else:
+        print(f"[INFO] Render lại {frame_count} frames từ cache trong {elapsed:.2f}s -> {analysis_fps:.1f} FPS")
+        schedule += " (điểm từ cache)"
+    print(f"[INFO] {schedule}")
 
     # --- HẬU KỲ: CHÈN ÂM THANH ---
+    # Video đã được encode H.264 trong lúc phân tích; chỉ tạo PCM cảnh báo (NumPy)
+    # và ghép vào bằng ffmpeg -c:v copy (không encode lại video).
     if len(anomaly_timeline) > 0:
         print("[INFO] Đang render âm thanh...")
-        timeline_arr = np.array(anomaly_timeline)
-
-        def make_audio(t):
-            t_obj = np.asanyarray(t)
-            idxs = (t_obj * fps).astype(int)
-            idxs = np.clip(idxs, 0, len(timeline_arr) - 1)
-            mask = timeline_arr[idxs]
-            
-            if t_obj.ndim == 0:
-                if mask: return float(np.sin(2 * np.pi * 800 * t_obj))
-                return 0.0
-            
-            audio_res = np.zeros_like(t_obj, dtype=np.float32)
-            audio_res[mask] = np.sin(2 * np.pi * 800 * t_obj[mask])
-            return audio_res
-
+        t0 = time.perf_counter()
         try:
-            video_clip = VideoFileClip(TEMP_VIDEO_PATH)
-            audio_clip = AudioClip(make_audio, duration=video_clip.duration)
-            final_video = video_clip.set_audio(audio_clip)
-            # Lưu vào outputs/videos
-            final_video.write_videofile(OUTPUT_VIDEO_PATH, codec="libx264", audio_codec="aac", logger=None)
-            return_video = OUTPUT_VIDEO_PATH
+            add_alert_audio(temp_video_path, output_video_path, anomaly_timeline, fps)
+            return_video = output_video_path
         except Exception as e:
             print(f"Lỗi render âm thanh: {e}")
-            return_video = TEMP_VIDEO_PATH
+            return_video = temp_video_path
+        print(f"[INFO] Chèn âm thanh: {time.perf_counter() - t0:.2f}s")
     else:
-        return_video = TEMP_VIDEO_PATH
+        return_video = temp_video_path
 
     # Báo cáo
     ratio = (anom_count / frame_count) * 100 if frame_count > 0 else 0
@@ -172,12 +388,66 @@ def process_video(video_path, threshold_value):
                   f"- **Trạng thái:** Bất thường (Có khoanh vùng lỗi).\n"
                   f"- **Sai số Max:** `{max_error:.5f}`\n"
                   f"- **Tỉ lệ lỗi:** `{ratio:.1f}%`\n"
-                  f"- **Lưu tại:** `{OUTPUT_VIDEO_PATH}`")
+                  f"- **Tốc độ phân tích:** `{analysis_fps:.1f} FPS`\n"
+                  f"- **Lập lịch:** {schedule}\n"
+                  f"- **Lưu tại:** `{return_video}`")
     else:
         badge = "✅ AN TOÀN"
-        status = f"Bình thường. MSE Max: `{max_error:.5f}`"
+        status = (f"Bình thường. MSE Max: `{max_error:.5f}`\n\n"
+                  f"Tốc độ phân tích: `{analysis_fps:.1f} FPS`\n\n"
+                  f"Lập lịch: {schedule}")
+
+    yield {"done": True, "video": return_video, "badge": badge, "status": status,
+           "curve": draw_mse_curve(mse_curve, threshold_value, timeline=anomaly_timeline),
+           "preview": _preview(last_frame) if frame_count else None}
+
+def process_video(video_path, threshold_value):
+    """Phân tích đồng bộ (không qua hàng đợi), ghi vào OUTPUT_DIR. Trả về (video, badge, status)."""
+    if video_path is None: 
+        return None, "LỖI", "Vui lòng upload video!"
+    result = None
+    for result in analyze_video(video_path, threshold_value):
+        pass
+    return result["video"], result["badge"], result["status"]
 
-    return return_video, badge, status
+# --- HÀNG ĐỢI JOB ---
+job_manager = JobManager(JOBS_DIR)
+
+def process_video_stream(video_path, threshold_value):
+    """
+    Handler cho giao diện: xếp job vào hàng đợi rồi stream vị trí chờ, tiến độ,
+    đường MSE và ảnh xem trước. Người dùng huỷ/đóng trang -> huỷ job.
+    """
+    if video_path is None:
+        yield None, "LỖI", "Vui lòng upload video!", None, None
+        return
+    job = job_manager.submit(analyze_video, video_path, threshold_value)
+    if job is None:
+        yield None, "⏳ QUÁ TẢI", "Hàng đợi đã đầy, vui lòng thử lại sau.", None, None
+        return
+    try:
+        version = 0
+        while not job.finished:
+            if job.status == QUEUED:
+                yield None, "⏳ ĐANG CHỜ", f"Vị trí trong hàng đợi: **{job_manager.position(job)}**", None, None
+            elif job.result is not None and not job.result["done"]:
+                r = job.result
+                percent = f" / {r['total']} ({100 * r['frame'] / r['total']:.0f}%)" if r["total"] > 0 else ""
+                yield (None, "⏳ ĐANG PHÂN TÍCH",
+                       f"Frame `{r['frame']}`{percent} | `{r['fps']:.1f} FPS` | Frame bất thường: `{r['anomalies']}`",
+                       r["curve"], r["preview"])
+            version = job.wait(version, timeout=1.0)
+        if job.status == DONE:
+            r = job.result
+            yield r["video"], r["badge"], r["status"], r["curve"], r["preview"]
+        elif job.status == CANCELLED:
+            yield None, "ĐÃ HUỶ", "Job đã bị huỷ.", None, None
+        else:
+            yield None, "LỖI", f"Lỗi khi phân tích: `{job.error}`", None, None
+    finally:
+        # Generator bị đóng (nút Huỷ hoặc mất kết nối) khi job chưa xong -> huỷ job
+        if not job.finished:
+            job_manager.cancel(job)
 
 # --- GIAO DIỆN ---
 load_resources()
@@ -188,13 +458,24 @@ with gr.Blocks(title="Hệ thống giám sát thông minh") as demo:
         with gr.Column():
             video_in = gr.Video(label="Input", sources=["upload"])
             slider = gr.Slider(0.001, 0.01, default_threshold, step=0.0001, label="Ngưỡng")
-            btn = gr.Button("🚀 PHÂN TÍCH", variant="primary")
+            with gr.Row():
+                btn = gr.Button("🚀 PHÂN TÍCH", variant="primary")
+                cancel_btn = gr.Button("⛔ HUỶ")
+            preview = gr.Image(label="Xem trước", type="numpy")
         with gr.Column():
             video_out = gr.Video(label="Output")
             badge = gr.Label()
             text = gr.Markdown()
+            curve = gr.Image(label="MSE theo frame", type="numpy")
+
+    # Giới hạn song song do JobManager đảm nhận (để báo được vị trí hàng đợi)
+    run_event = btn.click(process_video_stream, [video_in, slider], [video_out, badge, text, curve, preview],
+                          concurrency_limit=None)
+    cancel_btn.click(None, None, None, cancels=[run_event])
+    # Kéo ngưỡng: xem trước ngay từ điểm đã cache (không chạy model, không render)
+    slider.release(preview_threshold, [video_in, slider], [badge, text, curve], concurrency_limit=None)
 
-    btn.click(process_video, [video_in, slider], [video_out, badge, text])
+startup_report.save(os.path.join(BASE_DIR, "outputs", "logs"))
 
 if __name__ == "__main__":
     demo.launch()
\ No newline at end of file
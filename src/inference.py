@@ -0,0 +1,172 @@
+import os
+import threading
+import importlib.util
+import numpy as np
+
+# TensorFlow chỉ được import khi backend cần đến (keras / savedmodel / tflite không có ai_edge_litert):
+# import tensorflow mất vài giây, là phần lớn thời gian khởi động của app.
+
+# Backend suy luận: keras | savedmodel | tflite | tflite_int8 | onnx | auto
+# Chọn khi khởi động bằng biến môi trường ANOMALY_BACKEND (mặc định: keras).
+BACKEND = os.environ.get("ANOMALY_BACKEND", "keras")
+
+# File model của từng backend nằm cạnh file .h5 (tạo bằng export_model.py)
+ARTIFACT_SUFFIXES = {
+    "keras": ".h5",
+    "savedmodel": "_savedmodel",   # Thư mục SavedModel
+    "tflite": ".tflite",
+    "tflite_int8": "_int8.tflite",
+    "onnx": ".onnx",
+}
+
+# "auto": backend đã export khởi động nhanh nhất (onnx/tflite không cần TensorFlow), cuối cùng là .h5
+AUTO_ORDER = ["onnx", "tflite", "savedmodel", "keras"]
+
+def artifact_path(model_path, backend):
+    """Đường dẫn file model của backend, suy ra từ đường dẫn .h5."""
+    if backend not in ARTIFACT_SUFFIXES:
+        raise ValueError(f"Backend không hỗ trợ: {backend} (chọn một trong {list(ARTIFACT_SUFFIXES)})")
+    return os.path.splitext(model_path)[0] + ARTIFACT_SUFFIXES[backend]
+
+def runtime_module(name):
+    """Tên module runtime nặng mà backend cần import."""
+    if name == "onnx":
+        return "onnxruntime"
+    if name in ("tflite", "tflite_int8") and importlib.util.find_spec("ai_edge_litert") is not None:
+        return "ai_edge_litert.interpreter"
+    return "tensorflow"
+
+def import_runtime(name):
+    """Import trước runtime của backend (để đo riêng thời gian import khi khởi động)."""
+    return importlib.import_module(runtime_module(name))
+
+def resolve_backend(name, model_path):
+    """Đổi "auto" thành backend đầu tiên trong AUTO_ORDER có file model và runtime đã cài."""
+    if name != "auto":
+        return name
+    for candidate in AUTO_ORDER:
+        if not os.path.exists(artifact_path(model_path, candidate)):
+            continue
+        if candidate == "onnx" and importlib.util.find_spec("onnxruntime") is None:
+            continue
+        return candidate
+    return "keras"
+
+def make_predict_fn(model):
+    """
+    Tạo hàm forward đã biên dịch (tf.function) cho model.
+    Nhanh hơn nhiều so với gọi model.predict cho từng batch nhỏ
+    (predict tốn chi phí khởi tạo mỗi lần gọi).
+    Input/Output: numpy float32 (N, H, W, C).
+    """
+    import tensorflow as tf
+    spec = tf.TensorSpec(shape=(None,) + tuple(model.input_shape[1:]), dtype=tf.float32)
+
+    @tf.function(input_signature=[spec])
+    def forward(x):
+        return model(x, training=False)
+
+    def predict(batch):
+        return forward(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+    return predict
+
+class KerasBackend:
+    """Model Keras gốc (.h5), forward qua tf.function."""
+    name = "keras"
+
+    def __init__(self, path):
+        from tensorflow.keras.models import load_model
+        self.model = load_model(path, compile=False)
+        self.input_shape = tuple(self.model.input_shape[1:])
+        self._predict = make_predict_fn(self.model)
+
+    def predict(self, batch):
+        return self._predict(batch)
+
+class SavedModelBackend:
+    """
+    SavedModel (export_model.py): nạp graph đã biên dịch sẵn, không dựng lại model Keras từ .h5.
+    """
+    name = "savedmodel"
+
+    def __init__(self, path):
+        import tensorflow as tf
+        self._tf = tf
+        self.module = tf.saved_model.load(path)
+        self.input_shape = tuple(self.module.serve.input_signature[0].shape[1:])
+
+    def predict(self, batch):
+        return self.module.serve(self._tf.convert_to_tensor(batch, dtype=self._tf.float32)).numpy()
+
+class TFLiteBackend:
+    """
+    Model TFLite (float hoặc INT8). Model được export với batch = 1
+    nên mỗi frame một lần invoke (chi phí mỗi lần gọi rất nhỏ).
+    name: "tflite" hoặc "tflite_int8" (nhãn ghi vào kết quả benchmark).
+    """
+    def __init__(self, path, num_threads=None, name="tflite"):
+        self.name = name
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(int(d) for d in self._input["shape"][1:])
+        # Interpreter không an toàn khi nhiều thread gọi cùng lúc
+        self._lock = threading.Lock()
+
+    def _quantize(self, x, details):
+        scale, zero_point = details["quantization"]
+        if details["dtype"] == np.float32 or scale == 0:
+            return x.astype(details["dtype"])
+        info = np.iinfo(details["dtype"])
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(details["dtype"])
+
+    def _dequantize(self, y, details):
+        scale, zero_point = details["quantization"]
+        if details["dtype"] == np.float32 or scale == 0:
+            return y.astype(np.float32)
+        return (y.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch):
+        out = np.empty(batch.shape[:1] + tuple(self._output["shape"][1:]), dtype=np.float32)
+        with self._lock:
+            for i in range(len(batch)):
+                self.interpreter.set_tensor(self._input["index"], self._quantize(batch[i:i + 1], self._input))
+                self.interpreter.invoke()
+                out[i] = self._dequantize(self.interpreter.get_tensor(self._output["index"]), self._output)[0]
+        return out
+
+class ONNXBackend:
+    """Model ONNX chạy bằng onnxruntime (CPU)."""
+    name = "onnx"
+
+    def __init__(self, path):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self._input_name = inp.name
+        self.input_shape = tuple(inp.shape[1:])
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: batch.astype(np.float32)})[0]
+
+def load_backend(name=None, model_path=os.path.join("outputs", "models", "anomaly_detector.h5")):
+    """Khởi tạo backend theo tên (mặc định BACKEND, "auto" = resolve_backend) từ file model tương ứng."""
+    name = resolve_backend(name or BACKEND, model_path)
+    path = artifact_path(model_path, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Không tìm thấy model cho backend '{name}': {path} "
+                                f"(chạy export_model.py để tạo)")
+    print(f"[INFO] Backend suy luận: {name} ({path})")
+    if name == "keras":
+        return KerasBackend(path)
+    if name == "savedmodel":
+        return SavedModelBackend(path)
+    if name in ("tflite", "tflite_int8"):
+        return TFLiteBackend(path, name=name)
+    return ONNXBackend(path)
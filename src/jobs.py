@@ -0,0 +1,144 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+from collections import deque
+
+# --- CẤU HÌNH ---
+MAX_CONCURRENT_JOBS = 2    # Số video phân tích cùng lúc (dùng chung một backend)
+MAX_PENDING_JOBS = 16      # Hàng đợi tối đa; vượt quá thì từ chối job mới
+KEEP_JOB_DIRS = 32         # Giữ output của N job gần nhất, xoá các thư mục cũ hơn
+
+# Trạng thái job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+class Job:
+    """
+    Một yêu cầu phân tích. Hàm xử lý là generator: mỗi giá trị yield là tiến độ mới nhất
+    (chỉ giữ bản mới nhất, người xem chậm không làm nghẽn worker).
+    """
+    def __init__(self, fn, args, out_dir):
+        self.id = os.path.basename(out_dir)
+        self.fn = fn
+        self.args = args
+        self.out_dir = out_dir
+        self.cancel_event = threading.Event()
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.version = 0
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, CANCELLED, FAILED)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _set(self, status=None, result=None):
+        with self._cond:
+            if status is not None:
+                self.status = status
+            if result is not None:
+                self.result = result
+            self.version += 1
+            self._cond.notify_all()
+
+    def wait(self, version, timeout=None):
+        """Chờ đến khi có cập nhật mới hơn `version` (hoặc hết timeout). Trả về version hiện tại."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+class JobManager:
+    """
+    Pool worker giới hạn + hàng đợi FIFO có vị trí, huỷ job và thư mục output riêng cho mỗi job.
+    """
+    def __init__(self, root_dir, max_workers=MAX_CONCURRENT_JOBS, max_pending=MAX_PENDING_JOBS,
+                 keep_dirs=KEEP_JOB_DIRS):
+        self.root_dir = root_dir
+        self.max_pending = max_pending
+        self.keep_dirs = keep_dirs
+        self._pending = deque()
+        self._running = set()
+        self._cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(max_workers)]
+        for t in self._workers:
+            t.start()
+
+    def submit(self, fn, *args):
+        """
+        Xếp hàng fn(*args, out_dir=..., cancel_event=...) (generator).
+        Trả về Job, hoặc None nếu hàng đợi đã đầy.
+        """
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                return None
+            out_dir = os.path.join(self.root_dir, time.strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:8])
+            os.makedirs(out_dir, exist_ok=True)
+            job = Job(fn, args, out_dir)
+            self._pending.append(job)
+            self._cond.notify()
+        self._cleanup()
+        return job
+
+    def position(self, job):
+        """Vị trí trong hàng đợi (1 = kế tiếp), 0 nếu không còn chờ."""
+        with self._cond:
+            try:
+                return self._pending.index(job) + 1
+            except ValueError:
+                return 0
+
+    def cancel(self, job):
+        job.cancel()
+        with self._cond:
+            if job in self._pending:
+                self._pending.remove(job)
+                job._set(CANCELLED)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                job = self._pending.popleft()
+                self._running.add(job)
+            if job.cancel_event.is_set():
+                with self._cond:
+                    self._running.discard(job)
+                job._set(CANCELLED)
+                continue
+            job._set(RUNNING)
+            gen = job.fn(*job.args, out_dir=job.out_dir, cancel_event=job.cancel_event)
+            try:
+                for update in gen:
+                    if job.cancel_event.is_set():
+                        break
+                    job._set(result=update)
+                job._set(CANCELLED if job.cancel_event.is_set() else DONE)
+            except Exception as e:
+                print(f"[ERROR] Job {job.id} lỗi: {e}")
+                job.error = str(e)
+                job._set(FAILED)
+            finally:
+                # Đóng generator để giải phóng file/VideoCapture nếu bị huỷ giữa chừng
+                gen.close()
+                with self._cond:
+                    self._running.discard(job)
+
+    def _cleanup(self):
+        """Xoá thư mục output của các job cũ (giữ keep_dirs thư mục mới nhất)."""
+        if not os.path.isdir(self.root_dir):
+            return
+        dirs = sorted(d.path for d in os.scandir(self.root_dir) if d.is_dir())
+        with self._cond:
+            active = {job.out_dir for job in list(self._pending) + list(self._running)}
+        for d in dirs[:-self.keep_dirs]:
+            if d not in active:
+                shutil.rmtree(d, ignore_errors=True)
@@ -0,0 +1,122 @@
+import cv2
+import numpy as np
+
+# --- CẤU HÌNH ---
+DIFF_THRESHOLD = 30   # Ngưỡng (thang 0-255) trên bản đồ sai khác
+MIN_AREA = 10         # Bỏ các vùng nhỏ hơn (pixel ở độ phân giải model)
+
+# Định vị theo khối (BlockLocalizer)
+BLOCK_SIZE = 8        # Cạnh khối (pixel ở độ phân giải model)
+BLOCK_STRIDE = None   # None = khối không chồng nhau; nhỏ hơn BLOCK_SIZE = khối chồng (dùng ảnh tích phân)
+BLOCK_THRESHOLD = 15  # Ngưỡng (thang 0-255) trên sai số TRUNG BÌNH của khối
+SMOOTH_ALPHA = 0.6    # EMA theo thời gian của bản đồ khối (1.0 = không làm mượt)
+MERGE_GAP = 1         # Gộp các vùng cách nhau <= MERGE_GAP khối
+MIN_BLOCKS = 2        # Bỏ vùng ít hơn N khối
+
+def contour_boxes(diff, scale_x, scale_y):
+    """
+    Tìm khung bao vùng bất thường trên bản đồ sai khác |input - tái tạo|.
+    diff: mảng (128, 128) float trong [0, 1].
+    Trả về list (x, y, w, h) theo toạ độ frame gốc.
+    """
+    boxes = []
+    diff_map = (diff * 255).astype(np.uint8)
+    _, thresh_img = cv2.threshold(diff_map, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+    cnts, _ = cv2.findContours(thresh_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for c in cnts:
+        if cv2.contourArea(c) > MIN_AREA:
+            x, y, w, h = cv2.boundingRect(c)
+            boxes.append((int(x * scale_x), int(y * scale_y), int(w * scale_x), int(h * scale_y)))
+    return boxes
+
+def block_errors(diff, block=BLOCK_SIZE, stride=None):
+    """
+    Sai số trung bình theo khối block x block của bản đồ (H, W) -> (rows, cols).
+    Khối không chồng: reshape + mean (pooling theo bước). Khối chồng: ảnh tích phân.
+    """
+    stride = stride or block
+    h, w = diff.shape
+    if stride == block and h % block == 0 and w % block == 0:
+        return diff.reshape(h // block, block, w // block, block).mean(axis=(1, 3))
+    integral = np.zeros((h + 1, w + 1), dtype=np.float64)
+    integral[1:, 1:] = diff.cumsum(axis=0).cumsum(axis=1)
+    ys = np.arange(0, h - block + 1, stride)[:, None]
+    xs = np.arange(0, w - block + 1, stride)[None, :]
+    sums = (integral[ys + block, xs + block] - integral[ys, xs + block]
+            - integral[ys + block, xs] + integral[ys, xs])
+    return (sums / (block * block)).astype(np.float32)
+
+class BlockLocalizer:
+    """
+    Định vị vùng bất thường theo khối, thay cho contour trên ảnh ngưỡng:
+    1. Sai số trung bình từng khối (vector hoá).
+    2. Làm mượt theo thời gian bằng EMA (giữ một bản đồ khối cho mỗi luồng video).
+    3. Khối vượt ngưỡng -> gộp các nhóm gần nhau (giãn MERGE_GAP khối rồi gán nhãn liên thông).
+    4. Thu khung về đúng các pixel vượt DIFF_THRESHOLD trong vùng, rồi đổi sang toạ độ frame gốc
+       (làm tròn ra ngoài, không mất biên như int() của contour_boxes).
+    """
+    def __init__(self, block=BLOCK_SIZE, stride=BLOCK_STRIDE, alpha=SMOOTH_ALPHA,
+                 threshold=BLOCK_THRESHOLD, merge_gap=MERGE_GAP, min_blocks=MIN_BLOCKS):
+        self.block = block
+        self.stride = stride or block
+        self.alpha = alpha
+        self.threshold = threshold / 255.0
+        self.min_blocks = min_blocks
+        self.merge_gap = merge_gap
+        self.kernel = np.ones((merge_gap + 1, merge_gap + 1), np.uint8)
+        self.map = None
+
+    def reset(self):
+        self.map = None
+
+    def update(self, diff):
+        """Cập nhật bản đồ khối đã làm mượt với bản đồ sai khác (H, W) của frame mới."""
+        errors = block_errors(diff, self.block, self.stride)
+        if self.map is None or self.map.shape != errors.shape:
+            self.map = errors
+        else:
+            self.map += self.alpha * (errors - self.map)
+        return self.map
+
+    def __call__(self, diff, scale_x, scale_y):
+        """update + boxes. Cùng giao diện với contour_boxes: list (x, y, w, h) theo toạ độ frame gốc."""
+        self.update(diff)
+        return self.boxes(diff, scale_x, scale_y)
+
+    def boxes(self, diff, scale_x, scale_y):
+        """Khung từ bản đồ đã làm mượt hiện tại (diff của frame mới nhất dùng để thu khung)."""
+        if self.map is None:
+            return []
+        hot = self.map > self.threshold
+        if not hot.any():
+            return []
+        grouped = hot.view(np.uint8)
+        if self.merge_gap > 0:
+            # Giãn về phải/xuống MERGE_GAP khối: hai vùng cách nhau <= MERGE_GAP khối sẽ chạm nhau
+            grouped = cv2.dilate(grouped, self.kernel, anchor=(self.merge_gap, self.merge_gap))
+        n, labels = cv2.connectedComponents(grouped, connectivity=8)
+        rows, cols = np.nonzero(hot)
+        lab = labels[rows, cols]
+        # Biên (theo chỉ số khối) và số khối của mỗi vùng, tính một lượt cho mọi vùng
+        count = np.bincount(lab, minlength=n)
+        r0 = np.full(n, hot.shape[0]); c0 = np.full(n, hot.shape[1])
+        r1 = np.zeros(n, int); c1 = np.zeros(n, int)
+        np.minimum.at(r0, lab, rows); np.minimum.at(c0, lab, cols)
+        np.maximum.at(r1, lab, rows); np.maximum.at(c1, lab, cols)
+
+        h, w = diff.shape
+        pixel_threshold = DIFF_THRESHOLD / 255.0
+        boxes = []
+        for k in np.flatnonzero(count >= self.min_blocks):
+            y0, x0 = r0[k] * self.stride, c0[k] * self.stride
+            y1 = min(r1[k] * self.stride + self.block, h)
+            x1 = min(c1[k] * self.stride + self.block, w)
+            # Thu khung về các pixel thực sự lỗi (nếu frame hiện tại còn pixel vượt ngưỡng trong vùng)
+            mask = diff[y0:y1, x0:x1] > pixel_threshold
+            ys, xs = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+            if len(ys):
+                y0, y1 = y0 + ys[0], y0 + ys[-1] + 1
+                x0, x1 = x0 + xs[0], x0 + xs[-1] + 1
+            bx, by = int(x0 * scale_x), int(y0 * scale_y)
+            boxes.append((bx, by, int(np.ceil(x1 * scale_x)) - bx, int(np.ceil(y1 * scale_y)) - by))
+        return boxes
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+# --- CẤU HÌNH ---
+MOTION_SIZE = (32, 32)    # Kích thước thu nhỏ để đo chuyển động (rất rẻ)
+MOTION_THRESHOLD = 1.0    # Sai khác tuyệt đối trung bình (thang 0-255) coi là "có chuyển động"
+MIN_SKIP = 0              # Có chuyển động: bỏ qua tối thiểu MIN_SKIP frame giữa 2 lần chạy model
+MAX_SKIP = 8              # Cảnh tĩnh: vẫn chạy model ít nhất mỗi MAX_SKIP + 1 frame
+
+class AdaptiveSkipper:
+    """
+    Quyết định frame nào cần chạy model dựa trên năng lượng chuyển động.
+    Chuyển động = sai khác trung bình giữa frame thu nhỏ hiện tại và frame
+    thu nhỏ ở lần chạy model gần nhất (nên thay đổi chậm vẫn được tích luỹ).
+    Đặt min_skip = max_skip = k để có lịch cố định "1 trên k+1 frame".
+    """
+    def __init__(self, min_skip=MIN_SKIP, max_skip=MAX_SKIP, threshold=MOTION_THRESHOLD,
+                 size=MOTION_SIZE, fixed_skip=2):
+        self.min_skip = min_skip
+        self.max_skip = max_skip
+        self.threshold = threshold
+        self.size = size
+        self.fixed_skip = fixed_skip   # Lịch cố định dùng để so sánh khi báo cáo
+        self.ref = None
+        self.gap = 0
+        self.frames = 0
+        self.inferences = 0
+        self.last_motion = 0.0
+
+    def _small(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def should_score(self, frame):
+        """True nếu frame này cần chạy model."""
+        self.frames += 1
+        self.gap += 1
+        if self.ref is not None and self.gap <= self.min_skip:
+            return False
+        small = self._small(frame)
+        if self.ref is None or self.gap > self.max_skip:
+            score = True
+        else:
+            self.last_motion = float(np.mean(cv2.absdiff(small, self.ref)))
+            score = self.last_motion > self.threshold
+        if score:
+            self.ref = small
+            self.gap = 0
+            self.inferences += 1
+        return score
+
+    @property
+    def fixed_inferences(self):
+        """Số lần chạy model nếu dùng lịch cố định fixed_skip."""
+        return -(-self.frames // (self.fixed_skip + 1))
+
+    @property
+    def saved(self):
+        """Số lần chạy model tiết kiệm được (âm = chạy nhiều hơn lịch cố định)."""
+        return self.fixed_inferences - self.inferences
+
+    def summary(self):
+        return (f"Model chạy {self.inferences}/{self.frames} frames "
+                f"(lịch cố định: {self.fixed_inferences}, tiết kiệm: {self.saved})")
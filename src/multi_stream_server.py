@@ -0,0 +1,267 @@
+import numpy as np
+import os
+import time
+import queue
+import argparse
+import threading
+from frame_source import open_source
+from inference import load_backend, BACKEND
+from localization import BlockLocalizer
+from clips import ClipBuffer, clip_length_of
+from score_store import ScoreStore, SCORE_STORE_DIR
+
+# --- CẤU HÌNH ---
+MODEL_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
+THRESHOLD_PATH = os.path.join("outputs", "models", "threshold.txt")
+
+# Nguồn mặc định (video file, folder ảnh, "live:<video>" giả lập camera, "cam:<index>" webcam)
+SOURCES = [os.path.join("data", "ucsd", "test", "Test001"),
+           os.path.join("data", "ucsd", "test", "Test002")]
+
+MAX_BATCH_SIZE = 32       # Số frame tối đa gom chung một lần forward
+MAX_LATENCY_MS = 50       # Frame đầu tiên của batch không chờ quá hạn này
+MAX_PENDING = 256         # Hàng đợi chung giữa các stream và bộ gom batch
+RESULT_QUEUE_SIZE = 64    # Hàng đợi kết quả của mỗi stream (đầy thì bỏ kết quả cũ nhất, không chặn bộ gom batch)
+REPORT_EVERY = 50         # In kết quả mỗi N frame của một stream
+STORE_SCORES = True       # Lưu điểm từng frame + đoạn bất thường vào SCORE_STORE_DIR (mỗi stream một camera)
+
+ANOMALY_LABEL = "CANH BAO!"
+NORMAL_LABEL = "BINH THUONG"
+
+# Đánh dấu hết stream
+END = None
+
+class FrameRequest:
+    __slots__ = ("stream_id", "seq", "input", "scale", "t_enqueue")
+
+    def __init__(self, stream_id, seq, input_data, scale):
+        self.stream_id = stream_id
+        self.seq = seq
+        self.input = input_data
+        self.scale = scale
+        self.t_enqueue = time.perf_counter()
+
+class StreamResult:
+    __slots__ = ("stream_id", "seq", "mse", "label", "boxes", "latency")
+
+    def __init__(self, stream_id, seq, mse, label, boxes, latency):
+        self.stream_id = stream_id
+        self.seq = seq
+        self.mse = mse
+        self.label = label
+        self.boxes = boxes
+        self.latency = latency
+
+class AnomalyServer:
+    """
+    Dịch vụ nhiều stream dùng chung MỘT model:
+    reader (mỗi stream 1 thread) -> hàng đợi chung -> bộ gom batch động -> model
+    -> kết quả trả về hàng đợi riêng của từng stream.
+    """
+    def __init__(self, backend, threshold, max_batch=MAX_BATCH_SIZE, max_latency_ms=MAX_LATENCY_MS,
+                 store_root=None):
+        self.backend = backend
+        self.clip_length = clip_length_of(backend)   # T > 1: model clip, mỗi stream một ClipBuffer
+        self.store_root = store_root
+        self.threshold = threshold
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self.requests = queue.Queue(maxsize=MAX_PENDING)
+        self.result_queues = {}
+        self.localizers = {}
+        self.stores = {}
+        self.readers = []
+        self.consumers = []
+        self.stop_event = threading.Event()
+        self._active = 0
+        self._lock = threading.Lock()
+        # Thống kê
+        self.batches = 0
+        self.frames = 0
+        self.dropped = 0          # Frame live bị bỏ do hàng đợi chung đầy
+        self.result_dropped = {}  # Kết quả bị bỏ do consumer của stream xử lý không kịp
+
+    # --- Stream đầu vào ---
+    def add_stream(self, stream_id, spec, handler=None):
+        """Đăng ký một nguồn và consumer nhận kết quả của nó."""
+        source = open_source(spec)
+        self.result_queues[stream_id] = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+        self.result_dropped[stream_id] = 0
+        # Bản đồ lỗi theo khối được làm mượt theo thời gian -> mỗi stream một localizer
+        self.localizers[stream_id] = BlockLocalizer()
+        if self.store_root is not None:
+            self.stores[stream_id] = ScoreStore(stream_id.replace(":", "_").replace(os.sep, "_"), self.store_root)
+        with self._lock:
+            self._active += 1
+        self.readers.append(threading.Thread(
+            target=self._read_stream, args=(stream_id, source), daemon=True))
+        self.consumers.append(threading.Thread(
+            target=self._consume, args=(stream_id, handler or print_handler), daemon=True))
+
+    def _read_stream(self, stream_id, source):
+        """
+        Đọc thẳng ảnh xám 128x128 (không cần frame màu: server không hiển thị).
+        Folder ảnh / video file: đọc nhanh nhất có thể; live:<video> / cam:<index>: theo nhịp của nguồn.
+        Input gửi đi có shape (128, 128, T): model clip nhận T frame gần nhất của chính stream này.
+        """
+        seq = 0
+        w, h = source.size
+        clips = ClipBuffer(self.clip_length) if self.clip_length > 1 else None
+        while not self.stop_event.is_set():
+            gray = source.read_small()
+            if gray is None: break
+            seq += 1
+            x = gray / np.float32(255.0)
+            if clips is not None:
+                clips.push(x)
+                x = clips.clip().copy()   # View của ring buffer bị ghi đè ở frame sau
+            else:
+                x = x[..., np.newaxis]
+            req = FrameRequest(stream_id, seq, x, (w / 128, h / 128))
+            if source.is_live:
+                # Camera không chờ được: hàng đợi đầy thì bỏ frame
+                try: self.requests.put_nowait(req)
+                except queue.Full:
+                    with self._lock:
+                        self.dropped += 1
+            else:
+                self.requests.put(req)
+        source.release()
+        self.requests.put(FrameRequest(stream_id, END, None, None))
+
+    # --- Gom batch động ---
+    def _next_batch(self):
+        """Chờ frame đầu tiên, rồi gom thêm đến khi đủ batch hoặc hết hạn độ trễ."""
+        try:
+            first = self.requests.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first.t_enqueue + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=max(remaining, 0)) if remaining > 0
+                             else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self):
+        while not self.stop_event.is_set():
+            batch = self._next_batch()
+            frames = [r for r in batch if r.seq is not END]
+            if frames:
+                inputs = np.stack([r.input for r in frames])
+                reconstructed = self.backend.predict(inputs)
+                diffs = np.abs(inputs - reconstructed)
+                mses = np.mean(np.square(diffs), axis=(1, 2, 3))
+                now = time.perf_counter()
+                for i, r in enumerate(frames):
+                    mse = float(mses[i])
+                    localizer = self.localizers[r.stream_id]
+                    # Định vị trên bản đồ lỗi của frame mới nhất (channel cuối của clip)
+                    localizer.update(diffs[i, :, :, -1])
+                    if mse > self.threshold:
+                        label = ANOMALY_LABEL
+                        boxes = localizer.boxes(diffs[i, :, :, -1], *r.scale)
+                    else:
+                        label = NORMAL_LABEL
+                        boxes = []
+                    self._deliver(r.stream_id, StreamResult(r.stream_id, r.seq, mse, label, boxes, now - r.t_enqueue))
+                self.batches += 1
+                self.frames += len(frames)
+            for r in batch:
+                if r.seq is END:
+                    self._deliver(r.stream_id, END)
+                    with self._lock:
+                        self._active -= 1
+            if self._active == 0:
+                break
+
+    def _deliver(self, stream_id, item):
+        """
+        Trả kết quả mà không chặn bộ gom batch (dùng chung cho mọi stream):
+        consumer chậm thì bỏ kết quả CŨ nhất của chính stream đó (như reader live bỏ frame).
+        """
+        results = self.result_queues[stream_id]
+        while True:
+            try:
+                results.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    results.get_nowait()
+                    self.result_dropped[stream_id] += 1
+                except queue.Empty:
+                    pass
+
+    # --- Consumer của từng stream ---
+    def _consume(self, stream_id, handler):
+        store = self.stores.get(stream_id)
+        try:
+            while True:
+                result = self.result_queues[stream_id].get()
+                if result is END: break
+                if store is not None:
+                    store.append(time.time(), result.mse, result.label == ANOMALY_LABEL, boxes=result.boxes)
+                handler(result)
+        finally:
+            if store is not None:
+                store.close()
+
+    def run(self):
+        """Chạy đến khi mọi stream kết thúc (hoặc Ctrl+C)."""
+        for t in self.readers + self.consumers: t.start()
+        start = time.perf_counter()
+        try:
+            self._serve()
+        except KeyboardInterrupt:
+            print("\n[INFO] Đang dừng server...")
+        self.stop_event.set()
+        for t in self.consumers: t.join(timeout=2.0)
+        elapsed = time.perf_counter() - start
+        avg_batch = self.frames / self.batches if self.batches else 0
+        print(f"\n[INFO] {self.frames} frames / {len(self.result_queues)} streams trong {elapsed:.2f}s "
+              f"-> {self.frames / elapsed if elapsed > 0 else 0:.1f} FPS")
+        print(f"[INFO] {self.batches} batches, trung bình {avg_batch:.1f} frames/batch, "
+              f"bỏ {self.dropped} frames (live)")
+        for stream_id, n in self.result_dropped.items():
+            if n:
+                print(f"[WARNING] [{stream_id}] Bỏ {n} kết quả cũ do consumer xử lý không kịp")
+
+def print_handler(result):
+    """Consumer mặc định: in kết quả mỗi REPORT_EVERY frame và mọi frame bất thường."""
+    if result.label == ANOMALY_LABEL or result.seq % REPORT_EVERY == 0:
+        print(f"[{result.stream_id}] Frame: {result.seq} | Error: {result.mse:.6f} | "
+              f"{result.label} | Boxes: {len(result.boxes)} | Latency: {result.latency * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Server phát hiện bất thường cho nhiều camera")
+    parser.add_argument("sources", nargs="*", default=SOURCES,
+                        help="Video, folder ảnh, live:<video> hoặc cam:<index>")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-latency-ms", type=float, default=MAX_LATENCY_MS)
+    parser.add_argument("--backend", default=BACKEND, help="keras | tflite | tflite_int8 | onnx")
+    parser.add_argument("--no-store", action="store_true", default=not STORE_SCORES,
+                        help="Không lưu điểm vào score store")
+    args = parser.parse_args()
+
+    if not os.path.exists(THRESHOLD_PATH):
+        print("[ERROR] Chưa có file ngưỡng (threshold.txt). Chạy evaluate.py trước!")
+        return
+    with open(THRESHOLD_PATH, "r") as f:
+        threshold = float(f.read())
+
+    print("[INFO] Đang tải model (dùng chung cho mọi stream)...")
+    backend = load_backend(args.backend, MODEL_PATH)
+    server = AnomalyServer(backend, threshold, args.max_batch, args.max_latency_ms,
+                           None if args.no_store else SCORE_STORE_DIR)
+    for i, spec in enumerate(args.sources):
+        stream_id = f"cam{i}:{os.path.basename(spec.rstrip(os.sep))}"
+        server.add_stream(stream_id, spec)
+        print(f"[INFO] Stream {stream_id} <- {spec}")
+    server.run()
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,99 @@
 import cv2
 import numpy as np
 
-def draw_optical_flow(frame, prev_frame, step=16):
+# --- CẤU HÌNH ---
+FLOW_SIZE = (128, 128)     # Tính flow ở độ phân giải của model (rẻ hơn nhiều so với frame gốc)
+FLOW_METHOD = "dis"        # "dis" (nhanh, ~0.3 ms/frame ở 128x128) | "farneback" (~5 ms/frame)
+SCORE_PERCENTILE = 99      # Điểm flow của frame = phân vị này của độ lớn (vật chuyển động nhanh)
+
+def _to_gray(frame):
+    if frame.ndim == 3:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return frame
+
+def _farneback(prev_gray, gray):
+    return cv2.calcOpticalFlowFarneback(prev_gray, gray, None,
+                                        pyr_scale=0.5, levels=3, winsize=15,
+                                        iterations=3, poly_n=5, poly_sigma=1.2, flags=0)
+
+class FlowExtractor:
+    """
+    Tính dense optical flow liên tiếp giữa các frame ở FLOW_SIZE.
+    Giữ frame xám trước đó giữa các lần gọi, nên chỉ cần đưa từng frame theo thứ tự.
+    """
+    def __init__(self, method=FLOW_METHOD, size=FLOW_SIZE):
+        if method not in ("dis", "farneback"):
+            raise ValueError(f"Phương pháp flow không hỗ trợ: {method} (chọn 'dis' hoặc 'farneback')")
+        self.method = method
+        self.size = size
+        self.prev = None
+        self.flow = np.zeros((size[1], size[0], 2), dtype=np.float32)
+        self.magnitude = np.zeros((size[1], size[0]), dtype=np.float32)
+        if method == "dis":
+            self._dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST)
+
+    def reset(self):
+        """Bắt đầu video mới (frame kế tiếp sẽ có flow = 0)."""
+        self.prev = None
+
+    def update(self, frame):
+        """
+        Nhận frame (BGR hoặc xám, kích thước bất kỳ; uint8) và trả về flow (H, W, 2)
+        từ frame trước tới frame này. Frame đầu tiên có flow = 0.
+        """
+        gray = _to_gray(frame)
+        if gray.shape[1::-1] != tuple(self.size):
+            gray = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        if self.prev is None:
+            self.flow[:] = 0
+        elif self.method == "dis":
+            self.flow = self._dis.calc(self.prev, gray, None)
+        else:
+            self.flow = _farneback(self.prev, gray)
+        self.magnitude = cv2.magnitude(self.flow[..., 0], self.flow[..., 1])
+        # Frame xám đúng kích thước là mảng của người gọi (vd. buffer dùng lại của read_small): phải copy
+        self.prev = gray.copy() if gray is frame else gray
+        return self.flow
+
+    def score(self):
+        """Điểm phụ (side score) của frame hiện tại: phân vị cao của độ lớn flow."""
+        flat = self.magnitude.ravel()
+        k = min(int(len(flat) * SCORE_PERCENTILE / 100), len(flat) - 1)
+        return float(np.partition(flat, k)[k])
+
+def draw_flow(vis, flow, step=16, color=(0, 255, 0)):
+    """
+    Vẽ vector flow (lưới thưa) lên vis. flow có thể nhỏ hơn vis (vd. tính ở 128x128):
+    toạ độ và độ dài vector được scale theo kích thước vis.
+    """
+    h, w = vis.shape[:2]
+    fh, fw = flow.shape[:2]
+    sx, sy = w / fw, h / fh
+    y, x = np.mgrid[step / 2:h:step, step / 2:w:step].reshape(2, -1).astype(int)
+    fx, fy = flow[np.minimum((y / sy).astype(int), fh - 1), np.minimum((x / sx).astype(int), fw - 1)].T
+
+    # Các đường chuyển động: một lần gọi polylines cho mọi điểm
+    lines = np.vstack([x, y, x + fx * sx, y + fy * sy]).T.reshape(-1, 2, 2)
+    lines = np.int32(lines + 0.5)
+    cv2.polylines(vis, lines, 0, color)
+
+    # Chấm 3x3 tại điểm bắt đầu (gán trực tiếp thay vì gọi cv2.circle từng điểm)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            vis[np.clip(y + dy, 0, h - 1), np.clip(x + dx, 0, w - 1)] = color
+    return vis
+
+def draw_optical_flow(frame, prev_frame, step=16, method="farneback"):
     """
-    Tính toán và vẽ Optical Flow (Dense) bằng thuật toán Farneback.
+    Tính toán và vẽ Optical Flow (Dense).
     - frame: Ảnh hiện tại (Grayscale hoặc BGR)
     - prev_frame: Ảnh trước đó (Grayscale)
+    - method: "farneback" (như cũ) hoặc "dis" (nhanh hơn nhiều)
+    Chạy liên tục trên video thì nên dùng FlowExtractor + draw_flow (flow ở 128x128).
     """
     if prev_frame is None:
         return frame
-    
+
     # Đảm bảo đầu vào là ảnh xám
     if len(frame.shape) == 3:
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
@@ -17,29 +101,15 @@ def draw_optical_flow(frame, prev_frame, step=16):
     else:
         gray = frame
         vis = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-        
+
     # Tính Optical Flow
-    flow = cv2.calcOpticalFlowFarneback(prev_frame, gray, None, 
-                                        pyr_scale=0.5, levels=3, winsize=15, 
-                                        iterations=3, poly_n=5, poly_sigma=1.2, flags=0)
-    
-    # Vẽ các đường chuyển động (chỉ vẽ lưới thưa để dễ nhìn)
-    h, w = gray.shape[:2]
-    y, x = np.mgrid[step/2:h:step, step/2:w:step].reshape(2,-1).astype(int)
-    fx, fy = flow[y,x].T
-    
-    # Tạo các đường line xanh lá cây
-    lines = np.vstack([x, y, x+fx, y+fy]).T.reshape(-1, 2, 2)
-    lines = np.int32(lines + 0.5)
-    
-    cv2.polylines(vis, lines, 0, (0, 255, 0))
-    
-    # Vẽ chấm đỏ tại điểm bắt đầu
-    for (x1, y1), (_x2, _y2) in lines:
-        cv2.circle(vis, (x1, y1), 1, (0, 255, 0), -1)
-        
-    return vis
+    if method == "dis":
+        flow = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST).calc(prev_frame, gray, None)
+    else:
+        flow = _farneback(prev_frame, gray)
+
+    return draw_flow(vis, flow, step)
 
 # --- Test Block ---
 if __name__ == "__main__":
-    print("Function draw_optical_flow ready.")
\ No newline at end of file
+    print("Function draw_optical_flow ready.")
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+from score_stats import HistogramSketch
+
+# Dải độ trễ (giây) của sketch phân vị trong StageStats
+LATENCY_MIN = 1e-6
+LATENCY_MAX = 60.0
+LATENCY_BINS = 1024
+
+# Chế độ backpressure khi hàng đợi đầy
+BLOCK = "block"               # Stage trước phải chờ (không mất frame)
+DROP_OLDEST = "drop_oldest"   # Bỏ frame cũ nhất (ưu tiên độ trễ thấp)
+
+# Đánh dấu hết dữ liệu (hàng đợi đã đóng và rỗng)
+END = object()
+
+class StageQueue:
+    """Hàng đợi giới hạn giữa 2 stage, có đếm độ sâu và số frame bị bỏ."""
+    def __init__(self, name, maxsize=8, policy=BLOCK):
+        if policy not in (BLOCK, DROP_OLDEST):
+            raise ValueError(f"Chế độ backpressure không hợp lệ: {policy}")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.max_depth = 0
+        self._depth_sum = 0
+        self._puts = 0
+
+    def put(self, item):
+        """Thêm item. Trả về False nếu hàng đợi đã đóng."""
+        with self._cond:
+            if self.policy == BLOCK:
+                while len(self._items) >= self.maxsize and not self.closed:
+                    self._cond.wait()
+            else:
+                while len(self._items) >= self.maxsize:
+                    self._items.popleft()
+                    self.dropped += 1
+            if self.closed:
+                return False
+            self._items.append(item)
+            depth = len(self._items)
+            self.max_depth = max(self.max_depth, depth)
+            self._depth_sum += depth
+            self._puts += 1
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Lấy item; trả về END khi đã đóng và hết dữ liệu, None nếu hết timeout."""
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                if self.closed:
+                    return END
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._items)
+
+    def summary(self):
+        avg = self._depth_sum / self._puts if self._puts else 0.0
+        return (f"[QUEUE] {self.name}: depth avg {avg:.1f} / max {self.max_depth} "
+                f"(size {self.maxsize}, {self.policy}), dropped {self.dropped}")
+
+class StageStats:
+    """Bộ đếm số frame và độ trễ (giây) của một stage."""
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sketch = HistogramSketch(LATENCY_MIN, LATENCY_MAX, LATENCY_BINS)  # Phân vị, bộ nhớ hằng số
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self.count += 1
+            self.total += latency
+            self.max = max(self.max, latency)
+            self.sketch.update(latency)
+
+    def percentile(self, q):
+        """Độ trễ (giây) tại phân vị q (0-1), ước lượng từ sketch."""
+        with self._lock:
+            return min(self.sketch.quantile(q), self.max) if self.count else 0.0
+
+    def as_dict(self):
+        avg = self.total / self.count if self.count else 0.0
+        return {"frames": self.count, "avg_ms": round(avg * 1000, 3), "max_ms": round(self.max * 1000, 3),
+                **{f"p{q}_ms": round(self.percentile(q / 100) * 1000, 3) for q in (50, 95, 99)}}
+
+    def summary(self):
+        d = self.as_dict()
+        return (f"[STAGE] {self.name}: {d['frames']} frames, latency avg {d['avg_ms']:.1f} ms | "
+                f"p50 {d['p50_ms']:.1f} / p95 {d['p95_ms']:.1f} / p99 {d['p99_ms']:.1f} / max {d['max_ms']:.1f} ms")
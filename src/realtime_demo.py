@@ -1,9 +1,20 @@
 import cv2
 import numpy as np
 import os
-import glob
 import time
-from tensorflow.keras.models import load_model
+import json
+import sys
+import argparse
+import threading
+import traceback
+import alerts
+import frame_source
+import shm_ring
+from dataset import preprocess_frame
+from clips import ClipBuffer, clip_length_of
+from inference import load_backend, BACKEND
+from score_store import ScoreStore
+from pipeline import StageQueue, StageStats, BLOCK, DROP_OLDEST, END
 
 # --- CẤU HÌNH ---
 MODEL_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
@@ -16,100 +27,386 @@ TEST_DATA_PATH = os.path.join("data", "ucsd", "test", "Test002")
 # Nếu muốn test Avenue (Video file)
 #TEST_DATA_PATH = os.path.join("data", "avenue", "test", "20.avi")
 
-def play_sound_alert():
-    # Hàm phát tiếng kêu 'Beep' của hệ thống (Windows)
-    import winsound
-    winsound.Beep(1000, 200) # Tần số 1000Hz, 200ms
+# Pipeline: capture -> inference -> hiển thị, nối bằng hàng đợi giới hạn
+QUEUE_SIZE = 8
+BACKPRESSURE = BLOCK        # BLOCK: không mất frame | DROP_OLDEST: ưu tiên độ trễ thấp
+SKIP_FRAMES = 0             # 0 = chấm mọi frame; k = chạy model 1 trên k+1 frame (headless: frame bỏ qua không giải mã)
+DECODE_WORKERS = 0          # >0 (headless): giải mã + tiền xử lý trên N process, frame qua shared memory (shm_ring.py)
+
+# Chế độ không màn hình (server Linux): không imshow/waitKey, kết quả ghi ra log JSONL
+HEADLESS = False
+PACE = "source"             # "source": đọc frame theo FPS của nguồn (như camera thật) | "max": nhanh nhất có thể
+EVENT_LOG_PATH = os.path.join("outputs", "logs", "realtime_events.jsonl")
+STORE_SCORES = True         # Lưu điểm từng frame + đoạn bất thường vào SCORE_STORE_DIR/<camera> (score_store.py)
+
+def play_sound_alert(event=None):
+    # Tiếng kêu cảnh báo 1000Hz, 200ms (winsound / chuông terminal / tắt, xem alerts.py), không chặn vòng hiển thị
+    if event is None or event["type"] == "anomaly_start":
+        alerts.beep(1000, 200)
+
+class EventLog:
+    """
+    Log JSONL (mỗi dòng một JSON): điểm từng frame ("frame") và sự kiện bất thường
+    ("anomaly_start" / "anomaly_end", kèm số frame và MSE cao nhất), cuối cùng là "summary".
+    Sự kiện start/end được chuyển cho hooks (alerts.AlertHooks, không chặn).
+    """
+    def __init__(self, path, threshold, hooks=None):
+        self.threshold = threshold
+        self.hooks = hooks
+        self.file = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.file = open(path, "w", buffering=1 << 16)
+        self.t0 = time.perf_counter()
+        self.active = None    # Sự kiện bất thường đang mở
+        self.events = 0
+
+    def _write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+
+    def _emit(self, event):
+        self._write(event)
+        if self.hooks is not None:
+            self.hooks(event)
+
+    def frame(self, idx, mse, latency, scored=True):
+        """
+        Ghi điểm của frame idx, mở/đóng sự kiện khi vượt/xuống dưới ngưỡng. Trả về True nếu bất thường.
+        scored=False: frame không chạy model (giữ điểm của frame được chấm trước đó).
+        """
+        t = round(time.perf_counter() - self.t0, 4)
+        anomaly = bool(mse > self.threshold)
+        self._write({"type": "frame", "frame": idx, "t": t, "mse": round(float(mse), 8), "anomaly": anomaly,
+                     "scored": scored, "latency_ms": round(latency * 1000, 3)})
+        if anomaly and self.active is None:
+            self.events += 1
+            self.active = {"type": "anomaly_start", "event": self.events, "frame": idx, "t": t,
+                           "time": time.strftime("%Y-%m-%d %H:%M:%S"), "mse": round(float(mse), 8)}
+            self._emit(dict(self.active))
+            self.active["peak_mse"] = float(mse)
+        elif anomaly:
+            self.active["peak_mse"] = max(self.active["peak_mse"], float(mse))
+        elif self.active is not None:
+            self._end(idx, t)
+        return anomaly
+
+    def _end(self, idx, t):
+        start = self.active
+        self.active = None
+        self._emit({"type": "anomaly_end", "event": start["event"], "frame": idx, "t": t,
+                    "start_frame": start["frame"], "frames": idx - start["frame"],
+                    "duration_s": round(t - start["t"], 4), "peak_mse": round(start["peak_mse"], 8)})
+
+    def close(self, last_idx, summary=None):
+        """Đóng sự kiện còn mở (hết nguồn giữa lúc bất thường), ghi summary và đóng file."""
+        if self.active is not None:
+            self._end(last_idx + 1, round(time.perf_counter() - self.t0, 4))
+        if summary is not None:
+            self._write({"type": "summary", **summary})
+        if self.file is not None:
+            self.file.close()
+
+def open_source(path):
+    """
+    Mở nguồn video (Hỗ trợ cả Folder ảnh UCSD, Video file, live:<video> và cam:<index>).
+    Trả về FrameSource (frame_source.py).
+    """
+    source = frame_source.open_source(path)
+    if isinstance(source, frame_source.ImageFolderSource):
+        print(f"[INFO] Đang chạy demo trên folder ảnh: {source.frame_count} frames")
+    else:
+        print(f"[INFO] Đang chạy demo trên video: {path}")
+    return source
+
+def capture_stage(source, out_q, stop, stats, interval=None, headless=False, skip=0, decode_all=False):
+    """
+    Stage 1: đọc frame từ nguồn. interval: giãn cách giữa 2 frame (giây) để giả lập nguồn live, None = không chờ.
+    skip: chạy model 1 trên skip+1 frame. headless: không cần frame màu -> frame không chấm chỉ grab(),
+    frame chấm đọc thẳng ảnh xám 128x128; có màn hình thì đọc đủ mọi frame để hiển thị.
+    decode_all: headless nhưng vẫn cần ảnh xám của mọi frame (model clip).
+    Item: (idx, frame màu hoặc None, ảnh xám hoặc None, scored, t_capture).
+    """
+    if headless:
+        frames = frame_source.iter_scheduled(source, lambda i: decode_all or i % (skip + 1) == 0)
+    else:
+        frames = enumerate(source)
+    idx = 0
+    next_due = None
+    t0 = time.perf_counter()
+    try:
+        for i, data in frames:
+            if stop.is_set(): break
+            idx += 1
+            scored = i % (skip + 1) == 0
+            if headless:
+                # Buffer của nguồn được dùng lại ở lần đọc sau -> copy trước khi đưa vào hàng đợi
+                frame, small = None, (data.copy() if data is not None else None)
+            else:
+                frame, small = data, None
+            t_capture = time.perf_counter()
+            stats.record(t_capture - t0)
+            if interval is not None:
+                t_capture, next_due = _pace(t_capture, next_due, interval)
+            if not out_q.put((idx, frame, small, scored, t_capture)): break
+            t0 = time.perf_counter()
+    finally:
+        # Kể cả khi lỗi: đóng hàng đợi để stage sau (và main) không chờ mãi
+        source.release()
+        out_q.close()
+
+def _pace(t_capture, next_due, interval):
+    # Chờ đến lượt frame theo FPS của nguồn; chậm hơn nguồn thì không dồn nợ thời gian
+    if next_due is None or t_capture - next_due > interval:
+        next_due = t_capture
+    elif next_due > t_capture:
+        time.sleep(next_due - t_capture)
+        t_capture = time.perf_counter()
+    return t_capture, next_due + interval
+
+def ring_capture_stage(decoder, out_q, stop, stats, interval=None, skip=0):
+    """
+    Stage 1 khi giải mã đa process (headless, DECODE_WORKERS > 0): nhận ảnh xám 128x128 đã tiền xử lý
+    từ ring shared memory (shm_ring.ParallelDecoder) theo đúng thứ tự frame.
+    Frame không chấm (lịch skip) được đưa vào hàng đợi với scored=False như capture_stage;
+    decoder giải mã mọi frame (model clip) thì frame không chấm vẫn kèm ảnh xám.
+    """
+    idx = 0
+    next_due = None
+    t0 = time.perf_counter()
+
+    def emit(small, scored):
+        nonlocal idx, next_due, t0
+        idx += 1
+        t_capture = time.perf_counter()
+        stats.record(t_capture - t0)
+        if interval is not None:
+            t_capture, next_due = _pace(t_capture, next_due, interval)
+        ok = out_q.put((idx, None, small, scored, t_capture))
+        t0 = time.perf_counter()
+        return ok
+
+    try:
+        for index, gray in decoder:
+            if stop.is_set(): return
+            while idx < index:
+                if not emit(None, False): return
+            # View vào shared memory chỉ hợp lệ đến lần lặp sau -> copy; ảnh lỗi coi như frame không chấm
+            scored = gray is not None and index % (skip + 1) == 0
+            if not emit(None if gray is None else gray.copy(), scored): return
+        while idx < decoder.frames and not stop.is_set():
+            if not emit(None, False): return
+    finally:
+        decoder.close()
+        out_q.close()
+
+def inference_stage(backend, in_q, out_q, stats):
+    """
+    Stage 2: tiền xử lý (giống hệt lúc train) + chạy model + tính lỗi.
+    Frame không chấm giữ kết quả của frame được chấm gần nhất.
+    Model clip (T > 1): mọi frame có ảnh được đưa vào ClipBuffer, frame chấm dùng T frame gần nhất.
+    """
+    clip_length = clip_length_of(backend)
+    clips = ClipBuffer(clip_length) if clip_length > 1 else None
+    input_data = np.empty((1, 128, 128, clip_length), dtype=np.float32)
+    current = np.empty((128, 128), dtype=np.float32)
+    reconstructed, mse = None, 0.0
+    try:
+        while True:
+            item = in_q.get()
+            if item is END: break
+            idx, frame, small, scored, t_capture = item
+            t0 = time.perf_counter()
+            if scored or (clips is not None and (frame is not None or small is not None)):
+                if small is None:
+                    current[:] = preprocess_frame(frame)
+                else:
+                    np.divide(small, 255.0, out=current, dtype=np.float32)
+                if clips is not None:
+                    clips.push(current)
+            if scored:
+                input_data[0] = clips.clip() if clips is not None else current[..., np.newaxis]
+                reconstructed = backend.predict(input_data)
+                mse = np.mean(np.square(input_data - reconstructed))
+                stats.record(time.perf_counter() - t0)
+            if not out_q.put((idx, frame, reconstructed, mse, scored, t_capture)): break
+    finally:
+        # Đóng cả hàng đợi vào để capture không kẹt ở put() khi stage này dừng vì lỗi
+        in_q.close()
+        out_q.close()
+
+def run_stage(target, failed, *args):
+    """Chạy một stage trên thread riêng; lỗi được in traceback và đánh dấu failed để main thoát với mã lỗi."""
+    try:
+        target(*args)
+    except Exception:
+        print(f"[ERROR] Stage {target.__name__} dừng vì lỗi:\n{traceback.format_exc()}")
+        failed.set()
+
+def show(frame, reconstructed, mse, threshold, anomaly):
+    """Vẽ nhãn + lỗi lên frame và hiển thị cùng ảnh tái tạo. Trả về False nếu người dùng nhấn Q."""
+    # Resize để hiển thị cho đẹp (zoom lên x2)
+    display_frame = cv2.resize(frame, (0, 0), fx=2, fy=2)
+
+    # So sánh với Ngưỡng
+    label = "BINH THUONG"
+    color = (0, 255, 0) # Xanh lá
+    if anomaly:
+        label = "CANH BAO: BAT THUONG!"
+        color = (0, 0, 255) # Đỏ
+
+    # Vẽ lên màn hình
+    cv2.rectangle(display_frame, (0, 0), (display_frame.shape[1], 40), (0, 0, 0), -1)
+    cv2.putText(display_frame, f"{label}", (10, 30), 
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+    cv2.putText(display_frame, f"Error: {mse:.5f} | Threshold: {threshold:.5f}", (10, display_frame.shape[0] - 10), 
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+
+    # Hiển thị
+    cv2.imshow("Video Giam Sat (Nhan Q de thoat)", display_frame)
+    
+    # Hiện thêm ảnh tái tạo (để so sánh); chưa có khi frame chấm đầu tiên bị bỏ ở hàng đợi (DROP_OLDEST)
+    if reconstructed is not None:
+        recon_img = (reconstructed[0, :, :, -1] * 255).astype("uint8")   # Frame mới nhất của clip
+        cv2.imshow("AI 'Tuong tuong'", cv2.resize(recon_img, (200, 200)))
+    return cv2.waitKey(1) & 0xFF != ord('q')
+
+def main(source=TEST_DATA_PATH, headless=HEADLESS, pace=PACE, log_path=EVENT_LOG_PATH,
+         backend_name=BACKEND, sound=True, camera=None, store_scores=STORE_SCORES, skip=SKIP_FRAMES,
+         decode_workers=DECODE_WORKERS):
+    if pace not in ("source", "max"):
+        raise ValueError(f"PACE không hợp lệ: {pace} (chọn 'source' hoặc 'max')")
 
-def main():
     # 1. Load Ngưỡng
     if not os.path.exists(THRESHOLD_PATH):
         print("[ERROR] Chưa có file ngưỡng (threshold.txt). Chạy evaluate.py trước!")
-        return
+        return 1
     with open(THRESHOLD_PATH, "r") as f:
         threshold = float(f.read())
     print(f"[INFO] Đã load ngưỡng: {threshold}")
 
-    # 2. Load Model (Thêm compile=False để tránh lỗi version)
+    # 2. Load Model (mặc định chọn bằng biến môi trường ANOMALY_BACKEND)
     print("[INFO] Đang tải model...")
-    model = load_model(MODEL_PATH, compile=False)
+    backend = load_backend(backend_name, MODEL_PATH)
+    # Model clip cần ảnh của MỌI frame (frame bỏ qua vẫn vào ClipBuffer), chỉ lịch chạy model là thưa
+    clip_mode = clip_length_of(backend) > 1
 
-    # 3. Chuẩn bị nguồn video (Hỗ trợ cả Folder ảnh UCSD và Video file)
-    frames = []
-    is_video_file = False
-    
-    if os.path.isdir(TEST_DATA_PATH):
-        # Nếu là folder (UCSD)
-        image_paths = sorted(glob.glob(os.path.join(TEST_DATA_PATH, "*.tif")) + 
-                             glob.glob(os.path.join(TEST_DATA_PATH, "*.jpg")))
-        print(f"[INFO] Đang chạy demo trên folder ảnh: {len(image_paths)} frames")
-        # Đọc trước các đường dẫn
-        frames = image_paths
+    # 3. Chuẩn bị nguồn video
+    if decode_workers > 0 and not headless:
+        print("[WARNING] Giải mã đa process chỉ dùng khi headless (hiển thị cần frame màu), bỏ qua.")
+        decode_workers = 0
+    if decode_workers > 0:
+        frames = shm_ring.ParallelDecoder(source, decode_workers, 0 if clip_mode else skip)
+        print(f"[INFO] Giải mã trên {frames.workers} process qua shared memory ({shm_ring.START_METHOD}): {source}")
     else:
-        # Nếu là file video (Avenue)
-        print(f"[INFO] Đang chạy demo trên video file.")
-        is_video_file = True
-        cap = cv2.VideoCapture(TEST_DATA_PATH)
+        frames = open_source(source)
+    source_fps = frames.fps
+    # Nguồn live (camera, live:<video>) tự giữ nhịp, không chờ thêm
+    interval = 1.0 / source_fps if pace == "source" and not frames.is_live else None
 
-    # 4. Vòng lặp xử lý Realtime
-    idx = 0
+    # 4. Log sự kiện + hook cảnh báo (chạy trên thread riêng, không chặn pipeline)
+    hooks = alerts.AlertHooks([play_sound_alert] if sound else [])
+    log = EventLog(log_path, threshold, hooks)
+    camera = camera or os.path.splitext(os.path.basename(source.rstrip(os.sep)))[0]
+    store = ScoreStore(camera) if store_scores else None
+
+    # 5. Dựng pipeline: capture thread -> inference thread -> ghi log / hiển thị (main thread)
+    capture_q = StageQueue("capture->inference", QUEUE_SIZE, BACKPRESSURE)
+    result_q = StageQueue("inference->output", QUEUE_SIZE, BACKPRESSURE)
+    capture_stats = StageStats("capture")
+    infer_stats = StageStats("inference")
+    output_stats = StageStats("log" if headless else "display")
+    e2e_stats = StageStats("end-to-end")
+    stop = threading.Event()
+    failed = threading.Event()   # Một stage dừng vì lỗi -> thoát với mã lỗi, không in tổng kết
+
+    if decode_workers > 0:
+        capture = (ring_capture_stage, frames, capture_q, stop, capture_stats, interval, skip)
+    else:
+        capture = (capture_stage, frames, capture_q, stop, capture_stats, interval, headless, skip, clip_mode)
+    workers = [
+        threading.Thread(target=run_stage, args=(capture[0], failed) + capture[1:], daemon=True),
+        threading.Thread(target=run_stage, args=(inference_stage, failed, backend, capture_q, result_q, infer_stats),
+                         daemon=True),
+    ]
+    for t in workers: t.start()
+
+    # 6. Vòng lặp kết quả
+    start_time = time.perf_counter()
+    last_idx = 0
     while True:
-        # Đọc frame
-        if is_video_file:
-            ret, frame = cap.read()
-            if not ret: break
-        else:
-            if idx >= len(frames): break
-            frame = cv2.imread(frames[idx])
-            idx += 1
-            
-        if frame is None: break
-
-        # Resize để hiển thị cho đẹp (zoom lên x2)
-        display_frame = cv2.resize(frame, (0, 0), fx=2, fy=2)
-        
-        # --- XỬ LÝ MODEL ---
-        # 1. Tiền xử lý (giống hệt lúc train)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray_resized = cv2.resize(gray, (128, 128))
-        input_data = gray_resized.astype("float32") / 255.0
-        input_data = np.expand_dims(input_data, axis=0)     # (1, 128, 128)
-        input_data = np.expand_dims(input_data, axis=-1)    # (1, 128, 128, 1)
-        
-        # 2. Predict & Tính lỗi
-        reconstructed = model.predict(input_data, verbose=0)
-        mse = np.mean(np.square(input_data - reconstructed))
-        print(f"Frame: {idx} | Error: {mse:.6f} | Threshold: {threshold:.6f}")
-        
-        # 3. So sánh với Ngưỡng
-        label = "BINH THUONG"
-        color = (0, 255, 0) # Xanh lá
-        
-        if mse > threshold:
-            label = "CANH BAO: BAT THUONG!"
-            color = (0, 0, 255) # Đỏ
-            play_sound_alert() # Bỏ comment dòng này nếu muốn nghe tiếng kêu
-            
-        # 4. Vẽ lên màn hình
-        cv2.rectangle(display_frame, (0, 0), (display_frame.shape[1], 40), (0, 0, 0), -1)
-        cv2.putText(display_frame, f"{label}", (10, 30), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-        cv2.putText(display_frame, f"Error: {mse:.5f} | Threshold: {threshold:.5f}", (10, display_frame.shape[0] - 10), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
-
-        # 5. Hiển thị
-        cv2.imshow("Video Giam Sat (Nhan Q de thoat)", display_frame)
-        
-        # Hiện thêm ảnh tái tạo (để so sánh)
-        recon_img = (reconstructed[0, :, :, 0] * 255).astype("uint8")
-        cv2.imshow("AI 'Tuong tuong'", cv2.resize(recon_img, (200, 200)))
+        item = result_q.get()
+        if item is END: break
+        idx, frame, reconstructed, mse, scored, t_capture = item
+        last_idx = idx
+        t0 = time.perf_counter()
+        anomaly = log.frame(idx, mse, t0 - t_capture, scored)
+        if store is not None:
+            store.append(time.time(), mse, anomaly, scored)
+        if not headless:
+            print(f"Frame: {idx} | Error: {mse:.6f} | Threshold: {threshold:.6f}")
+            if not show(frame, reconstructed, mse, threshold, anomaly):
+                break
+        output_stats.record(time.perf_counter() - t0)
+        e2e_stats.record(time.perf_counter() - t_capture)
+
+    # 7. Dừng pipeline và in thống kê
+    stop.set()
+    capture_q.close()
+    result_q.close()
+    for t in workers: t.join(timeout=2.0)
+    if not headless:
+        cv2.destroyAllWindows()
+    hooks.flush()
+
+    if failed.is_set():
+        log.close(last_idx)
+        if store is not None:
+            store.close()
+        print(f"[ERROR] Pipeline dừng vì lỗi sau {last_idx} frames (xem traceback ở trên)")
+        return 1
 
-        # Chờ 30ms (giả lập tốc độ video), nhấn Q để thoát
-        if cv2.waitKey(30) & 0xFF == ord('q'):
-            break
+    elapsed = time.perf_counter() - start_time
+    done = output_stats.count
+    fps = done / elapsed if elapsed > 0 else 0.0
+    summary = {"frames": done, "elapsed_s": round(elapsed, 3), "fps": round(fps, 2),
+               "source_fps": round(source_fps, 2), "pace": pace, "skip": skip, "decode_workers": decode_workers,
+               "events": log.events,
+               "stages": {s.name: s.as_dict() for s in (capture_stats, infer_stats, output_stats, e2e_stats)},
+               "dropped": {q.name: q.dropped for q in (capture_q, result_q)}}
+    log.close(last_idx, summary)
+    if store is not None:
+        store.close()
 
-    if is_video_file: cap.release()
-    cv2.destroyAllWindows()
+    print(f"\n[INFO] Xử lý {done} frames trong {elapsed:.2f}s "
+          f"({fps:.1f} FPS, nguồn {source_fps:.1f} FPS, pace {pace}) | {log.events} sự kiện bất thường")
+    for stats in (capture_stats, infer_stats, output_stats, e2e_stats):
+        print(stats.summary())
+    for q in (capture_q, result_q):
+        print(q.summary())
+    if hooks.dropped:
+        print(f"[WARNING] Bỏ {hooks.dropped} sự kiện do hook cảnh báo xử lý không kịp")
+    if log_path:
+        print(f"[INFO] Log sự kiện: {log_path}")
+    if store is not None:
+        print(f"[INFO] Score store: {store.path} ({len(store)} frame, truy vấn bằng score_store.py)")
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Demo phát hiện bất thường thời gian thực (có/không màn hình)")
+    parser.add_argument("--source", default=TEST_DATA_PATH, help="Folder ảnh (UCSD) hoặc file video")
+    parser.add_argument("--headless", action="store_true", default=HEADLESS, help="Không hiển thị (server)")
+    parser.add_argument("--pace", choices=["source", "max"], default=PACE,
+                        help="source: theo FPS của nguồn | max: nhanh nhất có thể")
+    parser.add_argument("--log", default=EVENT_LOG_PATH, help="File log JSONL ('' = không ghi)")
+    parser.add_argument("--backend", default=BACKEND, help="keras | savedmodel | tflite | tflite_int8 | onnx | auto")
+    parser.add_argument("--no-sound", action="store_true", help="Tắt tiếng cảnh báo")
+    parser.add_argument("--skip", type=int, default=SKIP_FRAMES, help="Chạy model 1 trên skip+1 frame")
+    parser.add_argument("--camera", help="Tên camera trong score store (mặc định: tên nguồn)")
+    parser.add_argument("--no-store", action="store_true", default=not STORE_SCORES,
+                        help="Không lưu điểm vào score store")
+    parser.add_argument("--decode-workers", type=int, default=DECODE_WORKERS,
+                        help="Số process giải mã + tiền xử lý qua shared memory (chỉ headless, 0 = trong thread)")
+    args = parser.parse_args()
+    sys.exit(main(args.source, args.headless, args.pace, args.log, args.backend, not args.no_sound,
+                  args.camera, not args.no_store, args.skip, args.decode_workers))
@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# --- CẤU HÌNH ---
+SCORE_CACHE_DIR = os.path.join("outputs", "score_cache")
+SCORE_CACHE_MAX_MB = 256    # Vượt quá thì xoá các mục ít dùng nhất (LRU theo thời gian truy cập)
+HASH_CHUNK = 1 << 20
+
+def file_hash(path):
+    """SHA-1 nội dung file (video upload hoặc file model); thư mục (SavedModel) thì băm mọi file bên trong."""
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for p in files:
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+def cache_key(video_hash, model_version, config):
+    """Khoá cache: nội dung video + phiên bản model + cấu hình chấm điểm (lịch skip, flow...)."""
+    payload = json.dumps({"video": video_hash, "model": model_version, "config": config}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:24]
+
+class ScoreRecord:
+    """
+    Điểm từng frame của một video, KHÔNG phụ thuộc ngưỡng:
+    - scored: frame có chạy model không
+    - mse / flow: điểm của frame được chấm (flow = NaN nếu không dùng)
+    - boxes: khung ứng viên (toạ độ frame gốc) của mỗi frame được chấm,
+      lưu phẳng (M, 4) + offsets (khung chỉ phụ thuộc chuỗi bản đồ sai khác, không phụ thuộc ngưỡng).
+    """
+    def __init__(self, scored=None, mse=None, flow=None, boxes=None, box_offsets=None, meta=None):
+        self.scored = [] if scored is None else scored
+        self.mse = [] if mse is None else mse
+        self.flow = [] if flow is None else flow
+        self._boxes = [] if boxes is None else boxes
+        self.box_offsets = [0] if box_offsets is None else box_offsets
+        self.meta = meta or {}
+
+    def add(self, scored, mse=0.0, flow=None, boxes=()):
+        self.scored.append(scored)
+        self.mse.append(mse)
+        self.flow.append(np.nan if flow is None else flow)
+        self._boxes.extend(boxes)
+        self.box_offsets.append(len(self._boxes))
+
+    def __len__(self):
+        return len(self.scored)
+
+    def boxes(self, i):
+        return [tuple(int(v) for v in b) for b in self._boxes[self.box_offsets[i]:self.box_offsets[i + 1]]]
+
+    def labels(self, threshold, flow_threshold=None):
+        """
+        Nhãn bất thường và MSE hiển thị của mọi frame với một ngưỡng (vector hoá).
+        Frame không chấm giữ kết quả của frame được chấm gần nhất (như process_video).
+        Trả về (labels, mse_curve, source) với source[i] = frame được chấm mà frame i dùng.
+        """
+        scored = np.asarray(self.scored, dtype=bool)
+        mse = np.asarray(self.mse, dtype=np.float32)
+        hit = mse > threshold
+        if flow_threshold is not None:
+            hit |= np.nan_to_num(np.asarray(self.flow, dtype=np.float32), nan=-np.inf) > flow_threshold
+        source = np.maximum.accumulate(np.where(scored, np.arange(len(scored)), 0))
+        return hit[source], mse[source], source
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, scored=np.asarray(self.scored, dtype=bool),
+                 mse=np.asarray(self.mse, dtype=np.float32),
+                 flow=np.asarray(self.flow, dtype=np.float32),
+                 boxes=np.asarray(self._boxes, dtype=np.int32).reshape(-1, 4),
+                 box_offsets=np.asarray(self.box_offsets, dtype=np.int64),
+                 meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as d:
+            return cls(d["scored"], d["mse"], d["flow"], d["boxes"], d["box_offsets"],
+                       json.loads(str(d["meta"])))
+
+class ScoreCache:
+    """Cache điểm theo video trên đĩa, giới hạn dung lượng theo LRU."""
+    def __init__(self, cache_dir=SCORE_CACHE_DIR, max_mb=SCORE_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            record = ScoreRecord.load(path)
+        except Exception as e:
+            print(f"[WARNING] Cache điểm hỏng, bỏ qua: {path} ({e})")
+            return None
+        os.utime(path)  # Đánh dấu vừa dùng (LRU)
+        return record
+
+    def put(self, key, record):
+        record.save(self._path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path)
+                   for e in os.scandir(self.cache_dir) if e.name.endswith(".npz") and ".tmp" not in e.name]
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
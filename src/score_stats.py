@@ -0,0 +1,75 @@
+import numpy as np
+
+# Dải giá trị MSE của sketch (ảnh chuẩn hoá [0, 1] nên MSE <= 1)
+SKETCH_MIN = 1e-7
+SKETCH_MAX = 1.0
+SKETCH_BINS = 4096   # Bin chia theo log -> sai số tương đối ~0.4% mỗi bin
+
+class RunningStats:
+    """
+    Mean/std online (Welford, gộp theo batch kiểu Chan et al.).
+    Bộ nhớ hằng số, không cần giữ toàn bộ giá trị.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+        n_b = values.size
+        mean_b = values.mean()
+        m2_b = np.sum(np.square(values - mean_b))
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def std(self):
+        # Độ lệch chuẩn tổng thể (giống np.std mặc định)
+        return float(np.sqrt(self.m2 / self.n)) if self.n else 0.0
+
+class HistogramSketch:
+    """Histogram bin log cố định để ước lượng phân vị (percentile) theo stream."""
+    def __init__(self, lo=SKETCH_MIN, hi=SKETCH_MAX, bins=SKETCH_BINS):
+        self.edges = np.geomspace(lo, hi, bins + 1)
+        self.counts = np.zeros(bins + 2, dtype=np.int64)  # [underflow, bins..., overflow]
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        idx = np.searchsorted(self.edges, values, side="right")
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        """Giá trị tại phân vị q (0-1), nội suy hình học trong bin."""
+        if self.n == 0:
+            return float("nan")
+        target = q * self.n
+        cum = np.cumsum(self.counts)
+        i = int(np.searchsorted(cum, target, side="left"))
+        if i == 0:
+            return float(self.edges[0])
+        if i >= len(self.counts) - 1:
+            return float(self.edges[-1])
+        lo, hi = self.edges[i - 1], self.edges[i]
+        frac = (target - cum[i - 1]) / max(self.counts[i], 1)
+        return float(lo * (hi / lo) ** min(max(frac, 0.0), 1.0))
+
+    def histogram(self, bins=50, range_=None):
+        """Gộp lại thành histogram tuyến tính (để vẽ biểu đồ)."""
+        centers = np.sqrt(self.edges[:-1] * self.edges[1:])
+        if range_ is not None:
+            centers = np.clip(centers, *range_)
+        return np.histogram(centers, bins=bins, range=range_, weights=self.counts[1:-1])
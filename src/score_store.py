@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+# --- CẤU HÌNH ---
+SCORE_STORE_DIR = os.path.join("outputs", "score_store")   # Mỗi camera một thư mục con
+CHUNK_FRAMES = 1 << 16      # Số frame mỗi chunk (~1.1 MB/chunk, ~36 phút ở 30 FPS)
+SEGMENT_GAP_S = 1.0         # Gộp 2 đoạn bất thường cách nhau <= SEGMENT_GAP_S giây
+FLUSH_INTERVAL_S = 5.0      # Ghi meta + chỉ mục đoạn ít nhất mỗi FLUSH_INTERVAL_S giây (và khi một đoạn đóng)
+
+# Cờ từng frame (cột flags)
+FLAG_ANOMALY = 1            # Vượt ngưỡng lúc chấm
+FLAG_SCORED = 2             # Frame có chạy model (không phải giữ điểm của frame trước)
+
+# Các cột: tên -> (dtype, shape của một frame). Thời gian lưu offset float32 so với t0 của chunk.
+COLUMNS = {
+    "t": (np.float32, ()),
+    "mse": (np.float16, ()),        # float16: sai số tương đối ~0.05%, đủ cho MSE tái tạo
+    "flags": (np.uint8, ()),
+    "n_boxes": (np.uint8, ()),
+    "box": (np.uint16, (4,)),       # Khung bao hợp (x, y, w, h) của mọi khung trong frame
+}
+
+# Chỉ mục đoạn bất thường: sắp theo thời gian, không chồng nhau (đã gộp) -> tìm bằng searchsorted
+SEGMENT_DTYPE = np.dtype([("start", "f8"), ("end", "f8"), ("first", "i8"), ("last", "i8"),
+                          ("frames", "i4"), ("peak_mse", "f4")])
+
+def box_summary(boxes):
+    """(số khung, khung bao hợp (x, y, w, h)) của list khung (x, y, w, h)."""
+    if not len(boxes):
+        return 0, (0, 0, 0, 0)
+    b = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x0, y0 = b[:, 0].min(), b[:, 1].min()
+    x1, y1 = (b[:, 0] + b[:, 2]).max(), (b[:, 1] + b[:, 3]).max()
+    return min(len(b), 255), tuple(int(v) for v in np.clip((x0, y0, x1 - x0, y1 - y0), 0, 65535))
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+class ScoreStore:
+    """
+    Kho điểm dạng cột của một camera, cho footage dài (nhiều ngày):
+    - Cột mse (float16), flags, số khung + khung bao hợp, thời gian; chia chunk CHUNK_FRAMES frame,
+      mỗi chunk một file .npy mở bằng memmap (ghi thêm rẻ, đọc chỉ chạm chunk cần thiết).
+    - Chỉ mục đoạn bất thường đã gộp (segments.npy) để truy vấn theo khoảng thời gian không cần chấm lại.
+    Thời gian (giây, vd. time.time()) phải tăng dần theo thứ tự ghi.
+    append() tự flush mỗi flush_interval giây và ngay khi một đoạn bất thường đóng, nên process khác
+    (CLI score_store.py) thấy được đoạn mới của camera đang chạy; bị kill chỉ mất tối đa flush_interval giây.
+    """
+    def __init__(self, camera, root=SCORE_STORE_DIR, chunk_frames=CHUNK_FRAMES, segment_gap=SEGMENT_GAP_S,
+                 flush_interval=FLUSH_INTERVAL_S):
+        self.camera = camera
+        self.path = os.path.join(root, camera)
+        os.makedirs(self.path, exist_ok=True)
+        self.meta_path = os.path.join(self.path, "meta.json")
+        self.segments_path = os.path.join(self.path, "segments.npy")
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"camera": camera, "chunk_frames": chunk_frames, "segment_gap": segment_gap,
+                         "length": 0, "chunks": [], "open_segment": None}
+        self.chunk_frames = self.meta["chunk_frames"]
+        self.segment_gap = self.meta["segment_gap"]
+        self._segments = list(np.load(self.segments_path)) if os.path.exists(self.segments_path) else []
+        self._segment_index = None  # Mảng SEGMENT_DTYPE của các đoạn đã đóng (dựng lại khi có đoạn mới)
+        self._open = self.meta["open_segment"]
+        self._writer = None     # (chỉ số chunk, {cột: memmap}) của chunk đang ghi
+        self._readers = {}      # Chunk đã đầy, mở chỉ đọc
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._segment_closed = False
+
+    def __len__(self):
+        return self.meta["length"]
+
+    def _chunk_file(self, index, column):
+        return os.path.join(self.path, f"chunk_{index:06d}_{column}.npy")
+
+    # --- Ghi ---
+    def _writable_chunk(self, t):
+        chunks = self.meta["chunks"]
+        if not chunks or chunks[-1]["frames"] >= self.chunk_frames:
+            if chunks:
+                self.flush()    # Chunk cũ đã đầy: ghi hẳn xuống đĩa trước khi mở chunk mới
+            chunks.append({"t0": float(t), "t_first": float(t), "t_last": float(t), "frames": 0})
+        index = len(chunks) - 1
+        if self._writer is None or self._writer[0] != index:
+            self._flush_writer()
+            mode = "r+" if os.path.exists(self._chunk_file(index, "t")) else "w+"
+            arrays = {}
+            for name, (dtype, shape) in COLUMNS.items():
+                path = self._chunk_file(index, name)
+                if mode == "w+":
+                    arrays[name] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype,
+                                                             shape=(self.chunk_frames,) + shape)
+                else:
+                    arrays[name] = np.load(path, mmap_mode="r+")
+            self._writer = (index, arrays)
+        return chunks[index], self._writer[1]
+
+    def append(self, t, mse, anomaly, scored=True, boxes=()):
+        """Ghi một frame: thời gian t (giây), MSE, nhãn lúc chấm, khung (x, y, w, h) nếu có."""
+        chunk, arrays = self._writable_chunk(t)
+        i = chunk["frames"]
+        n_boxes, box = box_summary(boxes)
+        arrays["t"][i] = t - chunk["t0"]
+        arrays["mse"][i] = mse
+        arrays["flags"][i] = (FLAG_ANOMALY if anomaly else 0) | (FLAG_SCORED if scored else 0)
+        arrays["n_boxes"][i] = n_boxes
+        arrays["box"][i] = box
+        chunk["frames"] = i + 1
+        chunk["t_last"] = float(t)
+        frame = self.meta["length"]
+        self.meta["length"] = frame + 1
+        self._track_segment(frame, float(t), float(mse), anomaly)
+        if self._segment_closed or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _track_segment(self, frame, t, mse, anomaly):
+        seg = self._open
+        if anomaly:
+            if seg is not None and t - seg["end"] <= self.segment_gap:
+                seg["end"], seg["last"] = t, frame
+                seg["frames"] += 1
+                seg["peak_mse"] = max(seg["peak_mse"], mse)
+                return
+            self._close_segment()
+            self._open = {"start": t, "end": t, "first": frame, "last": frame, "frames": 1, "peak_mse": mse}
+        elif seg is not None and t - seg["end"] > self.segment_gap:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self._open is not None:
+            seg = self._open
+            self._segments.append(np.array((seg["start"], seg["end"], seg["first"], seg["last"],
+                                            seg["frames"], seg["peak_mse"]), dtype=SEGMENT_DTYPE))
+            self._segment_index = None
+            self._open = None
+            self._segment_closed = True
+
+    def _flush_writer(self):
+        if self._writer is not None:
+            for arr in self._writer[1].values():
+                arr.flush()
+
+    def flush(self):
+        """Ghi memmap, chỉ mục đoạn và meta xuống đĩa (ghi đè nguyên tử)."""
+        self._flush_writer()
+        tmp = self.segments_path + ".tmp.npy"
+        np.save(tmp, np.array(self._segments, dtype=SEGMENT_DTYPE).reshape(-1))
+        os.replace(tmp, self.segments_path)
+        self.meta["open_segment"] = self._open
+        _write_json(self.meta_path, self.meta)
+        self._last_flush = time.monotonic()
+        self._segment_closed = False
+
+    def close(self):
+        """
+        Flush và đóng file. Đoạn bất thường đang mở được lưu nguyên (meta["open_segment"]), không bị cắt:
+        mở lại và ghi tiếp trong vòng segment_gap giây thì vẫn là cùng một đoạn.
+        """
+        self.flush()
+        self._writer = None
+        self._readers = {}
+
+    # --- Đọc ---
+    def _chunk_arrays(self, index):
+        if self._writer is not None and self._writer[0] == index:
+            return self._writer[1]
+        if index not in self._readers:
+            self._readers[index] = {name: np.load(self._chunk_file(index, name), mmap_mode="r")
+                                    for name in COLUMNS}
+        return self._readers[index]
+
+    def segments(self, t1=None, t2=None, min_duration=0.0):
+        """Các đoạn bất thường giao với [t1, t2] (None = không giới hạn), gồm cả đoạn đang mở."""
+        if self._segment_index is None:
+            self._segment_index = np.array(self._segments, dtype=SEGMENT_DTYPE).reshape(-1)
+        segs = self._segment_index
+        if self._open is not None:
+            seg = self._open
+            segs = np.append(segs, np.array((seg["start"], seg["end"], seg["first"], seg["last"],
+                                             seg["frames"], seg["peak_mse"]), dtype=SEGMENT_DTYPE))
+        lo = 0 if t1 is None else int(np.searchsorted(segs["end"], t1, side="left"))
+        hi = len(segs) if t2 is None else int(np.searchsorted(segs["start"], t2, side="right"))
+        segs = segs[lo:hi]
+        if min_duration > 0:
+            segs = segs[segs["end"] - segs["start"] >= min_duration]
+        return segs
+
+    def frames(self, t1=None, t2=None):
+        """
+        Dữ liệu từng frame trong [t1, t2]: dict t (float64, giây), mse (float32), flags, n_boxes, box, index.
+        Chỉ đọc các chunk giao với khoảng thời gian.
+        """
+        chunks = self.meta["chunks"]
+        t_first = np.array([c["t_first"] for c in chunks])
+        t_last = np.array([c["t_last"] for c in chunks])
+        lo = 0 if t1 is None else int(np.searchsorted(t_last, t1, side="left"))
+        hi = len(chunks) if t2 is None else int(np.searchsorted(t_first, t2, side="right"))
+        parts = {name: [] for name in COLUMNS}
+        parts["index"] = []
+        for k in range(lo, hi):
+            c = chunks[k]
+            arrays = self._chunk_arrays(k)
+            t = arrays["t"][:c["frames"]].astype(np.float64) + c["t0"]
+            i0 = 0 if t1 is None else int(np.searchsorted(t, t1, side="left"))
+            i1 = len(t) if t2 is None else int(np.searchsorted(t, t2, side="right"))
+            parts["t"].append(t[i0:i1])
+            for name in ("mse", "flags", "n_boxes", "box"):
+                parts[name].append(np.asarray(arrays[name][i0:i1]))
+            parts["index"].append(np.arange(i0, i1) + k * self.chunk_frames)
+        out = {}
+        for name, (dtype, shape) in COLUMNS.items():
+            out[name] = np.concatenate(parts[name]) if parts[name] else np.zeros((0,) + shape, dtype)
+        out["t"] = out["t"].astype(np.float64)
+        out["mse"] = out["mse"].astype(np.float32)
+        out["index"] = np.concatenate(parts["index"]) if parts["index"] else np.zeros(0, np.int64)
+        return out
+
+def list_cameras(root=SCORE_STORE_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if os.path.exists(os.path.join(root, d, "meta.json")))
+
+def parse_time(value):
+    """Thời gian dạng 'YYYY-mm-dd HH:MM[:SS]' (giờ máy) hoặc số giây epoch."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"Không đọc được thời gian: {value}")
+
+def format_time(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) + f".{int((t % 1) * 1000):03d}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Truy vấn các đoạn bất thường đã lưu theo camera và khoảng thời gian")
+    parser.add_argument("--camera", action="append", help="Tên camera (lặp lại được). Mặc định: mọi camera")
+    parser.add_argument("--from", dest="t1", help="'YYYY-mm-dd HH:MM:SS' hoặc epoch")
+    parser.add_argument("--to", dest="t2", help="'YYYY-mm-dd HH:MM:SS' hoặc epoch")
+    parser.add_argument("--min-duration", type=float, default=0.0, help="Bỏ đoạn ngắn hơn (giây)")
+    parser.add_argument("--root", default=SCORE_STORE_DIR)
+    args = parser.parse_args()
+
+    t1, t2 = parse_time(args.t1), parse_time(args.t2)
+    for camera in args.camera or list_cameras(args.root):
+        store = ScoreStore(camera, args.root)
+        segs = store.segments(t1, t2, args.min_duration)
+        print(f"[KẾT QUẢ] {camera}: {len(store)} frame đã lưu, {len(segs)} đoạn bất thường")
+        for s in segs:
+            print(f"  {format_time(s['start'])} -> {format_time(s['end'])} "
+                  f"({s['end'] - s['start']:.1f}s, {s['frames']} frame, frame {s['first']}-{s['last']}, "
+                  f"MSE max {s['peak_mse']:.6f})")
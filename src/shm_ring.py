@@ -0,0 +1,389 @@
+import os
+import sys
+import time
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+import frame_source
+
+# --- CẤU HÌNH ---
+# Giải mã + tiền xử lý song song trên nhiều process, ghi ảnh xám 128x128 thẳng vào shared memory;
+# process inference đọc theo chỉ số slot, không pickle frame.
+DECODE_WORKERS = max(1, (os.cpu_count() or 1) - 1)   # Chừa 1 core cho inference
+RING_SLOTS = 256            # Số frame chấm tối đa nằm trong ring (128x128 uint8 -> 4 MB)
+VIDEO_CHUNK = 128           # Mỗi worker nhận các đoạn VIDEO_CHUNK frame liên tiếp (1 lần seek / đoạn)
+WAIT_TIMEOUT = 0.5          # Giây; chờ quá thì kiểm tra lại cờ dừng / worker chết
+# Cách tạo worker (biến môi trường ANOMALY_DECODE_START để đổi):
+# - forkserver (mặc định trên Linux/macOS): worker được fork từ một server đơn luồng -> an toàn dù process
+#   chính đã có thread pool của TensorFlow/onnxruntime; ring được pickle theo tên vùng nhớ.
+# - spawn (Windows): script gọi ParallelDecoder phải có if __name__ == "__main__".
+# - fork: chỉ khi tự chọn và tạo decoder TRƯỚC khi tải model (fork process nhiều thread có thể kẹt lock).
+START_METHOD = os.environ.get("ANOMALY_DECODE_START",
+                              "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+
+# Header int64 đầu vùng nhớ
+_READ, _DONE, _WORKERS, _STOP, _ERROR, _FRAMES, _END = range(7)
+_HEADER = 8
+_FREE = -1
+END = object()     # get(): hết nguồn (None = quá timeout)
+
+class FrameRing:
+    """
+    Ring buffer ảnh xám trong multiprocessing.shared_memory.
+    Frame chấm thứ seq (số thứ tự toàn cục, tăng dần) nằm ở slot seq % slots, kèm meta (seq, frame index, ok).
+    - Writer: reserve(seq) chờ slot trống (consumer đã release seq - slots) -> ghi thẳng vào view -> commit().
+    - Consumer: get(seq) chờ đúng seq (giữ thứ tự dù nhiều writer ghi xen kẽ) -> dùng view -> release(seq).
+    Mỗi writer phải ghi các seq của mình theo thứ tự tăng dần (không thể kẹt: seq consumer đang chờ luôn
+    nằm trong cửa sổ slots nên writer của nó không bao giờ phải chờ).
+    Writer gặp hết nguồn sớm hơn số frame header báo thì ghi seq kết thúc (worker_done(end=...)):
+    consumer dừng đúng ở đó thay vì chờ seq không bao giờ tới.
+    """
+    def __init__(self, slots=RING_SLOTS, shape=(128, 128), workers=1, ctx=None):
+        ctx = ctx or mp.get_context(START_METHOD)
+        self.slots, self.shape = slots, tuple(shape)
+        size = (_HEADER + 3 * slots) * 8 + slots * int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.owner = os.getpid()   # Chỉ process tạo ring mới unlink (worker fork mang bản sao đối tượng)
+        lock = ctx.Lock()
+        self.readable = ctx.Condition(lock)   # Có frame mới / worker xong / lỗi
+        self.writable = ctx.Condition(lock)   # Consumer đã trả slot / dừng
+        self._attach()
+        self.header[:] = 0
+        self.header[_WORKERS] = workers
+        self.header[_END] = np.iinfo(np.int64).max
+        self.meta[:, 0] = _FREE
+
+    def _attach(self):
+        buf = self.shm.buf
+        self.header = np.ndarray((_HEADER,), np.int64, buf, 0)
+        self.meta = np.ndarray((self.slots, 3), np.int64, buf, _HEADER * 8)
+        self.frames = np.ndarray((self.slots,) + self.shape, np.uint8, buf, (_HEADER + 3 * self.slots) * 8)
+
+    def __getstate__(self):
+        # forkserver / spawn: process con gắn lại vùng nhớ theo tên
+        return {"name": self.shm.name, "slots": self.slots, "shape": self.shape,
+                "readable": self.readable, "writable": self.writable}
+
+    def __setstate__(self, state):
+        self.slots, self.shape = state["slots"], state["shape"]
+        self.readable, self.writable = state["readable"], state["writable"]
+        # Process con dùng chung resource_tracker với process cha: đăng ký trùng tên không sinh rò rỉ
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self.owner = None
+        self._attach()
+
+    @property
+    def stopped(self):
+        return bool(self.header[_STOP])
+
+    # --- Writer ---
+    def reserve(self, seq):
+        """View (H, W) uint8 của slot cho seq khi slot đã trống; None nếu ring đã dừng."""
+        with self.writable:
+            while seq - self.header[_READ] >= self.slots:
+                if self.header[_STOP] or seq >= self.header[_END]: return None
+                self.writable.wait(WAIT_TIMEOUT)
+            if self.header[_STOP] or seq >= self.header[_END]: return None
+        return self.frames[seq % self.slots]
+
+    def commit(self, seq, index, ok=True):
+        """Đánh dấu slot của seq đã ghi xong (frame index của nguồn; ok=False: frame đọc lỗi)."""
+        with self.readable:
+            self.meta[seq % self.slots] = (seq, index, ok)
+            self.readable.notify_all()
+
+    def worker_done(self, frames=0, end=None):
+        """
+        Worker đã hết phần việc. frames: số frame của nguồn mà worker đã đi qua (để biết tổng).
+        end: seq đầu tiên không tồn tại khi worker gặp hết nguồn (video ngắn hơn header báo).
+        """
+        with self.readable:
+            self.header[_DONE] += 1
+            self.header[_FRAMES] = max(self.header[_FRAMES], frames)
+            if end is not None:
+                self.header[_END] = min(self.header[_END], end)
+                self.writable.notify_all()   # Writer đang chờ slot cho seq sau điểm kết thúc thì thôi
+            self.readable.notify_all()
+
+    def fail(self):
+        with self.readable:
+            self.header[_ERROR] = 1
+            self.readable.notify_all()
+
+    # --- Consumer ---
+    def get(self, seq, timeout=None):
+        """
+        (view, frame index, ok) của seq; END khi seq nằm sau điểm hết nguồn, mọi worker đã xong mà không có seq
+        hoặc ring đã dừng; None khi quá timeout. Worker báo lỗi -> RuntimeError.
+        """
+        slot = seq % self.slots
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.readable:
+            while self.meta[slot, 0] != seq:
+                if self.header[_ERROR]:
+                    raise RuntimeError("Worker giải mã gặp lỗi (xem traceback ở trên)")
+                if seq >= self.header[_END] or self.header[_DONE] >= self.header[_WORKERS] or self.header[_STOP]:
+                    return END
+                remaining = WAIT_TIMEOUT if deadline is None else deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.readable.wait(remaining)
+            index, ok = int(self.meta[slot, 1]), bool(self.meta[slot, 2])
+        return self.frames[slot], index, ok
+
+    def release(self, seq):
+        """Consumer đã dùng xong mọi frame đến seq: các slot được ghi lại."""
+        with self.writable:
+            self.header[_READ] = seq + 1
+            self.writable.notify_all()
+
+    def stop(self):
+        with self.readable:
+            self.header[_STOP] = 1
+            self.readable.notify_all()
+            self.writable.notify_all()
+
+    @property
+    def frames_seen(self):
+        return int(self.header[_FRAMES])
+
+    def close(self):
+        self.header = self.meta = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Người gọi còn giữ view: vùng nhớ được giải phóng khi view bị thu hồi
+        if self.owner == os.getpid():
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+def _chunks(worker, workers, chunk, frame_count):
+    """Các đoạn [start, stop) của worker (chia vòng tròn); đoạn cuối stop=None -> đọc đến hết video."""
+    n = -(-frame_count // chunk) if frame_count > 0 else None
+    c = worker
+    while n is None or c < n:
+        yield c * chunk, (c + 1) * chunk if n is None or c < n - 1 else None
+        c += workers
+
+def _seek(source, start):
+    """
+    Đưa source tới frame start; True nếu tới được, False nếu video hết trước start.
+    Seek hụt (header báo thừa frame: OpenCV dừng ở frame cuối thật) thì grab tiếp từ vị trí thực tế.
+    """
+    if source.seek(start):
+        return True
+    pos = int(source.cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if not 0 <= pos <= start:
+        raise RuntimeError(f"Không seek chính xác được tới frame {start} (backend dừng ở {pos})")
+    source.index = pos
+    while source.index < start:
+        if not source.grab():
+            return False
+    return True
+
+def _decode_video(ring, source, worker, workers, step, chunk):
+    """
+    Giải mã phần việc của worker trên video; frame chấm đọc thẳng vào slot.
+    Trả về (số frame đã đi qua, True nếu gặp hết video). Hết video ở giữa đoạn = hết nguồn (như đọc tuần tự).
+    """
+    seen = 0
+    # Nguồn live chỉ có 1 worker đọc tuần tự
+    chunks = [(0, None)] if source.is_live else _chunks(worker, workers, chunk, source.frame_count)
+    for start, stop in chunks:
+        if start != source.index and not _seek(source, start):
+            return source.index, True
+        i = start
+        while stop is None or i < stop:
+            if ring.stopped: return seen, False
+            if i % step == 0:
+                slot = ring.reserve(i // step)
+                if slot is None: return seen, False
+                if source.read_small(out=slot) is None: return i, True
+                ring.commit(i // step, i)
+            elif not source.grab():
+                return i, True
+            i += 1
+            seen = i
+    return seen, False
+
+def _decode_images(ring, source, worker, workers, step):
+    """Folder ảnh: truy cập ngẫu nhiên nên chia vòng tròn từng frame chấm. Ảnh lỗi -> ok=False."""
+    for i in range(worker * step, source.frame_count, workers * step):
+        slot = ring.reserve(i // step)
+        if slot is None: break
+        gray = frame_source.read_image_small(source.paths[i], source.resize, source.factor, slot, source._small)
+        ring.commit(i // step, i, gray is not None)
+    return source.frame_count, False
+
+def _decode_worker(ring, spec, worker, workers, step, chunk, resize):
+    cv2.setNumThreads(1)   # Song song theo process; thread pool của OpenCV chỉ tranh core
+    source, seen, ended = None, 0, False
+    try:
+        source = frame_source.open_source(spec, resize)
+        if isinstance(source, frame_source.ImageFolderSource):
+            seen, ended = _decode_images(ring, source, worker, workers, step)
+        else:
+            seen, ended = _decode_video(ring, source, worker, workers, step, chunk)
+    except Exception:
+        print(f"[ERROR] Worker giải mã {worker}:\n{traceback.format_exc()}")
+        ring.fail()
+    finally:
+        if source is not None:
+            source.release()
+        # Hết video tại frame seen: seq đầu tiên không tồn tại là ceil(seen / step)
+        ring.worker_done(seen, -(-seen // step) if ended else None)
+        ring.close()
+
+class ParallelDecoder:
+    """
+    Đọc nguồn (folder ảnh, video file, live:/cam:) bằng nhiều process theo lịch cố định 1 trên skip+1 frame.
+    Duyệt: yield (frame index, ảnh xám uint8 hoặc None nếu ảnh lỗi) của các frame chấm, đúng thứ tự.
+    Ảnh là view vào shared memory, chỉ hợp lệ đến lần lặp sau (copy nếu cần giữ).
+    - Video: chia đoạn VIDEO_CHUNK frame, mỗi worker seek tới đoạn của mình (frame bỏ qua chỉ grab()).
+    - Folder ảnh: chia vòng tròn từng frame.
+    - Nguồn live hoặc video không rõ số frame: 1 worker (không seek được).
+    """
+    def __init__(self, spec, workers=DECODE_WORKERS, skip=0, slots=RING_SLOTS, chunk=VIDEO_CHUNK,
+                 resize=frame_source.RESIZE):
+        probe = frame_source.open_source(spec, resize)
+        self.fps, self.size, self.frame_count, self.is_live = probe.fps, probe.size, probe.frame_count, probe.is_live
+        images = isinstance(probe, frame_source.ImageFolderSource)
+        probe.release()
+        if self.is_live or (not images and self.frame_count <= 0):
+            workers = 1
+        self.workers = max(1, workers)
+        self.step = skip + 1
+        chunk = self.step if images else max(self.step, chunk // self.step * self.step)
+        # Đủ slot để mọi worker cùng ghi đoạn của mình mà không chờ nhau
+        slots = max(slots, 2 * self.workers * (chunk // self.step))
+        # Thread pool của TF/onnxruntime là thread native (threading không thấy) -> dựa vào module đã nạp
+        if START_METHOD == "fork" and any(m in sys.modules for m in ("tensorflow", "onnxruntime")):
+            print("[WARNING] Fork worker giải mã sau khi đã tải TensorFlow/onnxruntime có thể bị kẹt lock; "
+                  "dùng forkserver/spawn hoặc tạo decoder trước khi tải model.")
+        ctx = mp.get_context(START_METHOD)
+        self.ring = FrameRing(slots, (resize[1], resize[0]), self.workers, ctx)
+        self.procs = [ctx.Process(target=_decode_worker, name=f"decode-{k}", daemon=True,
+                                  args=(self.ring, spec, k, self.workers, self.step, chunk, resize))
+                      for k in range(self.workers)]
+        for p in self.procs: p.start()
+        self.frames = 0    # Tổng số frame của nguồn (biết sau khi duyệt hết)
+
+    def _check_workers(self):
+        dead = [p for p in self.procs if p.exitcode not in (None, 0)]
+        if dead:
+            raise RuntimeError(f"Worker giải mã {dead[0].name} dừng bất thường (exit {dead[0].exitcode})")
+
+    def __iter__(self):
+        seq = 0
+        while True:
+            item = self.ring.get(seq, WAIT_TIMEOUT)
+            if item is None:
+                self._check_workers()
+                continue
+            if item is END:
+                self.frames = self.ring.frames_seen
+                return
+            gray, index, ok = item
+            yield index, (gray if ok else None)
+            self.ring.release(seq)
+            seq += 1
+
+    def batches(self, batch_size, out=None):
+        """
+        Gom frame chấm thành batch đầu vào model float32 [0, 1] shape (B, H, W, 1).
+        Yield (danh sách frame index, batch[:n]); batch được dùng lại giữa các lần yield.
+        Frame đọc lỗi bị bỏ qua.
+        """
+        h, w = self.ring.shape
+        batch = np.empty((batch_size, h, w, 1), dtype=np.float32) if out is None else out
+        indices = []
+        for index, gray in self:
+            if gray is None: continue
+            np.divide(gray, 255.0, out=batch[len(indices), :, :, 0], dtype=np.float32)
+            indices.append(index)
+            if len(indices) == batch_size:
+                yield indices, batch
+                indices = []
+        if indices:
+            yield indices, batch[:len(indices)]
+
+    def close(self):
+        """Dừng worker (kể cả khi đang chờ slot), đợi thoát rồi giải phóng shared memory."""
+        if self.ring.header is None: return
+        self.ring.stop()
+        for p in self.procs:
+            p.join(timeout=2.0)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def measure(spec, workers, skip=0):
+    """Đọc hết nguồn bằng ParallelDecoder, trả về (giây, số frame chấm)."""
+    t0 = time.perf_counter()
+    n = 0
+    with ParallelDecoder(spec, workers, skip) as decoder:
+        for _, gray in decoder:
+            n += gray is not None
+    return time.perf_counter() - t0, n
+
+def check(spec, workers, skip=0, chunk=VIDEO_CHUNK):
+    """So ParallelDecoder với đọc tuần tự (iter_scheduled): cùng frame index và cùng ảnh. Trả về True nếu khớp."""
+    with frame_source.open_source(spec) as source:
+        expected = [(i, gray.copy()) for i, gray in frame_source.iter_scheduled(source, lambda i: i % (skip + 1) == 0)
+                    if gray is not None]
+    with ParallelDecoder(spec, workers, skip, chunk=chunk) as decoder:
+        got = [(i, gray.copy()) for i, gray in decoder if gray is not None]
+    return len(got) == len(expected) and all(a[0] == b[0] and np.array_equal(a[1], b[1])
+                                             for a, b in zip(got, expected))
+
+def make_truncated_video(path, length=1200, keep=1 / 3, size=(320, 240)):
+    """Video MJPG bị cắt còn keep dung lượng: header vẫn báo length frame nhưng giải mã được ít hơn."""
+    tmp = path + ".full.avi"
+    out = cv2.VideoWriter(tmp, cv2.VideoWriter_fourcc(*"MJPG"), frame_source.DEFAULT_FPS, size)
+    for i in range(length):
+        frame = np.full((size[1], size[0], 3), i % 256, dtype=np.uint8)
+        cv2.putText(frame, str(i), (20, size[1] // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 0, 0), 3)
+        out.write(frame)
+    out.release()
+    with open(tmp, "rb") as f:
+        data = f.read()
+    os.remove(tmp)
+    with open(path, "wb") as f:
+        f.write(data[:int(len(data) * keep)])
+    return path
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description="Đo thông lượng giải mã + tiền xử lý song song qua shared memory")
+    parser.add_argument("source", nargs="?", help="Folder ảnh hoặc file video")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, DECODE_WORKERS])
+    parser.add_argument("--skip", type=int, default=0)
+    parser.add_argument("--check", action="store_true",
+                        help="Kiểm tra kết quả khớp đọc tuần tự (không có source: dùng video bị cắt cụt tự tạo)")
+    args = parser.parse_args()
+    print(f"[INFO] {os.cpu_count()} CPU, start method {START_METHOD}")
+    if args.check:
+        with tempfile.TemporaryDirectory() as tmp:
+            spec = args.source or make_truncated_video(os.path.join(tmp, "truncated.avi"))
+            results = [(w, skip, check(spec, w, skip, chunk=64))
+                       for w in sorted({1, 2, *args.workers}) for skip in sorted({0, 2, args.skip})]
+        for workers, skip, ok in results:
+            print(f"[KẾT QUẢ] {workers} worker, skip {skip}: {'khớp' if ok else 'KHÁC'} đọc tuần tự")
+        sys.exit(0 if all(ok for _, _, ok in results) else 1)
+    if args.source is None:
+        parser.error("cần source (hoặc --check)")
+    for workers in args.workers:
+        seconds, n = measure(args.source, workers, args.skip)
+        print(f"[KẾT QUẢ] {workers} worker: {n} frame chấm trong {seconds:.2f}s -> {n / max(seconds, 1e-9):.1f} FPS")
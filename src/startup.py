@@ -0,0 +1,64 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+import numpy as np
+
+# --- CẤU HÌNH ---
+STARTUP_LOG_DIR = os.path.join("outputs", "logs")
+
+class StartupReport:
+    """
+    Đo thời gian khởi động theo từng giai đoạn (import, import runtime, nạp model, warm-up...).
+    t0: mốc bắt đầu (thường lấy ngay dòng đầu của script, trước các import nặng).
+    """
+    def __init__(self, app, t0=None):
+        self.app = app
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.phases = []
+        self.info = {}
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def total(self):
+        return time.perf_counter() - self.t0
+
+    def summary(self):
+        parts = " | ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        return f"Khởi động {self.app}: {self.total():.2f}s ({parts})"
+
+    def save(self, log_dir=STARTUP_LOG_DIR):
+        """In tóm tắt và ghi JSON outputs/logs/startup_<app>.json. Trả về đường dẫn file."""
+        print(f"[INFO] {self.summary()}")
+        os.makedirs(log_dir, exist_ok=True)
+        path = os.path.join(log_dir, f"startup_{self.app}.json")
+        report = {"app": self.app, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "total_s": round(self.total(), 4),
+                  "phases": {name: round(seconds, 4) for name, seconds in self.phases},
+                  **self.info}
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return path
+
+def warm_up(backend, batch_sizes=(1,)):
+    """
+    Chạy thử model với input rỗng để trả trước chi phí lần forward đầu tiên
+    (trace tf.function, cấp phát bộ nhớ, khởi tạo kernel) lúc khởi động thay vì trong request đầu.
+    Trả về thời gian lần forward đầu tiên (giây).
+    """
+    first = None
+    for n in batch_sizes:
+        start = time.perf_counter()
+        backend.predict(np.zeros((n,) + tuple(backend.input_shape), dtype=np.float32))
+        if first is None:
+            first = time.perf_counter() - start
+    return first
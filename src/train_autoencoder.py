@@ -1,9 +1,15 @@
 import os
+import json
+import time
 import numpy as np
 import matplotlib.pyplot as plt
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
-from dataset import get_training_data
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback, ModelCheckpoint, EarlyStopping
+from tensorflow.keras.models import load_model
+from tensorflow.keras.optimizers.schedules import CosineDecay
+from dataset import get_training_data, cache_path_for
 from autoencoder import build_autoencoder
+from data_pipeline import make_train_val_datasets, split_sources
 
 # --- CẤU HÌNH ---
 # Đường dẫn dữ liệu (Bạn kiểm tra lại xem đúng folder chưa nhé)
@@ -11,58 +17,264 @@ DATA_PATH = os.path.join("data", "ucsd", "train")
 #DATA_PATH = os.path.join("data", "avenue", "train")
 MODEL_SAVE_PATH = os.path.join("outputs", "models", "anomaly_detector.h5")
 PLOT_SAVE_PATH = os.path.join("outputs", "logs", "training_plot.png")
+THROUGHPUT_PATH = os.path.join("outputs", "logs", "training_throughput.json")
+# Trạng thái train ghi sau mỗi epoch: trọng số, biến optimizer (moment Adam, số bước) và manifest nguồn đã train
+STATE_PATH = os.path.join("outputs", "models", "train_state.weights.h5")
+OPTIMIZER_STATE_PATH = os.path.join("outputs", "models", "optimizer_state.npz")
+MANIFEST_PATH = os.path.join("outputs", "models", "train_manifest.json")
 
 # Tham số huấn luyện
 # Để test nhanh thì để EPOCHS nhỏ (ví dụ 2). Khi train thật thì tăng lên 20-50.
 EPOCHS = 10 
-BATCH_SIZE = 32
+BATCH_SIZE = 128
+
+# --- HIỆU NĂNG TRAIN ---
+# Batch lớn hơn -> learning rate lớn hơn: BASE_LR ứng với BASE_BATCH_SIZE, nhân theo căn bậc hai
+# tỉ lệ batch (hợp với Adam), warm-up tuyến tính WARMUP_EPOCHS epoch rồi giảm cosine.
+BASE_LR = 1e-3
+BASE_BATCH_SIZE = 32
+LR_SCHEDULE = True
+WARMUP_EPOCHS = 1
+
+JIT_COMPILE = False        # Biên dịch train step bằng XLA (trên CPU có thể chậm hơn oneDNN: so sánh bằng báo cáo thông lượng)
+MIXED_PRECISION = False    # bfloat16 cho lớp ẩn; chỉ nhanh trên CPU có AVX512-BF16/AMX (model lưu ra vẫn float32)
+INTRA_OP_THREADS = 0       # Số thread trong một op (0 = TensorFlow tự chọn theo số core)
+INTER_OP_THREADS = 0       # Số op chạy song song (0 = tự chọn)
+
+# Chế độ stream: đọc frame uint8 từ cache theo lô (tf.data), RAM không tăng theo dữ liệu.
+# Đặt False để dùng cách cũ (nạp toàn bộ dữ liệu float32 vào RAM).
+STREAMING = True
+
+# Số frame liên tiếp mỗi mẫu (model không gian - thời gian nhìn được chuyển động).
+# 1 = model một frame như cũ. Các script suy luận tự đọc T từ input của model.
+CLIP_LENGTH = 1
+
+# Tiếp tục lần train bị dừng từ STATE_PATH (trọng số + optimizer + số epoch đã xong)
+RESUME = False
+
+def configure_threads(intra=INTRA_OP_THREADS, inter=INTER_OP_THREADS):
+    """Đặt kích thước thread pool của TensorFlow (phải gọi trước khi chạy op đầu tiên)."""
+    try:
+        if intra: tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter: tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        print(f"[WARNING] Không đặt được số thread (TensorFlow đã khởi tạo): {e}")
+    print(f"[INFO] Threads: intra-op {tf.config.threading.get_intra_op_parallelism_threads() or 'auto'}, "
+          f"inter-op {tf.config.threading.get_inter_op_parallelism_threads() or 'auto'} ({os.cpu_count()} CPU)")
+
+def make_learning_rate(steps_per_epoch, epochs=EPOCHS, batch_size=BATCH_SIZE):
+    """Learning rate theo batch size; kèm warm-up + cosine decay nếu LR_SCHEDULE."""
+    peak = BASE_LR * np.sqrt(batch_size / BASE_BATCH_SIZE)
+    if not LR_SCHEDULE or steps_per_epoch <= 0:
+        return float(peak)
+    warmup = min(WARMUP_EPOCHS, epochs - 1) * steps_per_epoch
+    return CosineDecay(initial_learning_rate=peak / 10, decay_steps=max(epochs * steps_per_epoch - warmup, 1),
+                       warmup_target=float(peak), warmup_steps=warmup)
+
+class ThroughputLogger(Callback):
+    """Đo thời gian từng epoch (phần train, không tính validation) và số mẫu/giây."""
+    def __init__(self, batch_size, train_samples):
+        super().__init__()
+        self.batch_size = batch_size
+        self.train_samples = train_samples
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.steps = 0
+        self.t0 = time.perf_counter()
+        self.train_end = None
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+
+    def on_test_begin(self, logs=None):
+        if self.train_end is None:
+            self.train_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.perf_counter()
+        train_s = (self.train_end or now) - self.t0
+        samples = min(self.steps * self.batch_size, self.train_samples)
+        self.epochs.append({"epoch": epoch + 1, "epoch_s": round(now - self.t0, 3), "train_s": round(train_s, 3),
+                            "samples": samples, "samples_per_s": round(samples / max(train_s, 1e-9), 1)})
+        print(f"[INFO] Epoch {epoch + 1}: {train_s:.1f}s train, {samples / max(train_s, 1e-9):.0f} mẫu/s")
+
+    def report(self, config):
+        # Epoch đầu gồm cả thời gian biên dịch (XLA) -> thông lượng ổn định tính từ epoch 2
+        steady = self.epochs[1:] or self.epochs
+        return {"config": config, "epochs": self.epochs,
+                "steady_samples_per_s": round(sum(e["samples"] for e in steady) /
+                                              max(sum(e["train_s"] for e in steady), 1e-9), 1),
+                "mean_epoch_s": round(float(np.mean([e["epoch_s"] for e in steady])), 3) if steady else 0.0}
+
+def source_manifest(data):
+    """Chữ ký từng nguồn của FrameView (theo tên file cache: đổi nội dung nguồn -> đổi chữ ký)."""
+    return {os.path.abspath(p): {"cache": os.path.basename(cache_path_for(p)), "frames": int(len(a))}
+            for p, a in zip(data.sources, data.arrays)}
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+def _optimizer_slots(optimizer):
+    # Learning rate không lưu (lấy theo cấu hình/lịch hiện tại); thứ tự biến theo thứ tự trọng số của model
+    return [v for v in optimizer.variables if not v.path.endswith("learning_rate")]
+
+def save_optimizer_state(optimizer, path=OPTIMIZER_STATE_PATH):
+    """
+    Lưu biến optimizer (số bước, moment/velocity của Adam) ra .npz.
+    Không dựa vào optimizer trong file .keras (Keras 3 không khôi phục đúng Adam có lịch learning rate).
+    """
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, *[v.numpy() for v in _optimizer_slots(optimizer)])
+    os.replace(tmp, path)
+
+def load_optimizer_state(model, path=OPTIMIZER_STATE_PATH):
+    """Nạp biến optimizer đã lưu vào model.optimizer (build nếu cần). Trả về True nếu khớp kiến trúc."""
+    if not os.path.exists(path):
+        return False
+    optimizer = model.optimizer
+    if not optimizer.built:
+        optimizer.build(model.trainable_variables)
+    slots = _optimizer_slots(optimizer)
+    with np.load(path) as saved:
+        values = [saved[f"arr_{i}"] for i in range(len(saved.files))]
+    if len(values) != len(slots) or any(v.shape != tuple(s.shape) for v, s in zip(values, slots)):
+        print(f"[WARNING] Trạng thái optimizer {path} không khớp model, bỏ qua.")
+        return False
+    for slot, value in zip(slots, values):
+        slot.assign(value)
+    return True
+
+class TrainState(Callback):
+    """Sau mỗi epoch: lưu trọng số + biến optimizer và manifest (epoch đã xong, val_loss tốt nhất)."""
+    def __init__(self, manifest, state_path=STATE_PATH, optimizer_path=OPTIMIZER_STATE_PATH,
+                 manifest_path=MANIFEST_PATH):
+        super().__init__()
+        self.manifest = manifest
+        self.state_path = state_path
+        self.optimizer_path = optimizer_path
+        self.manifest_path = manifest_path
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.model.save_weights(self.state_path)
+        save_optimizer_state(self.model.optimizer, self.optimizer_path)
+        val_loss = (logs or {}).get("val_loss")
+        best = self.manifest.get("best_val_loss")
+        if val_loss is not None and (best is None or val_loss < best):
+            self.manifest["best_val_loss"] = float(val_loss)
+        self.manifest["epochs_done"] = epoch + 1
+        self.manifest["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        save_manifest(self.manifest, self.manifest_path)
+
+def to_float32(model, input_shape):
+    """Bản float32 thuần của model mixed precision (cùng trọng số), để suy luận/export như cũ."""
+    plain = build_autoencoder(input_shape=input_shape)
+    plain.set_weights(model.get_weights())
+    return plain
 
 def train():
+    # 0. Thread pool (trước khi TensorFlow chạy op nào)
+    configure_threads(INTRA_OP_THREADS, INTER_OP_THREADS)
+
     # 1. Tạo thư mục output nếu chưa có
     os.makedirs(os.path.dirname(MODEL_SAVE_PATH), exist_ok=True)
     os.makedirs(os.path.dirname(PLOT_SAVE_PATH), exist_ok=True)
 
     # 2. Load dữ liệu
     print("[INFO] Đang tải dữ liệu training...")
-    data = get_training_data(DATA_PATH)
+    data = get_training_data(DATA_PATH, clip_length=CLIP_LENGTH)
     
     if data is None or len(data) == 0:
         print("[ERROR] Không tìm thấy dữ liệu. Hãy kiểm tra lại folder data!")
         return
 
-    # Shuffle dữ liệu để train tốt hơn
-    np.random.shuffle(data)
+    if STREAMING:
+        # Chia train/val theo video, shuffle bằng bộ đệm giới hạn, prefetch
+        train_ds, val_ds = make_train_val_datasets(data, BATCH_SIZE)
+        fit_kwargs = {"x": train_ds, "validation_data": val_ds}
+        steps_per_epoch = int(train_ds.cardinality())
+        train_samples = sum(len(a) for a in split_sources(data)[0])
+    else:
+        # Shuffle dữ liệu để train tốt hơn (xáo chỉ số, data là view lazy trên cache)
+        perm = np.random.permutation(len(data))
 
-    # Chia tập train/validation (80% train, 20% validate)
-    split_idx = int(len(data) * 0.8)
-    train_data = data[:split_idx]
-    val_data = data[split_idx:]
-    
-    print(f"[INFO] Training samples: {len(train_data)}")
-    print(f"[INFO] Validation samples: {len(val_data)}")
+        # Chia tập train/validation (80% train, 20% validate)
+        split_idx = int(len(data) * 0.8)
+        train_data = data[perm[:split_idx]]
+        val_data = data[perm[split_idx:]]
+        
+        print(f"[INFO] Training samples: {len(train_data)}")
+        print(f"[INFO] Validation samples: {len(val_data)}")
+        fit_kwargs = {"x": train_data, "y": train_data, "batch_size": BATCH_SIZE,
+                      "shuffle": True, "validation_data": (val_data, val_data)}
+        steps_per_epoch = int(np.ceil(len(train_data) / BATCH_SIZE))
+        train_samples = len(train_data)
 
     # 3. Xây dựng model
     print("[INFO] Đang khởi tạo model...")
-    model = build_autoencoder()
+    input_shape = (128, 128, CLIP_LENGTH)
+    model = build_autoencoder(input_shape=input_shape,
+                              learning_rate=make_learning_rate(steps_per_epoch, EPOCHS, BATCH_SIZE),
+                              jit_compile=JIT_COMPILE, mixed_precision=MIXED_PRECISION)
+    manifest = load_manifest()
+    initial_epoch = 0
+    if RESUME and os.path.exists(STATE_PATH) and manifest.get("epochs_done"):
+        # Tiếp tục đúng chỗ dừng: trọng số, moment của Adam và bước của lịch learning rate
+        model.load_weights(STATE_PATH)
+        load_optimizer_state(model)
+        initial_epoch = manifest["epochs_done"]
+        print(f"[INFO] Tiếp tục từ {STATE_PATH} (đã xong {initial_epoch} epoch)")
+        if initial_epoch >= EPOCHS:
+            print(f"[INFO] Đã train đủ {EPOCHS} epoch. Tăng EPOCHS để train tiếp.")
+            return
+    else:
+        manifest = {}
+    manifest["sources"] = source_manifest(data)
 
     # 4. Cấu hình Callbacks (Tự động lưu model tốt nhất)
     checkpoint = ModelCheckpoint(MODEL_SAVE_PATH, monitor='val_loss', verbose=1, 
-                                 save_best_only=True, mode='min')
+                                 save_best_only=True, mode='min',
+                                 initial_value_threshold=manifest.get("best_val_loss"))
     early_stopping = EarlyStopping(monitor='val_loss', patience=5, verbose=1)
+    throughput = ThroughputLogger(BATCH_SIZE, train_samples)
+    state = TrainState(manifest)
 
     # 5. Bắt đầu Training
-    # Lưu ý: input là train_data, target cũng là train_data (vì là Autoencoder)
+    # Lưu ý: input cũng chính là target (vì là Autoencoder)
     print("[INFO] Bắt đầu train (Đi pha cà phê đợi xíu)...")
     history = model.fit(
-        train_data, train_data,
         epochs=EPOCHS,
-        batch_size=BATCH_SIZE,
-        shuffle=True,
-        validation_data=(val_data, val_data),
-        callbacks=[checkpoint, early_stopping]
+        initial_epoch=initial_epoch,
+        callbacks=[checkpoint, early_stopping, throughput, state],
+        **fit_kwargs
     )
 
-    # 6. Vẽ biểu đồ Loss
+    if MIXED_PRECISION and os.path.exists(MODEL_SAVE_PATH):
+        # Lưu lại checkpoint tốt nhất dưới dạng float32 (tflite/onnx/int8 export như cũ)
+        to_float32(load_model(MODEL_SAVE_PATH, compile=False), input_shape).save(MODEL_SAVE_PATH)
+
+    # 6. Báo cáo thông lượng (cạnh training_plot.png)
+    config = {"batch_size": BATCH_SIZE, "epochs_run": len(throughput.epochs), "jit_compile": JIT_COMPILE,
+              "mixed_precision": MIXED_PRECISION, "lr_schedule": LR_SCHEDULE,
+              "peak_lr": float(BASE_LR * np.sqrt(BATCH_SIZE / BASE_BATCH_SIZE)),
+              "intra_op_threads": INTRA_OP_THREADS, "inter_op_threads": INTER_OP_THREADS,
+              "cpu_count": os.cpu_count(), "train_samples": train_samples, "steps_per_epoch": steps_per_epoch}
+    report = throughput.report(config)
+    with open(THROUGHPUT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[KẾT QUẢ] {report['steady_samples_per_s']:.0f} mẫu/s, {report['mean_epoch_s']:.1f}s/epoch")
+    print(f"[SUCCESS] Đã lưu báo cáo thông lượng tại: {THROUGHPUT_PATH}")
+
+    # 7. Vẽ biểu đồ Loss
     print("[INFO] Đang vẽ biểu đồ training loss...")
     plt.figure()
     plt.plot(history.history['loss'], label='Training Loss')
@@ -0,0 +1,101 @@
+import os
+import wave
+import shutil
+import subprocess
+import cv2
+import numpy as np
+
+# --- CẤU HÌNH ---
+SAMPLE_RATE = 44100
+ALERT_FREQ = 800        # Hz, tiếng bíp khi frame bất thường
+ALERT_VOLUME = 1.0      # Biên độ (1.0 = tối đa, như bản moviepy cũ)
+X264_PRESET = "veryfast"
+X264_CRF = 23
+
+def ffmpeg_exe():
+    """Đường dẫn ffmpeg: bản đi kèm imageio-ffmpeg (cài cùng moviepy) hoặc ffmpeg trong PATH."""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg")
+
+class FFmpegWriter:
+    """
+    Ghi frame BGR thẳng vào MỘT tiến trình ffmpeg (libx264) qua pipe.
+    Cùng giao diện write/release với cv2.VideoWriter; video ra đã là H.264
+    nên chỉ cần ghép audio mà không phải encode lại.
+    """
+    def __init__(self, path, fps, size, exe=None):
+        width, height = size
+        cmd = [exe or ffmpeg_exe(), "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps),
+               "-i", "-", "-an", "-c:v", "libx264", "-preset", X264_PRESET, "-crf", str(X264_CRF),
+               "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+        if width % 2 or height % 2:
+            # yuv420p cần kích thước chẵn
+            cmd += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        self.proc = subprocess.Popen(cmd + [path], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg dừng bất thường: {self.proc.stderr.read().decode(errors='ignore')}")
+
+    def release(self):
+        if self.proc.stdin.closed:
+            return
+        self.proc.stdin.close()
+        err = self.proc.stderr.read().decode(errors="ignore")
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg lỗi khi encode: {err}")
+
+def open_writer(path, fps, size):
+    """FFmpegWriter nếu có ffmpeg, ngược lại cv2.VideoWriter (mp4v) như cũ."""
+    exe = ffmpeg_exe()
+    if exe:
+        return FFmpegWriter(path, fps, size, exe)
+    print("[WARNING] Không tìm thấy ffmpeg, dùng cv2.VideoWriter (mp4v).")
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+def alert_tone(timeline, fps, sample_rate=SAMPLE_RATE, freq=ALERT_FREQ):
+    """
+    PCM int16 mono cho cả video, tính một lần bằng NumPy:
+    tiếng bíp ở các frame bất thường (timeline[i] = True), im lặng ở các frame khác.
+    """
+    timeline = np.asarray(timeline, dtype=bool)
+    n_samples = int(round(len(timeline) / fps * sample_rate))
+    t = np.arange(n_samples) / sample_rate
+    mask = timeline[np.clip((t * fps).astype(int), 0, len(timeline) - 1)]
+    pcm = np.zeros(n_samples, dtype=np.int16)
+    pcm[mask] = (ALERT_VOLUME * 32767 * np.sin(2 * np.pi * freq * t[mask])).astype(np.int16)
+    return pcm
+
+def write_wav(path, pcm, sample_rate=SAMPLE_RATE):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+def mux_audio(video_path, wav_path, out_path, exe=None):
+    """Ghép audio vào video: copy nguyên luồng video (-c:v copy), chỉ encode audio AAC."""
+    cmd = [exe or ffmpeg_exe(), "-y", "-loglevel", "error", "-i", video_path, "-i", wav_path,
+           "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac",
+           "-movflags", "+faststart", out_path]
+    result = subprocess.run(cmd, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg lỗi khi ghép audio: {result.stderr.decode(errors='ignore')}")
+
+def add_alert_audio(video_path, out_path, timeline, fps):
+    """Tạo tiếng cảnh báo từ timeline và ghép vào video đã encode (không encode lại video)."""
+    wav_path = os.path.splitext(out_path)[0] + "_alert.wav"
+    write_wav(wav_path, alert_tone(timeline, fps))
+    try:
+        mux_audio(video_path, wav_path, out_path)
+    finally:
+        os.remove(wav_path)